@@ -1,5 +1,13 @@
-# This will make sure the app is always imported when
-# Django starts so that shared_task will use this app.
-from .celery import app as celery_app
+# The Celery app is created on first use rather than when Django starts: processes that never
+# publish or run a task, e.g. most manage.py commands, do not pay for importing Celery.
+# weather_app.tasks imports it, so shared_task uses this app wherever tasks are sent.
 
-__all__ = ('celery_app',)
\ No newline at end of file
+
+def __getattr__(name):
+    if name == 'celery_app':
+        from .celery import app
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+__all__ = ('celery_app',)
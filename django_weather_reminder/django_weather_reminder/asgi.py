@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_weather_reminder.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up by get_asgi_application
+from weather_app.live import DisconnectMiddleware  # noqa: E402
+
+application = DisconnectMiddleware(django_application)
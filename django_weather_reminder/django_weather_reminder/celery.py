@@ -3,6 +3,7 @@ from datetime import timedelta
 
 from celery import Celery
 from django.conf import settings
+from kombu import Queue
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_weather_reminder.settings')
@@ -19,6 +20,39 @@ CELERY_BEAT_SCHEDULE = {
     'send_weather_emails': {'task': 'weather_app.tasks.send_weather_forecast_task', 'schedule': timedelta(minutes=1),
                             'args': []}, }
 
+# Queue topology. Network-bound work (upstream API calls, SMTP, webhooks) runs on the
+# fetch, mail and webhook queues, served by gevent workers; rendering and scheduling run
+# on prefork workers. See the worker services in docker-compose.prod.yaml.
+# Every network call made by these tasks has a timeout, so they are safe to run as green threads.
+# The module-level state they share (the weather provider thread pool and latency window, the
+# write-behind buffer, the per-process caches) is guarded by locks, which gevent patches.
+# On Redis lower priority numbers are consumed first.
+app.conf.task_queues = (Queue('celery'), Queue('fetch'), Queue('render'), Queue('mail'), Queue('webhook'), )
+app.conf.task_default_queue = 'celery'
+app.conf.task_default_priority = 5
+app.conf.task_routes = {
+    'weather_app.tasks.send_weather_forecast_task': {'queue': 'celery', 'priority': 0},
+    'weather_app.tasks.send_webhook_notification_task': {'queue': 'celery', 'priority': 0},
+    'weather_app.tasks.warm_weather_cache_task': {'queue': 'celery', 'priority': 1},
+    'weather_app.tasks.get_city_coordinates_task': {'queue': 'fetch', 'priority': 2},
+    'weather_app.tasks.get_city_weather_task': {'queue': 'fetch', 'priority': 2},
+    'weather_app.tasks.refresh_city_weather_task': {'queue': 'fetch', 'priority': 3},
+    'weather_app.tasks.send_city_forecasts_task': {'queue': 'celery', 'priority': 1},
+    'weather_app.tasks.render_forecast_task': {'queue': 'render', 'priority': 4},
+    'weather_app.tasks.send_forecast_mail_task': {'queue': 'mail', 'priority': 6},
+    'weather_app.tasks.send_mail_task': {'queue': 'mail', 'priority': 6},
+    'weather_app.tasks.send_webhook_notification': {'queue': 'webhook', 'priority': 8},
+}
+app.conf.broker_transport_options = {'priority_steps': list(range(10)), 'sep': ':', 'queue_order_strategy': 'priority'}
+# Reserve one task at a time so priorities are honoured and a slow task does not hold a prefetched backlog.
+app.conf.worker_prefetch_multiplier = 1
+
+# Static entries are synced into the database by the DatabaseScheduler when beat starts.
+app.conf.beat_schedule = {
+    'warm_weather_cache': {'task': 'weather_app.tasks.warm_weather_cache_task', 'schedule': timedelta(minutes=1)},
+    'compact_deliveries': {'task': 'weather_app.tasks.compact_deliveries_task', 'schedule': timedelta(days=1)},
+}
+
 app.autodiscover_tasks()
 
 if settings.DEBUG:
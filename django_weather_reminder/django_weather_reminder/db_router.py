@@ -0,0 +1,118 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+@contextmanager
+def use_replica(enabled: bool = True):
+    """
+    Route the reads made inside the block to a replica, e.g. for exports run from the command line.
+    """
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Send reads to one of the REPLICA_DATABASES while ``use_replica`` is active, everything else to default.
+
+    Nothing is routed to a replica unless a request or command opted in, so celery tasks,
+    the schedulers and every write keep reading their own writes from the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if settings.REPLICA_DATABASES and _use_replica.get():
+            return random.choice(settings.REPLICA_DATABASES)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve the reads of safe-method requests from replicas.
+
+    After a client makes a non-safe request it is pinned to the primary for REPLICA_PIN_SECONDS,
+    so it reads its own writes while the replicas catch up. Clients are told apart by their
+    Authorization header or session cookie, and by address when they have neither.
+    Writes that hand out credentials, e.g. a JWT or a new session, also pin the identity the
+    client uses from then on, see ``pinned_keys``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def identity_key(identity: str) -> str:
+        return 'db:pinned:' + hashlib.sha256(identity.encode()).hexdigest()
+
+    @classmethod
+    def client_key(cls, request) -> str:
+        return cls.identity_key(request.META.get('HTTP_AUTHORIZATION')
+                                or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+                                or request.META.get('REMOTE_ADDR', ''))
+
+    @classmethod
+    def pinned_keys(cls, request, response) -> dict:
+        """
+        Return the keys to pin after a non-safe request: the client's, and those of the access token
+        or session cookie the response hands out, under which the client's next requests arrive.
+        """
+        keys = [cls.client_key(request)]
+        data = getattr(response, 'data', None)
+        if isinstance(data, dict) and data.get('access'):
+            keys += [cls.identity_key(f'{header_type} {data["access"]}')
+                     for header_type in settings.SIMPLE_JWT['AUTH_HEADER_TYPES']]
+        session = response.cookies.get(settings.SESSION_COOKIE_NAME)
+        if session is not None and session.value:
+            keys.append(cls.identity_key(session.value))
+        return dict.fromkeys(keys, True)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+        key = self.client_key(request)
+        safe = request.method in SAFE_METHODS
+        with use_replica(safe and not cache.get(key)):
+            response = self.get_response(request)
+        if not safe:
+            cache.set_many(self.pinned_keys(request, response), settings.REPLICA_PIN_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return await self.get_response(request)
+        key = self.client_key(request)
+        safe = request.method in SAFE_METHODS
+        with use_replica(safe and not await cache.aget(key)):
+            response = await self.get_response(request)
+        if not safe:
+            await cache.aset_many(self.pinned_keys(request, response), settings.REPLICA_PIN_SECONDS)
+        return response
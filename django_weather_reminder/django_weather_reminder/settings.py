@@ -13,8 +13,6 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
-from django_weather_reminder.celery import app
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -47,11 +45,18 @@ INSTALLED_APPS = [
     'celery',
     'django_celery_beat',
     'django_celery_results',
-    'drf_yasg',
 ]
+# API schema and docs (drf_yasg, swagger and redoc). Off for the processes that serve no API, e.g. the workers,
+# as loading them is a large part of the startup time
+API_DOCS = bool(int(os.environ.get("API_DOCS", 1)))
+if API_DOCS:
+    INSTALLED_APPS.append('drf_yasg')
+# Startup budget checked by the profile_startup command, in milliseconds
+STARTUP_BUDGET_MS = int(os.environ.get("STARTUP_BUDGET_MS", 2000))
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'django_weather_reminder.db_router.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -91,6 +96,23 @@ DATABASES = {"default": {"ENGINE": os.environ.get("SQL_ENGINE", "django.db.backe
                          "PASSWORD": os.environ.get("SQL_PASSWORD", "password"),
                          "HOST": os.environ.get("SQL_HOST", "localhost"), "PORT": os.environ.get("SQL_PORT", "5432"), }}
 
+# Read replicas, a comma separated list of hosts sharing the credentials of the primary.
+# Safe-method API reads go to a replica, clients are pinned to the primary for
+# REPLICA_PIN_SECONDS after their own writes.
+REPLICA_DATABASES = []
+for index, host in enumerate(host for host in os.environ.get("SQL_REPLICA_HOSTS", "").split(",") if host):
+    DATABASES[f"replica_{index}"] = {**DATABASES["default"], "HOST": host.strip(), "TEST": {"MIRROR": "default"}}
+    REPLICA_DATABASES.append(f"replica_{index}")
+DATABASE_ROUTERS = ['django_weather_reminder.db_router.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", 5))
+
+# Cache, Redis when CACHE_URL is set
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHE_URL = os.environ.get("CACHE_URL")
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": CACHE_URL} if CACHE_URL
+          else {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -142,23 +164,153 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'weather_app.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
-
+    'DEFAULT_RENDERER_CLASSES': [
+        'weather_app.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'weather_app.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# List endpoints build their responses from .values() rows instead of serializer instances
+API_FAST_LIST = bool(int(os.environ.get("API_FAST_LIST", 0)))
+
+# Users of JWT requests are resolved through a per-process cache and the shared cache, in seconds
+AUTH_USER_LOCAL_CACHE_TTL = float(os.environ.get("AUTH_USER_LOCAL_CACHE_TTL", 5))
+AUTH_USER_LOCAL_CACHE_SIZE = int(os.environ.get("AUTH_USER_LOCAL_CACHE_SIZE", 1024))
+AUTH_USER_CACHE_TTL = int(os.environ.get("AUTH_USER_CACHE_TTL", 60))
+
 #for finish app add this element
     # 'DEFAULT_RENDERER_CLASS': [
     #     'rest_framework.renderers.JSONRenderer',
     #     'rest_framework.renderers.BrowserRenderer',
     # ],
 
+# Bulk subscription management
+BULK_SUBSCRIPTIONS_MAX_ITEMS = int(os.environ.get("BULK_SUBSCRIPTIONS_MAX_ITEMS", 10000))
+BULK_SUBSCRIPTIONS_CHUNK_SIZE = int(os.environ.get("BULK_SUBSCRIPTIONS_CHUNK_SIZE", 1000))
+
+# Batch geocoding: names per request, upstream geocoding calls per minute shared by all processes,
+# and geocoding calls one request keeps in flight
+GEOCODE_BATCH_MAX_ITEMS = int(os.environ.get("GEOCODE_BATCH_MAX_ITEMS", 1000))
+GEOCODE_RATE_LIMIT = int(os.environ.get("GEOCODE_RATE_LIMIT", 60))
+GEOCODE_CONCURRENCY = int(os.environ.get("GEOCODE_CONCURRENCY", 10))
+
+# Streaming weather history export
+WEATHER_EXPORT_CHUNK_SIZE = int(os.environ.get("WEATHER_EXPORT_CHUNK_SIZE", 2000))
+
 # Weather API and key
 WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY", "364be1b70859b8416d16006f5e875b94")
 GEO_URL = 'https://api.openweathermap.org/geo/1.0/direct'
 WEATHER_URL = 'https://api.openweathermap.org/data/2.5/weather'
+WEATHER_API_TIMEOUT = float(os.environ.get("WEATHER_API_TIMEOUT", 5))
+WEATHER_CACHE_TIMEOUT = int(os.environ.get("WEATHER_CACHE_TIMEOUT", 300))
+# Weather providers in order of preference, by name (openweathermap, open-meteo) or dotted path of a WeatherProvider
+WEATHER_PROVIDERS = os.environ.get("WEATHER_PROVIDERS", "openweathermap").split(",")
+OPEN_METEO_URL = 'https://api.open-meteo.com/v1/forecast'
+OPEN_METEO_GEO_URL = 'https://geocoding-api.open-meteo.com/v1/search'
+# Hedged requests: the second provider is asked when the first has not answered within the
+# WEATHER_HEDGE_PERCENTILE of its last WEATHER_HEDGE_WINDOW latencies (WEATHER_HEDGE_DELAY seconds until
+# WEATHER_HEDGE_MIN_SAMPLES are known, never less than WEATHER_HEDGE_MIN_DELAY) or has failed. Calls run on
+# WEATHER_HEDGE_THREADS threads per process, at most half of them calling the first provider
+WEATHER_HEDGE_PERCENTILE = float(os.environ.get("WEATHER_HEDGE_PERCENTILE", 95))
+WEATHER_HEDGE_DELAY = float(os.environ.get("WEATHER_HEDGE_DELAY", 1))
+WEATHER_HEDGE_MIN_DELAY = float(os.environ.get("WEATHER_HEDGE_MIN_DELAY", 0.05))
+WEATHER_HEDGE_WINDOW = int(os.environ.get("WEATHER_HEDGE_WINDOW", 200))
+WEATHER_HEDGE_MIN_SAMPLES = int(os.environ.get("WEATHER_HEDGE_MIN_SAMPLES", 20))
+WEATHER_HEDGE_THREADS = int(os.environ.get("WEATHER_HEDGE_THREADS", 32))
+# Circuit breaker of each weather provider: opened after UPSTREAM_FAILURE_THRESHOLD consecutive failures, probed
+# again after UPSTREAM_RECOVERY_TIMEOUT. Meanwhile the latest reading stored within UPSTREAM_FALLBACK_MAX_AGE
+# is served, marked stale
+UPSTREAM_FAILURE_THRESHOLD = int(os.environ.get("UPSTREAM_FAILURE_THRESHOLD", 5))
+UPSTREAM_RECOVERY_TIMEOUT = timedelta(seconds=int(os.environ.get("UPSTREAM_RECOVERY_TIMEOUT", 30)))
+UPSTREAM_FALLBACK_MAX_AGE = timedelta(seconds=int(os.environ.get("UPSTREAM_FALLBACK_MAX_AGE", 6 * 3600)))
+# Route the async views; off for the WSGI processes, which do not serve them, to skip loading their HTTP client
+ASYNC_VIEWS = bool(int(os.environ.get("ASYNC_VIEWS", 1)))
+# Upstream connections one ASGI process keeps in flight for the async views
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.environ.get("ASYNC_HTTP_MAX_CONNECTIONS", 1000))
+
+# Write-behind buffer of fetched readings, flushed with one bulk_create when it holds WEATHER_WRITE_BUFFER_SIZE
+# readings or after WEATHER_WRITE_BUFFER_DELAY seconds. 1 writes through. Buffered readings are not visible
+# to the stale-while-revalidate and cache warming lookups until flushed, so keep the delay short.
+WEATHER_WRITE_BUFFER_SIZE = int(os.environ.get("WEATHER_WRITE_BUFFER_SIZE", 1))
+WEATHER_WRITE_BUFFER_DELAY = float(os.environ.get("WEATHER_WRITE_BUFFER_DELAY", 1))
+# Readings that failed to be written are kept and retried with the next flush, the oldest are dropped beyond
+# WEATHER_WRITE_BUFFER_MAX_BACKLOG readings
+WEATHER_WRITE_BUFFER_MAX_BACKLOG = int(os.environ.get("WEATHER_WRITE_BUFFER_MAX_BACKLOG", 1000))
+
+# Stale-while-revalidate: stored readings younger than WEATHER_SERVE_STALE_AFTER are served as they are,
+# readings up to WEATHER_SERVE_STALE_FOR old are served immediately while one background refresh runs.
+WEATHER_SERVE_STALE = bool(int(os.environ.get("WEATHER_SERVE_STALE", 1)))
+WEATHER_SERVE_STALE_AFTER = timedelta(seconds=int(os.environ.get("WEATHER_SERVE_STALE_AFTER", 300)))
+WEATHER_SERVE_STALE_FOR = timedelta(seconds=int(os.environ.get("WEATHER_SERVE_STALE_FOR", 3600)))
+# Live weather stream: stored readings are published on Redis pub/sub at LIVE_UPDATES_URL (disabled when unset);
+# idle streams get a comment every LIVE_UPDATES_HEARTBEAT seconds and clients reconnect after LIVE_UPDATES_RETRY_MS
+LIVE_UPDATES_URL = os.environ.get("LIVE_UPDATES_URL")
+LIVE_UPDATES_TIMEOUT = float(os.environ.get("LIVE_UPDATES_TIMEOUT", 1))
+LIVE_UPDATES_HEARTBEAT = float(os.environ.get("LIVE_UPDATES_HEARTBEAT", 15))
+LIVE_UPDATES_RETRY_MS = int(os.environ.get("LIVE_UPDATES_RETRY_MS", 3000))
+# Streams end after LIVE_UPDATES_MAX_AGE seconds (keep it below the proxy_read_timeout of nginx) and buffer
+# at most LIVE_UPDATES_QUEUE_SIZE readings; stream tickets are valid for LIVE_UPDATES_TICKET_TTL seconds
+LIVE_UPDATES_MAX_AGE = float(os.environ.get("LIVE_UPDATES_MAX_AGE", 1800))
+LIVE_UPDATES_QUEUE_SIZE = int(os.environ.get("LIVE_UPDATES_QUEUE_SIZE", 100))
+LIVE_UPDATES_TICKET_TTL = int(os.environ.get("LIVE_UPDATES_TICKET_TTL", 30))
+# Cities one multi-city current weather request may ask for
+WEATHER_BATCH_MAX_ITEMS = int(os.environ.get("WEATHER_BATCH_MAX_ITEMS", 100))
+WEATHER_REFRESH_LOCK_TIMEOUT = int(os.environ.get("WEATHER_REFRESH_LOCK_TIMEOUT", 60))
+
+# Cache warming: the weather of cities with notifications due within WEATHER_WARM_LEAD is pre-fetched,
+# using at most WEATHER_WARM_RATE_SHARE of the upstream budget of WEATHER_API_RATE_LIMIT calls per minute.
+# Keep WEATHER_WARM_LEAD below WEATHER_SERVE_STALE_AFTER so warmed readings are still fresh when sent.
+WEATHER_API_RATE_LIMIT = int(os.environ.get("WEATHER_API_RATE_LIMIT", 60))
+WEATHER_WARM_LEAD = timedelta(seconds=int(os.environ.get("WEATHER_WARM_LEAD", 240)))
+WEATHER_WARM_RATE_SHARE = float(os.environ.get("WEATHER_WARM_RATE_SHARE", 0.5))
+
+# Subscriptions of a city falling due within this many seconds are sent (or suppressed) in one batch
+WEATHER_NOTIFY_BATCH_DELAY = int(os.environ.get("WEATHER_NOTIFY_BATCH_DELAY", 5))
+# Dispatch backpressure: the degradation level (1 coalesce, 2 drop superseded sends, 3 digest) is the number of
+# thresholds crossed by the broker queue depth (messages) or the latency of started tasks (seconds),
+# sampled at most every BACKPRESSURE_SAMPLE_INTERVAL seconds
+BACKPRESSURE_DEPTH_THRESHOLDS = tuple(
+    int(value) for value in os.environ.get("BACKPRESSURE_DEPTH_THRESHOLDS", "5000,20000,100000").split(","))
+BACKPRESSURE_LATENCY_THRESHOLDS = tuple(
+    float(value) for value in os.environ.get("BACKPRESSURE_LATENCY_THRESHOLDS", "30,120,600").split(","))
+BACKPRESSURE_SAMPLE_INTERVAL = int(os.environ.get("BACKPRESSURE_SAMPLE_INTERVAL", 10))
+# When coalescing, WEATHER_NOTIFY_BATCH_DELAY is multiplied by this factor
+BACKPRESSURE_COALESCE_FACTOR = int(os.environ.get("BACKPRESSURE_COALESCE_FACTOR", 6))
+# In digest mode a subscriber gets at most one forecast per this many minutes
+BACKPRESSURE_DIGEST_PERIOD = int(os.environ.get("BACKPRESSURE_DIGEST_PERIOD", 180))
+# Days the notification delivery ledger is kept
+DELIVERY_RETENTION_DAYS = int(os.environ.get("DELIVERY_RETENTION_DAYS", 30))
+
+# Subscription scheduling: 'beat' keeps one periodic task per subscription in celery-beat, 'sharded' lets
+# any number of run_scheduler instances lease SCHEDULER_PARTITIONS partitions of the subscriptions
+# and dispatch their due sets every SCHEDULER_TICK seconds.
+SUBSCRIPTION_SCHEDULER = os.environ.get("SUBSCRIPTION_SCHEDULER", "beat")
+SCHEDULER_PARTITIONS = int(os.environ.get("SCHEDULER_PARTITIONS", 64))
+SCHEDULER_LEASE_TIMEOUT = timedelta(seconds=int(os.environ.get("SCHEDULER_LEASE_TIMEOUT", 30)))
+SCHEDULER_TICK = float(os.environ.get("SCHEDULER_TICK", 5))
+SCHEDULER_BATCH_SIZE = int(os.environ.get("SCHEDULER_BATCH_SIZE", 5000))
+
+# Requests for coordinates within this distance of a known city are served as that city
+CITY_SNAP_RADIUS_KM = float(os.environ.get("CITY_SNAP_RADIUS_KM", 10))
+# The city index loads new cities every CITY_INDEX_REFRESH_INTERVAL seconds and reloads all of them every
+# CITY_INDEX_FULL_REFRESH_INTERVAL seconds
+CITY_INDEX_REFRESH_INTERVAL = int(os.environ.get("CITY_INDEX_REFRESH_INTERVAL", 60))
+CITY_INDEX_FULL_REFRESH_INTERVAL = int(os.environ.get("CITY_INDEX_FULL_REFRESH_INTERVAL", 3600))
+
+# Webhook delivery and the per-endpoint circuit breaker
+WEBHOOK_TIMEOUT = float(os.environ.get("WEBHOOK_TIMEOUT", 5))
+WEBHOOK_FAILURE_THRESHOLD = int(os.environ.get("WEBHOOK_FAILURE_THRESHOLD", 3))
+WEBHOOK_RECOVERY_TIMEOUT = timedelta(seconds=int(os.environ.get("WEBHOOK_RECOVERY_TIMEOUT", 300)))
+WEBHOOK_AUTO_PAUSE_AFTER = timedelta(hours=int(os.environ.get("WEBHOOK_AUTO_PAUSE_AFTER", 24)))
 
 # configure JWT token
 SIMPLE_JWT = {
@@ -201,8 +353,6 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",
 }
 # config celery
-app.conf.broker_url = 'redis://redis:6379/0'
-
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
@@ -0,0 +1,22 @@
+import pytest
+from django.core.cache import cache
+
+from weather_app.authentication import local_user_cache
+from weather_app.providers import primary_latencies
+from weather_app.spatial import city_index
+
+
+@pytest.fixture(autouse=True)
+def clean_process_state():
+    """
+    Fixture that empties the process-wide city index, user cache, provider latencies and cache, which outlive the test database.
+    """
+    city_index.clear()
+    local_user_cache.clear()
+    primary_latencies.clear()
+    cache.clear()
+    yield
+    city_index.clear()
+    local_user_cache.clear()
+    primary_latencies.clear()
+    cache.clear()
@@ -0,0 +1,43 @@
+import httpx
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import AsyncClient
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from weather_app.models import City, Weather
+
+WEATHER_RESPONSE = {'name': 'Test City', 'weather': [{'description': 'Sunny'}],
+                    'main': {'temp': 25.0, 'pressure': 1013.0, 'humidity': 50.0},
+                    'clouds': {'all': 0}, 'wind': {'speed': 10.0}}
+
+
+@pytest.mark.django_db
+def test_async_weather_list_view(monkeypatch):
+    """
+    Test that the async weather endpoint requires a JWT, fetches through the async client and stores the reading.
+    """
+    city = City.objects.create(name='Test City', lat=50.4501, lon=30.5234)
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=WEATHER_RESPONSE)
+
+    monkeypatch.setattr('weather_app.async_utils.get_client',
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    token = RefreshToken.for_user(User.objects.create(username='testuser')).access_token
+    client = AsyncClient()
+    url = reverse('async-weather-list')
+
+    response = async_to_sync(client.get)(url, {'lat': 50.451, 'lon': 30.524})
+    assert response.status_code == 401
+
+    response = async_to_sync(client.get)(url, {'lat': 50.451, 'lon': 30.524},
+                                         headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert response.json()['city'] == city.id
+    assert response.json()['description'] == 'Sunny'
+    assert len(requests) == 1
+    assert Weather.objects.filter(city=city).count() == 1
@@ -0,0 +1,51 @@
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from weather_app.authentication import CachedJWTAuthentication, user_cache_key
+
+
+@pytest.mark.django_db
+def test_cached_jwt_authentication():
+    """
+    Test that the user of a token is only queried once, and that deactivating the user takes effect at once.
+    """
+    user = User.objects.create(username='testuser')
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+    url = reverse('subscribedcity-list')
+
+    with CaptureQueriesContext(connection) as queries:
+        assert client.get(url).status_code == status.HTTP_200_OK
+        assert client.get(url).status_code == status.HTTP_200_OK
+    assert sum('FROM "auth_user"' in query['sql'] for query in queries) == 1
+
+    user.is_active = False
+    user.save()
+    assert client.get(url).status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_cached_user_has_no_password(monkeypatch):
+    """
+    Test that the cached user is loaded from the primary database and keeps only the fields the checks need.
+    """
+    user = User.objects.create_user(username='testuser', email='test@example.com', password='secret')
+    used = []
+    monkeypatch.setattr('weather_app.authentication.router.db_for_write', lambda model: used.append(model) or 'default')
+    authentication = CachedJWTAuthentication()
+    token = authentication.get_validated_token(str(RefreshToken.for_user(user).access_token).encode())
+
+    cached = authentication.get_user(token)
+    assert used == [User]
+    assert (cached.pk, cached.username, cached.email) == (user.pk, 'testuser', 'test@example.com')
+    entry = cache.get(user_cache_key(user.pk))
+    assert user.password not in repr(entry)
+    assert 'password' in cached.get_deferred_fields()
+    assert cached.check_password('secret')
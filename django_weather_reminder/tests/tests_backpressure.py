@@ -0,0 +1,94 @@
+import time
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.utils import timezone
+
+from weather_app import backpressure, metrics
+from weather_app.deliveries import delivery_slot
+from weather_app.models import City, NotificationDelivery, SubscribedCity, Weather
+from weather_app.tasks import send_city_forecasts_task, send_forecast_mail_task
+
+WEATHER_DATA = {'description': 'Sunny', 'temp': 25.0, 'pressure': 1013.0, 'humidity': 50.0, 'clouds': 0,
+                'wind_speed': 10.0}
+
+
+def test_degradation_level_from_depth_and_latency(monkeypatch, settings):
+    """
+    Test that the level is the number of thresholds crossed by the queue depth or the task latency,
+    that it is reported as a metric and sampled once per interval.
+    """
+    settings.BACKPRESSURE_DEPTH_THRESHOLDS = (10, 100, 1000)
+    settings.BACKPRESSURE_LATENCY_THRESHOLDS = (1, 10, 100)
+    monkeypatch.setattr(backpressure, 'sample_queue_depth', lambda: 150)
+
+    assert backpressure.degradation_level() == backpressure.DROP_SUPERSEDED
+    assert metrics.read(metrics.DEGRADATION_LEVEL)['value'] == backpressure.DROP_SUPERSEDED
+    assert metrics.read(metrics.BROKER_QUEUE_DEPTH)['value'] == 150
+
+    metrics.gauge(metrics.TASK_QUEUE_LATENCY, 500)
+    assert backpressure.degradation_level() == backpressure.DROP_SUPERSEDED
+    cache.delete(backpressure.LEVEL_CACHE_KEY)
+    assert backpressure.degradation_level() == backpressure.DIGEST
+
+
+@pytest.mark.django_db
+def test_superseded_send_dropped_under_backpressure():
+    """
+    Test that a queued send is dropped once a later slot of its subscription was claimed,
+    only while the dispatch is degraded.
+    """
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    subscription = SubscribedCity.objects.create(user=User.objects.create(username='user', email='user@example.com'),
+                                                 city=city, period_notifications=60)
+    slot = delivery_slot(60, timezone.now())
+    old, new = (NotificationDelivery.objects.create(subscription=subscription, slot=slot + timedelta(hours=hours),
+                                                    claim_token='00000000-0000-0000-0000-000000000000')
+                for hours in (-1, 0))
+
+    cache.set(backpressure.LEVEL_CACHE_KEY, backpressure.DROP_SUPERSEDED)
+    send_forecast_mail_task('Forecast', 'user@example.com', old.id)
+    send_forecast_mail_task('Forecast', 'user@example.com', new.id)
+
+    assert len(mail.outbox) == 1
+    old.refresh_from_db()
+    assert old.status == NotificationDelivery.SUPERSEDED
+
+
+@pytest.mark.django_db
+def test_digest_mode_skips_recently_notified():
+    """
+    Test that in digest mode subscribers notified within BACKPRESSURE_DIGEST_PERIOD are skipped.
+    """
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    Weather.objects.create(city=city, **WEATHER_DATA)
+    subscription = SubscribedCity.objects.create(user=User.objects.create(username='user', email='user@example.com'),
+                                                 city=city, period_notifications=1)
+    assert send_city_forecasts_task(city.id, [subscription.id]) == 1
+    NotificationDelivery.objects.update(slot=timezone.now() - timedelta(minutes=5))
+
+    cache.set(backpressure.LEVEL_CACHE_KEY, backpressure.DIGEST)
+    assert send_city_forecasts_task(city.id, [subscription.id]) == 0
+    cache.set(backpressure.LEVEL_CACHE_KEY, backpressure.NORMAL)
+    assert send_city_forecasts_task(city.id, [subscription.id]) == 1
+
+
+def test_queue_latency_starts_at_eta():
+    """
+    Test that the queue latency of a task with a countdown is measured from when it is due, not when it is published.
+    """
+    headers = {'eta': (timezone.now() + timedelta(seconds=240)).isoformat()}
+    backpressure.stamp_due_at(headers=headers)
+    assert headers[backpressure.LATENCY_HEADER] > time.time() + 230
+
+    class Task:
+        request = type('Request', (), {backpressure.LATENCY_HEADER: time.time() - 2})
+
+    backpressure.record_queue_latency(task=Task)
+    assert 2 <= metrics.read(metrics.TASK_QUEUE_LATENCY)['value'] < 3
+    Task.request = type('Request', (), {backpressure.LATENCY_HEADER: headers[backpressure.LATENCY_HEADER]})
+    backpressure.record_queue_latency(task=Task)
+    assert metrics.read(metrics.TASK_QUEUE_LATENCY)['value'] == 0
@@ -0,0 +1,67 @@
+import pytest
+from django.db import DatabaseError
+
+from weather_app import metrics
+from weather_app.buffers import WriteBehindBuffer
+from weather_app.models import City, Weather
+
+
+@pytest.mark.django_db
+def test_write_behind_buffer_flushes_in_bulk():
+    """
+    Test that buffered readings are written with one bulk insert once the buffer is full, and that
+    the flush is reported to the metrics.
+    """
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    buffer = WriteBehindBuffer(Weather, max_size=3, max_delay=60, latency_metric='test.flush_ms',
+                               size_metric='test.flush_size')
+
+    def reading(temp):
+        return Weather(city=city, description='Sunny', temp=temp, pressure=1013.0, humidity=50.0, clouds='0',
+                       wind_speed=1.0)
+
+    buffer.add(reading(1))
+    buffer.add(reading(2))
+    assert Weather.objects.count() == 0
+    buffer.add(reading(3))
+    assert Weather.objects.count() == 3
+    assert len(buffer) == 0
+
+    buffer.add(reading(4))
+    assert buffer.flush() == 1
+    assert Weather.objects.count() == 4
+    assert metrics.read('test.flush_size') == {'count': 2, 'sum': 4, 'max': 3, 'mean': 2.0}
+    assert metrics.read('test.flush_ms')['count'] == 2
+
+
+@pytest.mark.django_db
+def test_write_behind_buffer_keeps_failed_rows(monkeypatch):
+    """
+    Test that readings a flush fails to write are kept, up to max_backlog, and written by the next flush.
+    """
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    buffer = WriteBehindBuffer(Weather, max_size=2, max_delay=60, latency_metric='test.flush_ms',
+                               size_metric='test.flush_size', max_backlog=3)
+    bulk_create = Weather.objects.bulk_create
+
+    def failing_bulk_create(items):
+        raise DatabaseError('connection lost')
+
+    def reading(temp):
+        return Weather(city=city, description='Sunny', temp=temp, pressure=1013.0, humidity=50.0, clouds=0,
+                       wind_speed=1.0)
+
+    monkeypatch.setattr(Weather.objects, 'bulk_create', failing_bulk_create)
+    buffer.add(reading(1))
+    with pytest.raises(DatabaseError):
+        buffer.add(reading(2))
+    assert len(buffer) == 2
+    for temp in (3, 4):
+        with pytest.raises(DatabaseError):
+            buffer.add(reading(temp))
+    assert len(buffer) == 3
+
+    monkeypatch.setattr(Weather.objects, 'bulk_create', bulk_create)
+    assert buffer.flush() == 3
+    assert sorted(Weather.objects.values_list('temp', flat=True)) == [2, 3, 4]
+    assert len(buffer) == 0
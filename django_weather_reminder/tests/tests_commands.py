@@ -0,0 +1,70 @@
+import gzip
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+
+from weather_app.management.commands.import_cities import iter_json_objects
+from weather_app.models import City, Weather
+from weather_app.utils import get_city_data
+
+CITY_LIST = [{'id': 703448, 'name': 'Kyiv', 'state': '', 'country': 'UA', 'coord': {'lon': 30.5167, 'lat': 50.4333}},
+             {'id': 2643743, 'name': 'London', 'state': '', 'country': 'GB', 'coord': {'lon': -0.1257, 'lat': 51.5085}},
+             {'id': 3094802, 'name': 'Kraków', 'state': '', 'country': 'PL', 'coord': {'lon': 19.9167, 'lat': 50.0833}}]
+
+
+def test_iter_json_objects_across_reads():
+    """
+    Test that the streaming parser yields every object even when objects span several reads.
+    """
+    file = io.StringIO(json.dumps(CITY_LIST, indent=2))
+    assert list(iter_json_objects(file, read_size=7)) == CITY_LIST
+
+
+@pytest.mark.django_db
+def test_import_cities(tmp_path, monkeypatch):
+    """
+    Test that import_cities upserts a gzipped city list in chunks, updating the matching cities
+    created by geocoding, and that imported cities are then resolved by get_city_data without
+    calling the geocoding API.
+    """
+    path = tmp_path / 'city.list.json.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as file:
+        json.dump(CITY_LIST, file)
+    City.objects.create(name='Old name', provider_id=703448)
+    # Created by geocoding before the import, with its own coordinates.
+    geocoded = City.objects.create(name='London', country='GB', lat=51.5073, lon=-0.1277)
+    City.objects.create(name='London', country='CA', lat=42.9834, lon=-81.233)
+
+    call_command('import_cities', str(path), chunk_size=2)
+    assert City.objects.count() == 4
+    assert City.objects.get(provider_id=703448).name == 'Kyiv'
+    assert City.objects.get(provider_id=3094802).search_name == 'krakow'
+    assert City.objects.get(provider_id=2643743).id == geocoded.id
+    assert City.objects.get(provider_id=2643743).lat == 51.5085
+
+    def fail_get(*args, **kwargs):
+        raise AssertionError('The geocoding API must not be called')
+
+    monkeypatch.setattr('requests.get', fail_get)
+    assert get_city_data('KRAKOW')['name'] == 'Kraków'
+
+
+@pytest.mark.django_db
+def test_weather_storage_report():
+    """
+    Test that weather_storage_report measures both layouts of the stored readings and that the compact one is smaller.
+    """
+    city = City.objects.create(name='Kyiv', country='UA', lat=50.45, lon=30.52)
+    Weather.objects.bulk_create([Weather(city=city, description=description, temp=20.5, pressure=1013.25, humidity=50,
+                                         clouds=40, wind_speed=3.5)
+                                 for description in ('scattered clouds', 'overcast clouds') * 1000])
+    stdout = io.StringIO()
+    call_command('weather_storage_report', '--json', stdout=stdout)
+    report = json.loads(stdout.getvalue())
+
+    assert report['rows'] == report['sampled'] == 2000
+    assert report['compact']['table_bytes'] < report['legacy']['table_bytes']
+    assert report['compact']['row_bytes'] < report['legacy']['row_bytes']
+    assert report['table_saving'] > 0
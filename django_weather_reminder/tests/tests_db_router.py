@@ -0,0 +1,58 @@
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory
+from rest_framework.response import Response
+
+from django_weather_reminder.db_router import ReplicaRoutingMiddleware, use_replica
+from weather_app.models import Weather
+
+
+def test_reads_routed_to_replica_until_own_write(settings):
+    """
+    Test that safe requests read from a replica, and that a client is pinned to the primary after its own write.
+    """
+    settings.REPLICA_DATABASES = ['replica_0']
+    used = []
+
+    def view(request):
+        used.append((router.db_for_read(Weather), router.db_for_write(Weather)))
+        return HttpResponse()
+
+    middleware = ReplicaRoutingMiddleware(view)
+    factory = RequestFactory()
+    alice, bob = {'HTTP_AUTHORIZATION': 'Bearer alice'}, {'HTTP_AUTHORIZATION': 'Bearer bob'}
+
+    middleware(factory.get('/api/v1/weathers/', **alice))
+    middleware(factory.post('/api/v1/subscribes/', **alice))
+    middleware(factory.get('/api/v1/subscribes/', **alice))
+    middleware(factory.get('/api/v1/weathers/', **bob))
+
+    assert used == [('replica_0', 'default'), ('default', 'default'), ('default', 'default'),
+                    ('replica_0', 'default')]
+    # Outside of a request, e.g. in tasks and the schedulers, everything stays on the primary.
+    assert router.db_for_read(Weather) == 'default'
+    with use_replica():
+        assert router.db_for_read(Weather) == 'replica_0'
+
+
+def test_issued_credentials_pinned_after_write(settings):
+    """
+    Test that a client obtaining a token reads its own writes under the token it uses from then on.
+    """
+    settings.REPLICA_DATABASES = ['replica_0']
+    used = []
+
+    def view(request):
+        used.append(router.db_for_read(Weather))
+        if request.method == 'POST':
+            return Response({'refresh': 'refresh-token', 'access': 'access-token'})
+        return Response()
+
+    middleware = ReplicaRoutingMiddleware(view)
+    factory = RequestFactory()
+
+    middleware(factory.post('/api/v1/token/', REMOTE_ADDR='10.0.0.1'))
+    middleware(factory.get('/api/v1/subscribes/', HTTP_AUTHORIZATION='Bearer access-token'))
+    middleware(factory.get('/api/v1/subscribes/', HTTP_AUTHORIZATION='Bearer other-token'))
+
+    assert used == ['default', 'default', 'replica_0']
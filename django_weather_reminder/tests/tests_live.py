@@ -0,0 +1,168 @@
+import asyncio
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import AsyncClient
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from weather_app.buffers import weather_buffer
+from weather_app.live import DisconnectMiddleware, city_channel, stream_readings
+from weather_app.models import City, SubscribedCity, Weather
+
+
+class FakePipeline:
+    def __init__(self, published):
+        self.published = published
+        self.queued = []
+
+    def publish(self, channel, data):
+        self.queued.append((channel, data))
+
+    def execute(self):
+        self.published.extend(self.queued)
+
+
+class FakePubSub:
+    def __init__(self, messages):
+        self.messages = messages
+        self.channels = []
+
+    async def subscribe(self, *channels):
+        self.channels.extend(channels)
+
+    async def unsubscribe(self, *channels):
+        self.channels = [channel for channel in self.channels if channel not in channels]
+
+    async def get_message(self, timeout=None):
+        if self.messages and self.messages[0]['channel'].decode() in self.channels:
+            return self.messages.pop(0)
+        await asyncio.sleep(0.01)
+        return None
+
+    async def reset(self):
+        self.channels = []
+
+
+class FakeAsyncRedis:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+        self.closed = False
+
+    def pubsub(self, **kwargs):
+        return self._pubsub
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.django_db
+def test_stored_readings_published(monkeypatch):
+    """
+    Test that a reading stored through the write-behind buffer is published once on the channel of its city.
+    """
+    published = []
+
+    class FakeRedis:
+        def pipeline(self, transaction=True):
+            return FakePipeline(published)
+
+    monkeypatch.setattr('weather_app.live.get_redis', lambda: FakeRedis())
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    weather_buffer.add(Weather(city=city, description='Sunny', temp=25.0, pressure=1013.0, humidity=50.0, clouds='0',
+                               wind_speed=10.0))
+    weather_buffer.flush()
+
+    assert [channel for channel, data in published] == [city_channel(city.id)]
+    assert json.loads(published[0][1])['temp'] == 25.0
+
+
+@pytest.mark.django_db
+def test_weather_stream_view(monkeypatch, settings):
+    """
+    Test that the stream requires a single use ticket, subscribes to the cities of the user and sends readings as events.
+    """
+    settings.LIVE_UPDATES_URL = 'redis://redis:6379/2'
+    settings.LIVE_UPDATES_HEARTBEAT = 0.05
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    user = User.objects.create(username='testuser')
+    SubscribedCity.objects.create(user=user, city=city, period_notifications=1)
+    pubsub = FakePubSub([{'channel': city_channel(city.id).encode(), 'data': b'{"temp": 25.0}'}])
+    monkeypatch.setattr('weather_app.live.get_async_redis', lambda: FakeAsyncRedis(pubsub))
+    api_client = APIClient()
+    api_client.force_authenticate(user=user)
+    response = api_client.post(reverse('weather-stream-ticket'))
+    assert response.status_code == 201
+    ticket = response.data['ticket']
+    url = reverse('async-weather-stream')
+
+    async def read_stream():
+        client = AsyncClient()
+        assert (await client.get(url)).status_code == 401
+        assert (await client.get(url, {'token': str(RefreshToken.for_user(user).access_token)})).status_code == 401
+        response = await client.get(url, {'ticket': ticket})
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'text/event-stream'
+        stream = response.streaming_content
+        chunks = [await anext(stream) for _ in range(3)]
+        await stream.aclose()
+        assert (await client.get(url, {'ticket': ticket})).status_code == 401
+        return chunks
+
+    chunks = [chunk.decode() for chunk in async_to_sync(read_stream)()]
+    assert chunks == ['retry: 3000\n\n', 'event: weather\ndata: {"temp": 25.0}\n\n', ': keep-alive\n\n']
+    assert pubsub.channels == []
+
+
+def test_streams_share_one_connection(monkeypatch, settings):
+    """
+    Test that the streams of a process share one pub/sub connection, closed when the last stream ends.
+    """
+    settings.LIVE_UPDATES_HEARTBEAT = 1
+    pubsub = FakePubSub([{'channel': city_channel(1).encode(), 'data': b'{"temp": 25.0}'}])
+    clients = []
+    monkeypatch.setattr('weather_app.live.get_async_redis', lambda: clients.append(FakeAsyncRedis(pubsub))
+                        or clients[-1])
+
+    async def read_streams():
+        first, second = stream_readings([1]), stream_readings([1, 2])
+        await anext(first), await anext(second)
+        assert sorted(pubsub.channels) == [city_channel(1), city_channel(2)]
+        events = [await anext(first), await anext(second)]
+        await second.aclose()
+        assert pubsub.channels == [city_channel(1)]
+        await first.aclose()
+        return events
+
+    assert async_to_sync(read_streams)() == ['event: weather\ndata: {"temp": 25.0}\n\n'] * 2
+    assert len(clients) == 1 and clients[0].closed
+
+
+def test_stream_ends_on_disconnect(monkeypatch, settings):
+    """
+    Test that a stream ends when DisconnectMiddleware sees the client leave, and after LIVE_UPDATES_MAX_AGE.
+    """
+    settings.LIVE_UPDATES_HEARTBEAT = 1
+    pubsub = FakePubSub([])
+    monkeypatch.setattr('weather_app.live.get_async_redis', lambda: FakeAsyncRedis(pubsub))
+
+    async def application(scope, receive, send):
+        assert (await receive())['type'] == 'http.request'
+        assert [chunk async for chunk in stream_readings([1], scope['disconnected'])] == ['retry: 3000\n\n']
+
+    async def serve():
+        messages = asyncio.Queue()
+        messages.put_nowait({'type': 'http.request', 'body': b'', 'more_body': False})
+        serving = asyncio.ensure_future(DisconnectMiddleware(application)({'type': 'http'}, messages.get, None))
+        await asyncio.sleep(0.05)
+        assert not serving.done()
+        messages.put_nowait({'type': 'http.disconnect'})
+        await asyncio.wait_for(serving, 1)
+        settings.LIVE_UPDATES_MAX_AGE = 0.05
+        return [chunk async for chunk in stream_readings([1])]
+
+    assert async_to_sync(serve)() == ['retry: 3000\n\n']
+    assert pubsub.channels == []
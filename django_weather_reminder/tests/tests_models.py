@@ -1,7 +1,7 @@
 from django.contrib.auth.models import User
 from django.test import TestCase
 
-from weather_app.models import City, SubscribedCity, Weather
+from weather_app.models import City, SubscribedCity, Weather, WeatherDescription
 
 
 class CityModelTestCase(TestCase):
@@ -59,7 +59,7 @@ class WeatherModelTestCase(TestCase):
         """
         self.city = City.objects.create(name='Test City')
         self.weather = Weather.objects.create(city=self.city, description='Sunny', temp=25.0, pressure=1013.0,
-                                              humidity=50.0, clouds='Clear', wind_speed=10.0)
+                                              humidity=50.0, clouds=75, wind_speed=10.0)
 
     def test_weather_model(self):
         """
@@ -68,7 +68,7 @@ class WeatherModelTestCase(TestCase):
         its attributes against expected values.
         It checks if the city name is 'Test City', the description is 'Sunny',
         the temperature is 25.0, the pressure is 1013.0,
-        the humidity is 50.0, the clouds are 'Clear', and the wind speed is 10.0.
+        the humidity is 50.0, the clouds are 75 percent, and the wind speed is 10.0.
         Parameters:
         - self: The instance of the test case.
         """
@@ -77,5 +77,18 @@ class WeatherModelTestCase(TestCase):
         self.assertEqual(self.weather.temp, 25.0)
         self.assertEqual(self.weather.pressure, 1013.0)
         self.assertEqual(self.weather.humidity, 50.0)
-        self.assertEqual(self.weather.clouds, 'Clear')
+        self.assertEqual(self.weather.clouds, 75)
         self.assertEqual(self.weather.wind_speed, 10.0)
+
+    def test_weather_description_interned(self):
+        """
+        Test that readings with the same description share one interned text, read back through the reference.
+        """
+        Weather.objects.bulk_create([Weather(city=self.city, description=description, temp=20.0, pressure=1013.0,
+                                             humidity=50.0, clouds=0, wind_speed=3.0)
+                                     for description in ('Sunny', 'Rain', 'Sunny')])
+        self.assertEqual(WeatherDescription.objects.count(), 2)
+        self.assertEqual(Weather.objects.filter(description_ref__text='Sunny').count(), 3)
+        self.assertEqual(sorted(weather.description for weather in Weather.objects.select_related('description_ref')),
+                         ['Rain', 'Sunny', 'Sunny', 'Sunny'])
+        self.assertEqual(Weather.objects.get(pk=self.weather.pk).description, 'Sunny')
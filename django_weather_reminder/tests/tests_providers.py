@@ -0,0 +1,257 @@
+import threading
+import time
+
+import pytest
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from weather_app import metrics
+from weather_app.models import City, Weather
+from weather_app.providers import CircuitOpen, OpenMeteoProvider, ProviderError, WeatherProvider, hedge_delay, \
+    hedged_call, primary_latencies
+from weather_app.utils import get_weather_data_coord
+
+calls = []
+
+READING = {'name': None, 'country': None, 'lat': 50.45, 'lon': 30.52, 'description': 'clear sky', 'temp': 20.0,
+           'pressure': 1013.0, 'humidity': 40.0, 'clouds': 0, 'wind_speed': 3.0}
+
+
+class StubProvider(WeatherProvider):
+    delay = 0
+    fail = False
+
+    def current(self, lat, lon, units='metric', lang='en'):
+        calls.append(self.name)
+        time.sleep(self.delay)
+        if self.fail:
+            raise ProviderError(f'{self.name}: status 500')
+        return {**READING, 'description': self.name}
+
+
+class SlowProvider(StubProvider):
+    name = 'slow'
+    delay = 0.5
+
+
+class FastProvider(StubProvider):
+    name = 'fast'
+
+
+class FailingProvider(StubProvider):
+    name = 'failing'
+    fail = True
+
+
+@pytest.fixture
+def providers(settings):
+    """
+    Fixture that configures the stub providers by their names and resets the recorded calls.
+    """
+    calls.clear()
+    settings.WEATHER_HEDGE_DELAY = 0.05
+
+    def configure(*names):
+        settings.WEATHER_PROVIDERS = [f'tests.tests_providers.{name}Provider' for name in names]
+
+    return configure
+
+
+def test_hedge_wins_over_slow_primary(providers):
+    """
+    Test that a primary slower than the hedge delay is raced by the secondary, whose answer is used.
+    """
+    providers('Slow', 'Fast')
+    started = time.perf_counter()
+    assert hedged_call('current', 50.45, 30.52)['description'] == 'fast'
+    assert time.perf_counter() - started < SlowProvider.delay
+    assert calls == ['slow', 'fast']
+    assert metrics.read(metrics.UPSTREAM_HEDGES)['count'] == 1
+
+
+def test_fast_primary_is_not_hedged(providers):
+    """
+    Test that the secondary is not asked when the primary answers within the hedge delay.
+    """
+    providers('Fast', 'Slow')
+    assert hedged_call('current', 50.45, 30.52)['description'] == 'fast'
+    assert calls == ['fast']
+    assert len(primary_latencies) == 1
+
+
+def test_failing_primary_falls_over(providers):
+    """
+    Test that a failing primary is hedged at once, and that ProviderError is raised when every provider fails.
+    """
+    providers('Failing', 'Fast')
+    assert hedged_call('current', 50.45, 30.52)['description'] == 'fast'
+    providers('Failing', 'Failing')
+    with pytest.raises(ProviderError):
+        hedged_call('current', 50.45, 30.52)
+
+
+def test_hedge_delay_percentile(settings):
+    """
+    Test that the hedge delay is the configured one until enough latencies are known, then their percentile.
+    """
+    settings.WEATHER_HEDGE_MIN_SAMPLES = 10
+    settings.WEATHER_HEDGE_PERCENTILE = 90
+    for latency in range(1, 10):
+        primary_latencies.add(latency / 10)
+    assert hedge_delay() == settings.WEATHER_HEDGE_DELAY
+    primary_latencies.add(1.0)
+    assert hedge_delay() == 1.0
+    settings.WEATHER_HEDGE_PERCENTILE = 50
+    assert hedge_delay() == 0.6
+
+
+@pytest.mark.django_db
+def test_get_weather_data_coord_without_place_name(providers):
+    """
+    Test that a reading without a place name, as answered by Open-Meteo, is stored for the nearest known city.
+    """
+    city = City.objects.create(name='Kyiv', country='UA', lat=50.45, lon=30.52)
+    providers('Failing', 'Fast')
+    weather_data = get_weather_data_coord(50.45, 30.52)
+    assert weather_data['description'] == 'fast'
+    assert Weather.objects.get().city == city
+
+
+def reopen_for_probe(provider_name):
+    """
+    Move the opening of a circuit back past its recovery timeout, so the next call is the half-open probe.
+    """
+    cache.set(f'upstream:circuit:{provider_name}:opened_at', time.time() - 3600, None)
+
+
+def test_circuit_opens_and_recovers_through_probe(providers, settings):
+    """
+    Test that the circuit opens after consecutive failures and rejects calls without reaching the provider,
+    that a failed probe reopens it and that a successful one closes it.
+    """
+    settings.UPSTREAM_FAILURE_THRESHOLD = 2
+    providers('Failing')
+    for _ in range(2):
+        with pytest.raises(ProviderError):
+            hedged_call('current', 50.45, 30.52)
+    with pytest.raises(CircuitOpen):
+        hedged_call('current', 50.45, 30.52)
+    assert calls == ['failing', 'failing']
+
+    reopen_for_probe('failing')
+    with pytest.raises(ProviderError):
+        hedged_call('current', 50.45, 30.52)
+    with pytest.raises(CircuitOpen):
+        hedged_call('current', 50.45, 30.52)
+    assert len(calls) == 3
+
+    reopen_for_probe('failing')
+    FailingProvider.fail = False
+    try:
+        hedged_call('current', 50.45, 30.52)
+        hedged_call('current', 50.45, 30.52)
+    finally:
+        FailingProvider.fail = True
+    assert len(calls) == 5
+
+
+def test_open_primary_circuit_is_skipped(providers, settings):
+    """
+    Test that a provider whose circuit is open is skipped in favour of the next one.
+    """
+    settings.UPSTREAM_FAILURE_THRESHOLD = 1
+    providers('Failing', 'Fast')
+    assert hedged_call('current', 50.45, 30.52)['description'] == 'fast'
+    calls.clear()
+    assert hedged_call('current', 50.45, 30.52)['description'] == 'fast'
+    assert calls == ['fast']
+
+
+@pytest.mark.django_db
+def test_open_circuit_serves_last_reading(providers, settings):
+    """
+    Test that while the providers are unavailable the latest stored reading is served marked stale,
+    and that without one the call fails fast with 503 once the circuit is open.
+    """
+    settings.UPSTREAM_FAILURE_THRESHOLD = 1
+    providers('Failing')
+    city = City.objects.create(name='Kyiv', country='UA', lat=50.45, lon=30.52)
+    Weather.objects.create(city=city, description='Sunny', temp=25.0, pressure=1013.0, humidity=50.0, clouds='0',
+                           wind_speed=10.0)
+
+    weather_data = get_weather_data_coord(50.45, 30.52, city=city)
+    assert weather_data['stale'] is True
+    assert weather_data['description'] == 'Sunny'
+    assert get_weather_data_coord(50.45, 30.52, city=city)['stale'] is True
+    assert calls == ['failing']
+    assert metrics.read(metrics.UPSTREAM_FALLBACKS)['count'] == 2
+
+    other = City.objects.create(name='Lviv', country='UA', lat=49.84, lon=24.03)
+    response = get_weather_data_coord(49.84, 24.03, city=other)
+    assert isinstance(response, Response)
+    assert response.status_code == 503
+    assert calls == ['failing']
+
+
+def test_saturated_primary_is_hedged_at_once(providers, monkeypatch):
+    """
+    Test that the secondary is asked without waiting while the primary already holds its share of the thread pool.
+    """
+    providers('Slow', 'Fast')
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr('weather_app.providers._primary_slots', slots)
+    assert hedged_call('current', 50.45, 30.52)['description'] == 'fast'
+    assert calls == ['fast']
+    providers('Slow')
+    assert hedged_call('current', 50.45, 30.52)['description'] == 'slow'
+
+    # A half-open probe claimed while every primary slot is taken is released for the next call.
+    providers('Fast', 'Slow')
+    reopen_for_probe('fast')
+    assert hedged_call('current', 50.45, 30.52)['description'] == 'slow'
+    slots.release()
+    calls.clear()
+    assert hedged_call('current', 50.45, 30.52)['description'] == 'fast'
+    assert calls == ['fast']
+
+
+def test_open_meteo_units_and_pressure(monkeypatch):
+    """
+    Test that Open-Meteo is asked for the sea level pressure and that standard units are in Kelvin.
+    """
+    urls = []
+    answer = {'latitude': 50.45, 'longitude': 30.52, 'current': {
+        'temperature_2m': 20.0, 'relative_humidity_2m': 40, 'pressure_msl': 1013.2, 'cloud_cover': 0,
+        'wind_speed_10m': 3.0, 'weather_code': 0}}
+    monkeypatch.setattr(OpenMeteoProvider, 'get', lambda self, url: urls.append(url) or answer)
+
+    weather = OpenMeteoProvider().current(50.45, 30.52, 'standard')
+    assert 'pressure_msl' in urls[0] and 'temperature_unit=celsius' in urls[0]
+    assert (weather['temp'], weather['pressure']) == (293.15, 1013.2)
+    assert OpenMeteoProvider().current(50.45, 30.52)['temp'] == 20.0
+
+
+def test_malformed_answer_is_a_provider_failure(monkeypatch, settings):
+    """
+    Test that a successful response with an unexpected body raises ProviderError and counts against the circuit.
+    """
+    settings.WEATHER_PROVIDERS = ['openweathermap']
+    settings.UPSTREAM_FAILURE_THRESHOLD = 2
+    bodies = [ValueError('Expecting value'), {'coord': {}, 'main': {}}]
+
+    class FakeResponse:
+        status_code = 200
+
+        def json(self):
+            body = bodies.pop(0)
+            if isinstance(body, Exception):
+                raise body
+            return body
+
+    monkeypatch.setattr('requests.get', lambda url, timeout: FakeResponse())
+    for _ in range(2):
+        with pytest.raises(ProviderError):
+            hedged_call('current', 50.45, 30.52)
+    with pytest.raises(CircuitOpen):
+        hedged_call('current', 50.45, 30.52)
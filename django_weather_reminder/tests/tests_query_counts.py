@@ -0,0 +1,248 @@
+"""
+Query count and latency budgets of the API endpoints.
+
+Every endpoint is requested against a seeded dataset of QUERY_BUDGET_SEED_SIZE cities, readings and
+subscriptions, then against one ten times larger. The number of SQL queries must stay within the
+budget of the endpoint and must not grow with the dataset, which catches N+1 regressions; the wall
+time must stay within its budget. Raise QUERY_BUDGET_SEED_SIZE to run the same checks on more data.
+Every route and method of the API in the URL resolver must have a budget.
+"""
+import os
+import time
+from dataclasses import dataclass
+from itertools import count
+
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, resolve, reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from tests.tests_live import FakeAsyncRedis, FakePubSub
+from weather_app.models import City, SubscribedCity, Weather
+from weather_app.spatial import city_index
+from weather_app.subscriptions import create_subscription_tasks
+
+SEED_SIZE = int(os.environ.get('QUERY_BUDGET_SEED_SIZE', 5))
+# Wall time budget of one request in milliseconds, generous enough for a loaded CI machine
+MAX_MS = float(os.environ.get('QUERY_BUDGET_MAX_MS', 1000))
+READINGS_PER_CITY = 2
+
+_names = count()
+
+
+@dataclass
+class Seed:
+    user: User
+    cities: list
+    subscriptions: list
+
+
+def seed(size: int) -> Seed:
+    """
+    Create ``size`` cities with their readings, and a user subscribed to each of them.
+    """
+    prefix = f'Seed {next(_names)}'
+    cities = [City.objects.create(name=f'{prefix} City {i}', country='UA', lat=40 + i * 0.1, lon=20 + i * 0.1)
+              for i in range(size)]
+    Weather.objects.bulk_create([Weather(city=city, description='Sunny', temp=20.0 + i, pressure=1013.0,
+                                         humidity=50.0, clouds='0', wind_speed=3.0)
+                                 for city in cities for i in range(READINGS_PER_CITY)])
+    user = User.objects.create_user(username=f'{prefix} user', email=f'{next(_names)}@example.com',
+                                    password='testpassword')
+    subscriptions = SubscribedCity.objects.bulk_create([SubscribedCity(user=user, city=city, period_notifications=60)
+                                                        for city in cities])
+    for subscription in subscriptions:
+        subscription.user = user
+    create_subscription_tasks(subscriptions)
+    return Seed(user=user, cities=cities, subscriptions=subscriptions)
+
+
+def names(data: Seed) -> list:
+    return [city.name for city in data.cities[:3]]
+
+
+def new_city(data: Seed) -> int:
+    return City.objects.create(name=f'New {next(_names)}', lat=10, lon=10).id
+
+
+def reading(data: Seed) -> int:
+    return data.cities[0].weather_data.values_list('id', flat=True).first()
+
+
+def weather(data: Seed) -> dict:
+    return {'city': data.cities[0].id, 'description': 'Cloudy', 'temp': 10.0, 'pressure': 1000.0, 'humidity': 80.0,
+            'clouds': 90, 'wind_speed': 5.0}
+
+
+def subscription_update(data: Seed) -> dict:
+    # The subscription views validate partial updates as full ones.
+    return {'user': data.user.id, 'city': data.cities[0].id, 'period_notifications': 60}
+
+
+def webhook(data: Seed) -> dict:
+    return {'user': data.user.id, 'city': new_city(data), 'period_notifications': 60,
+            'webhook_url': f'https://example.com/hook/{next(_names)}'}
+
+
+# name: (method, url, payload, max queries)
+ENDPOINTS = {
+    'city-list': ('get', lambda data: reverse('city-list'), None, 1),
+    'city-list-by-name': ('get', lambda data: reverse('city-list'), lambda data: {'city_name': data.cities[0].name},
+                          1),
+    'city-resolve': ('post', lambda data: reverse('city-resolve'), names, 1),
+    'weather-list': ('get', lambda data: reverse('weather-list'), None, 1),
+    'weather-list-by-coordinates': ('get', lambda data: reverse('weather-list'),
+                                    lambda data: {'lat': data.cities[0].lat, 'lon': data.cities[0].lon}, 2),
+    'weather-current': ('get', lambda data: reverse('weather-current'),
+                        lambda data: {'cities': ','.join(str(city.id) for city in data.cities[:3])}, 1),
+    'weather-export': ('get', lambda data: reverse('weather-export'), None, 1),
+    'subscription-list': ('get', lambda data: reverse('subscribedcity-list'), None, 1),
+    'subscription-detail': ('get', lambda data: reverse('subscribedcity-detail', args=[data.subscriptions[0].id]),
+                            None, 1),
+    'subscription-update': ('put', lambda data: reverse('subscribedcity-detail', args=[data.subscriptions[0].id]),
+                            lambda data: {'user': data.user.id, 'city': data.cities[0].id,
+                                          'period_notifications': 60}, 12),
+    'subscription-delete': ('delete', lambda data: reverse('subscribedcity-detail', args=[data.subscriptions[0].id]),
+                            None, 9),
+    'subscription-create': ('post', lambda data: reverse('subscribedcity-list'),
+                            lambda data: {'user': data.user.id,
+                                          'city': City.objects.create(name=f'New {next(_names)}').id,
+                                          'period_notifications': 60}, 10),
+    'subscription-bulk-update': ('patch', lambda data: reverse('subscribedcity-bulk'),
+                                 lambda data: [{'id': subscription.id, 'period_notifications': 60}
+                                               for subscription in data.subscriptions[:3]], 12),
+    'subscription-partial-update': ('patch', lambda data: reverse('subscribedcity-detail',
+                                                                  args=[data.subscriptions[0].id]),
+                                    subscription_update, 12),
+    'subscription-bulk-create': ('post', lambda data: reverse('subscribedcity-bulk'),
+                                 lambda data: [{'city': new_city(data), 'period_notifications': 60} for _ in range(3)],
+                                 12),
+    'city-create': ('post', lambda data: reverse('city-list'),
+                    lambda data: {'name': f'New {next(_names)}', 'country': 'UA', 'lat': 10, 'lon': 10}, 1),
+    'city-detail': ('get', lambda data: reverse('city-detail', args=[data.cities[0].id]), None, 1),
+    'city-update': ('put', lambda data: reverse('city-detail', args=[data.cities[0].id]),
+                    lambda data: {'name': data.cities[0].name, 'country': 'PL', 'lat': 10, 'lon': 10}, 2),
+    'city-partial-update': ('patch', lambda data: reverse('city-detail', args=[data.cities[0].id]),
+                            lambda data: {'country': 'PL'}, 2),
+    'city-delete': ('delete', lambda data: reverse('city-detail', args=[data.cities[0].id]), None, 6),
+    'weather-create': ('post', lambda data: reverse('weather-list'), weather, 4),
+    'weather-detail': ('get', lambda data: reverse('weather-detail', args=[reading(data)]), None, 1),
+    'weather-update': ('put', lambda data: reverse('weather-detail', args=[reading(data)]), weather, 5),
+    'weather-partial-update': ('patch', lambda data: reverse('weather-detail', args=[reading(data)]),
+                               lambda data: {'description': 'Rain'}, 4),
+    'weather-delete': ('delete', lambda data: reverse('weather-detail', args=[reading(data)]), None, 2),
+    'weather-stream-ticket': ('post', lambda data: reverse('weather-stream-ticket'), None, 0),
+    'webhook-list': ('get', lambda data: reverse('subscribedwebhookcity-list'), None, 1),
+    'webhook-detail': ('get', lambda data: reverse('subscribedwebhookcity-detail', args=[data.subscriptions[0].id]),
+                       None, 1),
+    'webhook-create': ('post', lambda data: reverse('subscribedwebhookcity-list'), webhook, 19),
+    'webhook-update': ('put', lambda data: reverse('subscribedwebhookcity-detail', args=[data.subscriptions[0].id]),
+                       subscription_update, 6),
+    'webhook-partial-update': ('patch', lambda data: reverse('subscribedwebhookcity-detail',
+                                                             args=[data.subscriptions[0].id]),
+                               subscription_update, 6),
+    'webhook-delete': ('delete', lambda data: reverse('subscribedwebhookcity-detail',
+                                                      args=[data.subscriptions[0].id]), None, 4),
+    'user-list': ('get', lambda data: reverse('user-list'), None, 1),
+    'user-create': ('post', lambda data: reverse('user-list'),
+                    lambda data: {'username': f'new{next(_names)}', 'password': 'testpassword',
+                                  'email': 'new@example.com'}, 2),
+    'user-detail': ('get', lambda data: reverse('user-detail', args=[data.user.id]), None, 1),
+    'user-update': ('put', lambda data: reverse('user-detail', args=[data.user.id]),
+                    lambda data: {'username': f'renamed{next(_names)}', 'password': 'testpassword',
+                                  'email': 'renamed@example.com'}, 3),
+    'user-partial-update': ('patch', lambda data: reverse('user-detail', args=[data.user.id]),
+                            lambda data: {'email': 'renamed@example.com'}, 2),
+    'user-delete': ('delete', lambda data: reverse('user-detail', args=[data.user.id]), None, 8),
+    'token': ('post', lambda data: reverse('token_obtain_pair'),
+              lambda data: {'username': data.user.username, 'password': 'testpassword'}, 1),
+    'token-refresh': ('post', lambda data: reverse('token_refresh'),
+                      lambda data: {'refresh': str(RefreshToken.for_user(data.user))}, 0),
+    # The async views authenticate the JWT access token of the request themselves.
+    'async-city-list': ('get', lambda data: reverse('async-city-list'), None, 2),
+    'async-city-list-by-name': ('get', lambda data: reverse('async-city-list'),
+                                lambda data: {'city_name': data.cities[0].name}, 2),
+    'async-weather-list': ('get', lambda data: reverse('async-weather-list'), None, 2),
+    'async-weather-list-by-coordinates': ('get', lambda data: reverse('async-weather-list'),
+                                          lambda data: {'lat': data.cities[0].lat, 'lon': data.cities[0].lon}, 3),
+    'async-weather-stream': ('get', lambda data: reverse('async-weather-stream'), None, 2),
+}
+# Endpoints served only with live updates enabled
+LIVE_ENDPOINTS = {'weather-stream-ticket', 'async-weather-stream'}
+
+
+def api_routes(patterns: list, prefix: str = '') -> set:
+    """
+    Return the ``(url name, method)`` of every route of the API in the URL resolver.
+    """
+    routes = set()
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            routes |= api_routes(pattern.url_patterns, route)
+        elif route.startswith('api/v1/'):
+            if hasattr(pattern.callback, 'actions'):
+                methods = pattern.callback.actions
+            elif hasattr(pattern.callback, 'cls'):
+                methods = [method.lower() for method in pattern.callback.cls().allowed_methods]
+            else:
+                # The async views, see async_api_view
+                methods = ['get']
+            # HEAD runs the GET action, OPTIONS only describes the route
+            routes |= {(pattern.name, method) for method in methods if method not in ('head', 'options')}
+    return routes
+
+
+def request(client: APIClient, data: Seed, endpoint: str) -> tuple[int, float]:
+    """
+    Request an endpoint as the seeded user and return the number of queries and the wall time in milliseconds.
+    """
+    method, url, payload, max_queries = ENDPOINTS[endpoint]
+    client.force_authenticate(user=data.user)
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(data.user)}')
+    url, payload = url(data), payload(data) if payload else None
+    # Load the seeded cities into the process-wide city index outside of the measured request.
+    city_index.refresh(force=True)
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = getattr(client, method)(url, payload, format='json' if method != 'get' else None)
+        if response.streaming:
+            b''.join(response)
+        elapsed = (time.perf_counter() - started) * 1000
+    assert response.status_code < 400, response.content
+    return len(queries), elapsed
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('endpoint', ENDPOINTS)
+def test_endpoint_query_budget(endpoint, monkeypatch, settings):
+    """
+    Test that an endpoint stays within its query and time budgets and runs the same number of
+    queries on a dataset ten times larger.
+    """
+    if endpoint in LIVE_ENDPOINTS:
+        settings.LIVE_UPDATES_URL = 'redis://redis:6379/2'
+        settings.LIVE_UPDATES_MAX_AGE = 0
+        monkeypatch.setattr('weather_app.live.get_async_redis', lambda: FakeAsyncRedis(FakePubSub([])))
+    client = APIClient()
+    max_queries = ENDPOINTS[endpoint][3]
+    small_queries, small_ms = request(client, seed(SEED_SIZE), endpoint)
+    large_queries, large_ms = request(client, seed(SEED_SIZE * 10), endpoint)
+
+    assert small_queries <= max_queries
+    assert large_queries == small_queries, f'{endpoint} queries grow with the dataset'
+    assert max(small_ms, large_ms) <= MAX_MS
+
+
+@pytest.mark.django_db
+def test_every_endpoint_has_a_budget():
+    """
+    Test that every route and method of the API has a query budget, so new endpoints are not missed.
+    """
+    data = seed(1)
+    budgeted = {(resolve(url(data)).url_name, method) for method, url, payload, max_queries in ENDPOINTS.values()}
+
+    assert api_routes(get_resolver().url_patterns) - budgeted == set()
@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth.models import User
+from django.core import mail
+from django.utils import timezone
+
+from weather_app.models import City, SchedulerLease, SubscribedCity, Weather
+from weather_app.scheduler import ShardedScheduler
+
+
+@pytest.mark.django_db
+def test_partitions_rebalance_between_instances(settings):
+    """
+    Test that instances split the partitions evenly and take over the partitions of an instance that died.
+    """
+    settings.SCHEDULER_PARTITIONS = 8
+    first, second = ShardedScheduler('first'), ShardedScheduler('second')
+    now = timezone.now()
+    assert first.acquire(now) == set(range(8))
+
+    # A new instance takes its share over, the first one keeps the rest on its next tick.
+    assert len(second.acquire(now)) == 4
+    assert first.acquire(now) | second.partitions == set(range(8))
+    assert len(first.partitions) == len(second.partitions) == 4
+
+    # The first instance stops renewing: its leases expire and the second takes them over.
+    later = now + settings.SCHEDULER_LEASE_TIMEOUT + timedelta(seconds=1)
+    assert second.acquire(later) == set(range(8))
+    assert set(SchedulerLease.objects.values_list('owner', flat=True)) == {'second'}
+
+
+@pytest.mark.django_db
+def test_dispatch_due_subscriptions(settings, django_capture_on_commit_callbacks):
+    """
+    Test that only due subscriptions of the held partitions are dispatched, and that they move one period ahead.
+    """
+    settings.SCHEDULER_PARTITIONS = 2
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    Weather.objects.create(city=city, description='Sunny', temp=25.0, pressure=1013.0, humidity=50.0, clouds='0',
+                           wind_speed=10.0)
+    now = timezone.now()
+    subscriptions = [SubscribedCity.objects.create(user=User.objects.create(username=f'user{i}',
+                                                                            email=f'user{i}@example.com'),
+                                                   city=city, period_notifications=60) for i in range(4)]
+    SubscribedCity.objects.filter(id=subscriptions[0].id).update(next_run_at=now + timedelta(minutes=5))
+
+    scheduler = ShardedScheduler('only')
+    scheduler.acquire(now)
+    scheduler.partitions = {subscriptions[1].id % 2}
+    with django_capture_on_commit_callbacks(execute=True):
+        dispatched = scheduler.dispatch(now)
+
+    expected = [subscription for subscription in subscriptions[1:] if subscription.id % 2 in scheduler.partitions]
+    assert dispatched == len(expected)
+    assert sorted(message.to[0] for message in mail.outbox) == sorted(s.user.email for s in expected)
+    for subscription in expected:
+        subscription.refresh_from_db()
+        assert subscription.next_run_at == now + timedelta(minutes=60)
+    assert scheduler.dispatch(now) == 0
@@ -71,8 +71,9 @@ class WeatherSerializerTestCase(TestCase):
         """
         city = City.objects.create(name='Test City')
         data = {'city': city.id, 'description': 'Sunny', 'temp': 25.0, 'pressure': 1013.0, 'humidity': 50.0,
-                'clouds': 'Clear', 'wind_speed': 10.0}
+                'clouds': 75, 'wind_speed': 10.0}
         serializer = WeatherSerializer(data=data)
         self.assertTrue(serializer.is_valid())
+        self.assertFalse(WeatherSerializer(data={**data, 'clouds': 'Clear'}).is_valid())
         weather = serializer.save()
         self.assertEqual(weather.city.name, 'Test City')
@@ -0,0 +1,86 @@
+from unittest.mock import Mock
+
+import pytest
+from django.contrib.auth.models import User
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from weather_app.models import City, Weather
+from weather_app.spatial import CityIndex, haversine_km
+
+
+def test_haversine_km():
+    """
+    Test the great-circle distance between Kyiv and London.
+    """
+    assert haversine_km(50.4501, 30.5234, 51.5072, -0.1276) == pytest.approx(2134, rel=0.01)
+
+
+@pytest.mark.django_db
+def test_city_index_nearest():
+    """
+    Test that the index finds the nearest city within the radius, including cities created after
+    it was loaded by bulk_create (no signals) once the refresh interval has passed.
+    """
+    index = CityIndex(cell_km=10, refresh_interval=0)
+    kyiv = City.objects.create(name='Kyiv', lat=50.4501, lon=30.5234)
+    assert index.nearest(50.46, 30.53, 10) == kyiv.id
+    assert index.nearest(51.0, 30.5, 10) is None
+
+    brovary, = City.objects.bulk_create([City(name='Brovary', lat=50.5110, lon=30.7909)])
+    assert index.nearest(50.50, 30.78, 10) == brovary.id
+
+    # Across the antimeridian, e.g. in Fiji
+    taveuni, = City.objects.bulk_create([City(name='Taveuni', lat=-16.85, lon=-179.97)])
+    assert index.nearest(-16.85, 179.97, 10) == taveuni.id
+
+
+@pytest.mark.django_db
+def test_city_index_refresh_catches_late_commits():
+    """
+    Test that a refresh picks up a city whose lower id was committed after a higher one was loaded,
+    and that a full refresh drops the cities deleted by other processes.
+    """
+    index = CityIndex(cell_km=10, refresh_interval=0, full_refresh_interval=3600)
+    kyiv = City.objects.create(name='Kyiv', lat=50.4501, lon=30.5234)
+    City.objects.bulk_create([City(id=kyiv.id + 10, name='Odesa', lat=46.4825, lon=30.7233)])
+    assert index.nearest(50.46, 30.53, 10) == kyiv.id
+
+    # Committed late by a slower transaction, with an id below the highest one already indexed.
+    lviv, = City.objects.bulk_create([City(id=kyiv.id + 5, name='Lviv', lat=49.8397, lon=24.0297)])
+    assert index.nearest(49.84, 24.03, 10) == lviv.id
+
+    City.objects.filter(id=kyiv.id).delete()
+    index.full_refresh_interval = 0
+    assert index.nearest(50.46, 30.53, 10) is None
+
+
+@pytest.mark.django_db
+def test_weather_list_view_snaps_to_city(monkeypatch):
+    """
+    Test that two requests a few hundred metres apart are served as the same city with one upstream fetch.
+    """
+    city = City.objects.create(name='Test City', lat=50.4501, lon=30.5234)
+    calls = []
+
+    def mock_get(url, **kwargs):
+        calls.append(url)
+        response = Mock(status_code=200)
+        response.json.return_value = {'name': 'Test City', 'weather': [{'description': 'Sunny'}],
+                                      'main': {'temp': 25.0, 'pressure': 1013.0, 'humidity': 50.0},
+                                      'clouds': {'all': 0}, 'wind': {'speed': 10.0}}
+        return response
+
+    monkeypatch.setattr('requests.get', mock_get)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(username='testuser'))
+    url = reverse('weather-list')
+
+    for lat, lon in ((50.4510, 30.5240), (50.4490, 30.5220)):
+        response = client.get(url, {'lat': lat, 'lon': lon})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['city'] == city.id
+    assert len(calls) == 1
+    assert 'lat=50.4501&lon=30.5234' in calls[0]
+    assert Weather.objects.filter(city=city).count() == 1
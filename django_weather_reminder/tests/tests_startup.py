@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+from io import StringIO
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from weather_app.management.commands.profile_startup import parse_importtime
+
+
+def test_setup_does_not_load_celery_or_http_clients():
+    """
+    Test that setting up Django in a fresh interpreter does not import the Celery app or the async HTTP client.
+    """
+    code = ('import sys, django; django.setup(); '
+            'print(sorted(name for name in ("django_weather_reminder.celery", "httpx", "redis") if name in sys.modules))')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'django_weather_reminder.settings'})
+    assert result.stdout.strip() == '[]'
+
+
+def test_parse_importtime():
+    """
+    Test that only top-level imports are summed, per root package.
+    """
+    output = ('import time: self [us] | cumulative | imported package\n'
+              'import time:       100 |        100 |   celery.local\n'
+              'import time:       500 |       2000 | celery\n'
+              'import time:       300 |       1000 | celery.app\n'
+              'import time:       400 |        400 | httpx\n')
+    assert parse_importtime(output) == {'celery': 3.0, 'httpx': 0.4}
+
+
+def test_profile_startup_budget():
+    """
+    Test that the command reports the startup phases and fails over the budget.
+    """
+    stdout = StringIO()
+    call_command('profile_startup', '--repeat', '1', '--no-urls', '--budget-ms', '60000', stdout=stdout)
+    assert 'setup' in stdout.getvalue()
+    assert 'weather_app' in stdout.getvalue()
+    with pytest.raises(CommandError):
+        call_command('profile_startup', '--repeat', '1', '--no-urls', '--budget-ms', '1', stdout=StringIO())
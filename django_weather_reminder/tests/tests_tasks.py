@@ -0,0 +1,163 @@
+from datetime import timedelta
+from smtplib import SMTPException
+
+import pytest
+from django.contrib.auth.models import User
+from django.core import mail
+
+from django_weather_reminder.celery import app
+from weather_app.deliveries import claim_deliveries, compact_deliveries, delivery_report, delivery_slot
+from weather_app.models import City, NotificationDelivery, SubscribedCity, Weather
+from weather_app.tasks import send_mail_task, render_forecast_task, send_weather_forecast_task, \
+    send_city_forecasts_task, get_city_weather_task, send_forecast_mail_task, send_webhook_notification_task
+
+WEATHER_DATA = {'description': 'Sunny', 'temp': 25.0, 'pressure': 1013.0, 'humidity': 50.0, 'clouds': 0,
+                'wind_speed': 10.0}
+
+
+def test_tasks_routed_to_dedicated_queues():
+    """
+    Test that fetching, rendering, mailing and webhook delivery are routed to their own queues.
+    """
+    routes = {name: app.amqp.router.route({}, name)['queue'].name for name in (
+        'weather_app.tasks.get_city_weather_task', 'weather_app.tasks.render_forecast_task',
+        'weather_app.tasks.send_forecast_mail_task', 'weather_app.tasks.send_webhook_notification',
+        'weather_app.tasks.send_weather_forecast_task')}
+    assert routes == {'weather_app.tasks.get_city_weather_task': 'fetch',
+                      'weather_app.tasks.render_forecast_task': 'render',
+                      'weather_app.tasks.send_forecast_mail_task': 'mail',
+                      'weather_app.tasks.send_webhook_notification': 'webhook',
+                      'weather_app.tasks.send_weather_forecast_task': 'celery'}
+
+
+@pytest.mark.django_db
+def test_send_mail_task():
+    """
+    Test that send_mail_task renders the forecast and sends it to the recipient.
+    """
+    send_mail_task(WEATHER_DATA, 'test@example.com', 'Test City')
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].to == ['test@example.com']
+    assert mail.outbox[0].body == render_forecast_task(WEATHER_DATA, 'Test City')
+    assert 'The weather is Sunny' in mail.outbox[0].body
+
+
+@pytest.mark.django_db
+def test_legacy_sends_claim_their_slot(monkeypatch):
+    """
+    Test that the legacy mail task and the webhook task send once per period of their subscription.
+    """
+    posted = []
+    monkeypatch.setattr('weather_app.webhooks.post_webhook', lambda url, payload: posted.append(url))
+    monkeypatch.setattr('weather_app.tasks.get_city_data', lambda city: {'lat': 50.45, 'lon': 30.52})
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    Weather.objects.create(city=city, **WEATHER_DATA)
+    SubscribedCity.objects.create(user=User.objects.create(username='user', email='user@example.com'), city=city,
+                                  period_notifications=60)
+    webhook = SubscribedCity.objects.create(user=User.objects.create(username='hook'), city=city,
+                                            period_notifications=60)
+
+    for _ in range(2):
+        send_mail_task(WEATHER_DATA, 'user@example.com', 'Test City')
+        send_webhook_notification_task('https://example.com/hook', 'Test City', webhook.id)
+    assert len(mail.outbox) == 1
+    assert posted == ['https://example.com/hook']
+    assert list(NotificationDelivery.objects.values_list('status', flat=True)) == [NotificationDelivery.SENT] * 2
+
+
+@pytest.mark.django_db
+def test_city_forecasts_suppressed_below_thresholds():
+    """
+    Test that due subscriptions of a city are sent in one batch and that a subscription whose
+    thresholds are not crossed since its last delivered snapshot is skipped.
+    """
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    Weather.objects.create(city=city, **WEATHER_DATA)
+    users = [User.objects.create(username=f'user{i}', email=f'user{i}@example.com') for i in range(3)]
+    always = SubscribedCity.objects.create(user=users[0], city=city, period_notifications=1)
+    unchanged = SubscribedCity.objects.create(user=users[1], city=city, period_notifications=1, temp_threshold=2,
+                                              notify_on_description_change=True,
+                                              last_delivered={'description': 'Sunny', 'temp': 24.0})
+    changed = SubscribedCity.objects.create(user=users[2], city=city, period_notifications=1, temp_threshold=2,
+                                            last_delivered={'description': 'Sunny', 'temp': 20.0})
+
+    for subscription in (always, unchanged, changed):
+        send_weather_forecast_task(subscription.user.email, city.name, subscription.id)
+
+    assert sorted(message.to[0] for message in mail.outbox) == ['user0@example.com', 'user2@example.com']
+    changed.refresh_from_db()
+    assert changed.last_delivered['temp'] == 25.0
+    assert not SubscribedCity.objects.filter(pending_since__isnull=False).exists()
+
+
+@pytest.mark.django_db
+def test_overlapping_dispatch_sends_once():
+    """
+    Test that dispatching the same subscriptions twice in one period sends once and records the delivery.
+    """
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    Weather.objects.create(city=city, **WEATHER_DATA)
+    subscription = SubscribedCity.objects.create(user=User.objects.create(username='user', email='user@example.com'),
+                                                 city=city, period_notifications=60)
+
+    assert send_city_forecasts_task(city.id, [subscription.id]) == 1
+    assert send_city_forecasts_task(city.id, [subscription.id]) == 0
+    assert len(mail.outbox) == 1
+
+    delivery = NotificationDelivery.objects.get(subscription=subscription)
+    assert delivery.status == NotificationDelivery.SENT
+    assert delivery.slot == delivery_slot(60, delivery.claimed_at)
+    report = delivery_report(delivery.slot)
+    assert (report['total'], report['sent'], report['pending']) == (1, 1, 0)
+    assert compact_deliveries(delivery.slot + timedelta(hours=1)) == 1
+
+
+@pytest.mark.django_db
+def test_failed_forecast_is_not_suppressed(monkeypatch):
+    """
+    Test that the snapshot of a forecast whose email fails to send is not stored as delivered, and that
+    the failed delivery is claimed again by the next dispatch of the period, which sends the unchanged reading.
+    """
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    Weather.objects.create(city=city, **WEATHER_DATA)
+    subscription = SubscribedCity.objects.create(user=User.objects.create(username='user', email='user@example.com'),
+                                                 city=city, period_notifications=60, temp_threshold=2,
+                                                 last_delivered={'description': 'Sunny', 'temp': 20.0})
+
+    def failing_send_mail(**kwargs):
+        raise SMTPException('connection refused')
+
+    monkeypatch.setattr('weather_app.tasks.send_mail', failing_send_mail)
+    send_city_forecasts_task(city.id, [subscription.id])
+    subscription.refresh_from_db()
+    assert subscription.last_delivered['temp'] == 20.0
+    assert NotificationDelivery.objects.get().status == NotificationDelivery.FAILED
+
+    monkeypatch.undo()
+    # The next dispatch of the same period retries the failed delivery, with the same reading.
+    assert send_city_forecasts_task(city.id, [subscription.id]) == 1
+    assert len(mail.outbox) == 1
+    assert NotificationDelivery.objects.get().status == NotificationDelivery.SENT
+    subscription.refresh_from_db()
+    assert subscription.last_delivered['temp'] == 25.0
+    assert send_city_forecasts_task(city.id, [subscription.id]) == 0
+
+
+@pytest.mark.django_db
+def test_unavailable_weather_fails_delivery(settings):
+    """
+    Test that when the weather can not be fetched, the chain gets None instead of an error response,
+    nothing is sent and the claimed delivery is marked failed.
+    """
+    settings.WEATHER_PROVIDERS = ['tests.tests_providers.FailingProvider']
+    subscription = SubscribedCity.objects.create(user=User.objects.create(username='user', email='user@example.com'),
+                                                 city=City.objects.create(name='Test City', lat=50.45, lon=30.52),
+                                                 period_notifications=60)
+    delivery_id = claim_deliveries([subscription])[subscription.id]
+
+    weather_data = get_city_weather_task({'lat': 50.45, 'lon': 30.52})
+    assert weather_data is None
+    send_forecast_mail_task(render_forecast_task(weather_data, 'Test City'), 'user@example.com', delivery_id)
+
+    assert not mail.outbox
+    assert NotificationDelivery.objects.get(id=delivery_id).status == NotificationDelivery.FAILED
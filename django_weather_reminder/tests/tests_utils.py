@@ -14,7 +14,7 @@ def mock_requests_get(monkeypatch):
         monkeypatch: A pytest fixture that allows for monkey patching of attributes or functions.
     """
 
-    def mock_get(url):
+    def mock_get(url, **kwargs):
         response = Mock()
         if 'geo' in url:
             response.status_code = 200
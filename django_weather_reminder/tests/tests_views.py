@@ -1,12 +1,22 @@
+import gzip
 import json
+import time
+from datetime import timedelta
+from unittest.mock import Mock
 
+import httpx
 import pytest
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.urls import reverse
+from django.utils import timezone
+from django_celery_beat.models import PeriodicTask
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from weather_app.models import City, SubscribedCity
+from weather_app.models import City, SubscribedCity, Weather
+from weather_app.serializers import SubscribedCityBulkListSerializer
+from weather_app.utils import weather_cache_key
 
 
 @pytest.mark.django_db
@@ -91,3 +101,295 @@ def test_subscribed_city_create_view():
     response = client.delete(reverse('subscribedcity-detail', args=[subscribed_city.id]))
     assert response.status_code == status.HTTP_204_NO_CONTENT
     assert not SubscribedCity.objects.filter(user=user).exists()
+
+
+@pytest.mark.django_db
+def test_subscribed_city_bulk_view():
+    """
+    Test the bulk subscription endpoint.
+    It creates subscriptions for several cities in one request, checks that invalid items are reported
+    per item without blocking the valid ones, that every subscription gets its periodic task,
+    and then updates the periods of the created subscriptions in one PATCH request.
+    """
+    client = APIClient()
+    url = reverse('subscribedcity-bulk')
+
+    user = User.objects.create(username='testuser', password='testpassword', email='test@example.com')
+    cities = [City.objects.create(name=f'Test City {i}') for i in range(3)]
+    client.force_authenticate(user=user)
+
+    data = [{'city': city.id, 'period_notifications': 1} for city in cities]
+    data += [{'city': cities[0].id, 'period_notifications': 1}, {'city': 0, 'period_notifications': 1},
+             {'city': cities[1].id, 'period_notifications': 0}]
+    response = client.post(url, data, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    results = response.json()['results']
+    assert [result['status'] for result in results] == ['created'] * 3 + ['error'] * 3
+    assert SubscribedCity.objects.filter(user=user).count() == 3
+    assert PeriodicTask.objects.filter(name__in=[f'Subscriptions {result["id"]}' for result in results[:3]],
+                                       interval__every=1).count() == 3
+
+    data = [{'id': result['id'], 'period_notifications': 5} for result in results[:3]]
+    response = client.patch(url, data, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    assert {result['status'] for result in response.json()['results']} == {'updated'}
+    assert set(SubscribedCity.objects.values_list('period_notifications', flat=True)) == {5}
+    assert PeriodicTask.objects.filter(interval__every=5).count() == 3
+
+
+@pytest.mark.django_db
+def test_subscribed_city_bulk_view_concurrent_duplicate(monkeypatch):
+    """
+    Test that a subscription created concurrently between the validation and the insert of a bulk
+    request gives 409 without writing any of the batch.
+    """
+    user = User.objects.create(username='testuser', password='testpassword', email='test@example.com')
+    cities = [City.objects.create(name=f'Test City {i}') for i in range(2)]
+    validate_items = SubscribedCityBulkListSerializer.validate_items
+
+    def validate_then_race(self, *args, **kwargs):
+        items = validate_items(self, *args, **kwargs)
+        SubscribedCity.objects.create(user=user, city=cities[1], period_notifications=1)
+        return items
+
+    monkeypatch.setattr(SubscribedCityBulkListSerializer, 'validate_items', validate_then_race)
+    client = APIClient()
+    client.force_authenticate(user=user)
+    response = client.post(reverse('subscribedcity-bulk'), [{'city': city.id, 'period_notifications': 1}
+                                                            for city in cities], format='json')
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert list(SubscribedCity.objects.values_list('city_id', flat=True)) == [cities[1].id]
+
+
+@pytest.mark.django_db
+def test_city_resolve_view(monkeypatch, settings):
+    """
+    Test the batch geocoding endpoint.
+    Known names are answered locally, each distinct unknown name is geocoded once, names left over
+    when the rate budget is spent are reported as rate limited, and results keep the input order.
+    """
+    settings.GEOCODE_RATE_LIMIT = 2
+    geocoded = []
+
+    def handler(request):
+        name = request.url.params['q']
+        geocoded.append(name)
+        if name == 'Nowhere':
+            return httpx.Response(200, json=[])
+        return httpx.Response(200, json=[{'name': name, 'country': 'UA', 'lat': 49.84, 'lon': 24.03}])
+
+    monkeypatch.setattr('weather_app.async_utils.new_client',
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    City.objects.create(name='Kyiv', country='UA', lat=50.45, lon=30.52)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(username='testuser'))
+
+    names = ['Lviv', ' KYIV ', 'Nowhere', 'lviv', 'Odesa', 'Kyiv']
+    response = client.post(reverse('city-resolve'), names, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    results = response.json()['results']
+    assert [result['name'] for result in results] == names
+    assert [result['status'] for result in results] == ['found', 'found', 'not_found', 'found', 'rate_limited',
+                                                        'found']
+    assert results[0]['city']['name'] == 'Lviv'
+    assert results[1]['city']['name'] == 'Kyiv'
+    assert sorted(geocoded) == ['Lviv', 'Nowhere']
+    assert City.objects.filter(search_name='lviv').exists()
+
+    response = client.post(reverse('city-resolve'), {'names': names}, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_city_resolve_view_provider_down(monkeypatch, settings):
+    """
+    Test that names the provider fails to geocode are reported as unavailable, counted by its circuit
+    breaker, and that no call is made once the circuit is open.
+    """
+    settings.UPSTREAM_FAILURE_THRESHOLD = 2
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.params['q'])
+        return httpx.Response(200, content=b'<html>Bad gateway</html>')
+
+    monkeypatch.setattr('weather_app.async_utils.new_client',
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(username='testuser'))
+
+    response = client.post(reverse('city-resolve'), ['Lviv', 'Odesa'], format='json')
+    assert [result['status'] for result in response.json()['results']] == ['unavailable', 'unavailable']
+    response = client.post(reverse('city-resolve'), ['Kharkiv'], format='json')
+    assert [result['status'] for result in response.json()['results']] == ['unavailable']
+    assert sorted(calls) == ['Lviv', 'Odesa']
+
+
+@pytest.mark.django_db
+def test_weather_current_view(monkeypatch):
+    """
+    Test the multi-city current weather endpoint.
+    Cities given by id or coordinates are answered from the stored readings in one payload, and only
+    the stale and missing ones are refreshed in the background.
+    """
+    calls = []
+
+    def mock_get(url, **kwargs):
+        calls.append(url)
+        response = Mock(status_code=200)
+        response.json.return_value = {'name': 'Any City', 'weather': [{'description': 'Rain'}],
+                                      'main': {'temp': 10.0, 'pressure': 1000.0, 'humidity': 90.0},
+                                      'clouds': {'all': 100}, 'wind': {'speed': 3.0}}
+        return response
+
+    monkeypatch.setattr('requests.get', mock_get)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(username='testuser'))
+    fresh, stale, unread = (City.objects.create(name=f'Test City {i}', lat=10.0 * i, lon=10.0 * i) for i in range(3))
+    for city in (fresh, stale):
+        Weather.objects.create(city=city, description='Sunny', temp=25.0, pressure=1013.0, humidity=50.0,
+                               clouds='0', wind_speed=10.0)
+    Weather.objects.filter(city=stale).update(datetime=timezone.now() - timedelta(minutes=30))
+    # A backfilled reading stored last is not the latest one of its city.
+    backfilled = Weather.objects.create(city=fresh, description='Rain', temp=5.0, pressure=1000.0, humidity=90.0,
+                                        clouds='100', wind_speed=3.0)
+    Weather.objects.filter(id=backfilled.id).update(datetime=timezone.now() - timedelta(minutes=30))
+
+    response = client.get(reverse('weather-current'), {'cities': f'{fresh.id},{stale.id},{unread.id},0',
+                                                       'coords': '0.001,0.001;45,45'})
+    assert response.status_code == status.HTTP_200_OK
+    results = response.json()['results']
+    assert [(result['city'], result['status']) for result in results] == [
+        (fresh.id, 'fresh'), (stale.id, 'stale'), (unread.id, 'pending'), (0, 'not_found'), (fresh.id, 'fresh'),
+        (None, 'not_found')]
+    assert results[0]['weather']['temp'] == 25.0
+    assert results[1]['age'] >= 1800
+    assert len(calls) == 2
+
+    # Refreshed in the background, the unread city is now served from the cache with its age.
+    response = client.get(reverse('weather-current'), {'cities': f'{unread.id}'})
+    assert [(result['status'], result['age']) for result in response.json()['results']] == [('fresh', 0)]
+
+    response = client.get(reverse('weather-current'), {'coords': '1,2,3'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_weather_export_view():
+    """
+    Test the streaming weather export in NDJSON and gzipped CSV, filtered by city, and that malformed
+    bounds are rejected.
+    """
+    client = APIClient()
+    url = reverse('weather-export')
+    user = User.objects.create(username='testuser', password='testpassword')
+    city = City.objects.create(name='Test City')
+    other_city = City.objects.create(name='Other City')
+    for i in range(3):
+        Weather.objects.create(city=city, description='Sunny', temp=20.0 + i, pressure=1013.0, humidity=50.0,
+                               clouds='0', wind_speed=10.0)
+    Weather.objects.create(city=other_city, description='Rain', temp=5.0, pressure=1000.0, humidity=90.0,
+                           clouds='100', wind_speed=3.0)
+    client.force_authenticate(user=user)
+
+    response = client.get(url, {'city': city.id})
+    assert response.status_code == status.HTTP_200_OK
+    assert response['Content-Type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+    assert [row['temp'] for row in rows] == [20.0, 21.0, 22.0]
+    assert {row['city_id'] for row in rows} == {city.id}
+
+    response = client.get(url, {'file_format': 'csv', 'gzip': '1'})
+    assert response.status_code == status.HTTP_200_OK
+    lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+    assert lines[0].split(',')[:3] == ['id', 'city_id', 'datetime']
+    assert len(lines) == 5
+
+    assert client.get(url, {'since': '2024-13-01'}).status_code == status.HTTP_400_BAD_REQUEST
+    assert client.get(url, {'until': 'yesterday'}).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_weather_list_view_serves_stale(monkeypatch):
+    """
+    Test stale-while-revalidate serving: a fresh stored reading is returned without calling the upstream,
+    an old one is returned immediately, marked stale, and refreshed once in the background.
+    """
+    calls = []
+
+    def mock_get(url, **kwargs):
+        calls.append(url)
+        response = Mock(status_code=200)
+        response.json.return_value = {'name': 'Test City', 'weather': [{'description': 'Rain'}],
+                                      'main': {'temp': 10.0, 'pressure': 1000.0, 'humidity': 90.0},
+                                      'clouds': {'all': 100}, 'wind': {'speed': 3.0}}
+        return response
+
+    monkeypatch.setattr('requests.get', mock_get)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(username='testuser'))
+    url = reverse('weather-list')
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    reading = Weather.objects.create(city=city, description='Sunny', temp=25.0, pressure=1013.0, humidity=50.0,
+                                     clouds='0', wind_speed=10.0)
+
+    response = client.get(url, {'lat': 50.45, 'lon': 30.52})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['description'] == 'Sunny'
+    assert response['X-Weather-Stale'] == 'false'
+    assert not calls
+
+    Weather.objects.filter(pk=reading.pk).update(datetime=timezone.now() - timedelta(minutes=30))
+    response = client.get(url, {'lat': 50.45, 'lon': 30.52})
+    assert response.json()['description'] == 'Sunny'
+    assert response['X-Weather-Stale'] == 'true'
+    assert int(response['Age']) >= 30 * 60
+    assert len(calls) == 1
+    assert city.weather_data.latest('datetime').description == 'Rain'
+
+
+@pytest.mark.django_db
+def test_fast_list_matches_serializer_output(settings):
+    """
+    Test that the .values() fast path returns exactly the serializer output, rendered and parsed with orjson,
+    with the keys in the same order.
+    """
+    city = City.objects.create(name='Test City', country='UA', lat=50.45, lon=30.52)
+    Weather.objects.create(city=city, description='Sunny', temp=25.5, pressure=1013.0, humidity=50.0, clouds='0',
+                           wind_speed=3.5)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(username='testuser'))
+
+    settings.API_FAST_LIST = False
+    slow = [client.get(reverse(name)) for name in ('city-list', 'weather-list')]
+    settings.API_FAST_LIST = True
+    fast = [client.get(reverse(name)) for name in ('city-list', 'weather-list')]
+    for slow_response, fast_response in zip(slow, fast):
+        assert fast_response.status_code == status.HTTP_200_OK
+        assert fast_response.json() == slow_response.json()
+        assert [list(row) for row in fast_response.json()] == [list(row) for row in slow_response.json()]
+        assert fast_response.content == slow_response.content
+    assert fast[1].json() == [{'city': city.id, 'description': 'Sunny', 'temp': 25.5, 'pressure': 1013.0,
+                               'humidity': 50.0, 'clouds': 0, 'wind_speed': 3.5}]
+
+    response = client.post(reverse('subscribedcity-bulk'), b'[{"city": 1,', content_type='application/json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_cached_weather_age_headers():
+    """
+    Test that weather served from the cache reports the time since it was fetched in the Age header.
+    """
+    city = City.objects.create(name='Test City', lat=50.45, lon=30.52)
+    weather_data = {'city': city.id, 'description': 'Sunny', 'temp': 25.0, 'pressure': 1013.0, 'humidity': 50.0,
+                    'clouds': 0, 'wind_speed': 10.0}
+    cache.set(weather_cache_key(city.id), (time.time() - 120, weather_data))
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(username='testuser'))
+
+    response = client.get(reverse('weather-list'), {'lat': 50.45, 'lon': 30.52})
+    assert response.status_code == status.HTTP_200_OK
+    assert 120 <= int(response['Age']) < 130
+    assert response['X-Weather-Stale'] == 'false'
+    assert response.json()['temp'] == 25.0
@@ -0,0 +1,50 @@
+from datetime import timedelta
+from unittest.mock import Mock
+
+import pytest
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django_celery_beat.models import IntervalSchedule, PeriodicTask
+
+from weather_app.models import City, SubscribedCity, Weather
+from weather_app.subscriptions import SUBSCRIPTION_TASK, subscription_task_name
+from weather_app.warming import plan_warming, warm_weather_cache
+
+
+def subscribe(user: User, city: City, last_run_minutes_ago: int, period: int = 60) -> SubscribedCity:
+    subscription = SubscribedCity.objects.create(user=user, city=city, period_notifications=period)
+    interval, _ = IntervalSchedule.objects.get_or_create(every=period, period=IntervalSchedule.MINUTES)
+    PeriodicTask.objects.create(name=subscription_task_name(subscription), task=SUBSCRIPTION_TASK, interval=interval,
+                                last_run_at=timezone.now() - timedelta(minutes=last_run_minutes_ago))
+    return subscription
+
+
+@pytest.mark.django_db
+def test_warming_ranks_due_cities(monkeypatch, settings):
+    """
+    Test that only cities with notifications due soon are warmed, most subscribed first, skipping fresh readings,
+    with the subscriptions and readings read in chunks.
+    """
+    settings.BULK_SUBSCRIPTIONS_CHUNK_SIZE = 2
+    users = [User.objects.create(username=f'user{i}', email=f'user{i}@example.com') for i in range(3)]
+    kyiv, lviv, odesa, dnipro = (City.objects.create(name=name, lat=lat, lon=30.0) for name, lat in
+                                 (('Kyiv', 50.0), ('Lviv', 49.0), ('Odesa', 46.0), ('Dnipro', 48.0)))
+    subscribe(users[0], kyiv, 58)
+    subscribe(users[0], lviv, 59)
+    subscribe(users[1], lviv, 57)
+    subscribe(users[0], odesa, 10)
+    subscribe(users[2], dnipro, 59)
+    Weather.objects.create(city=dnipro, description='Sunny', temp=20, pressure=1000, humidity=50, clouds='0',
+                           wind_speed=1)
+
+    assert plan_warming(timezone.now()) == [(lviv.id, 2), (kyiv.id, 1)]
+
+    response = Mock(status_code=200)
+    response.json.return_value = {'name': 'City', 'weather': [{'description': 'Sunny'}],
+                                  'main': {'temp': 25.0, 'pressure': 1013.0, 'humidity': 50.0},
+                                  'clouds': {'all': 0}, 'wind': {'speed': 10.0}}
+    get = Mock(return_value=response)
+    monkeypatch.setattr('requests.get', get)
+    assert warm_weather_cache() == 2
+    assert get.call_count == 2
+    assert plan_warming(timezone.now()) == []
@@ -0,0 +1,100 @@
+from datetime import timedelta
+from unittest.mock import Mock
+
+import pytest
+import requests
+from django.core.management import call_command
+from django.utils import timezone
+
+from weather_app.models import WebhookEndpoint, WebhookDeadLetter
+from weather_app.webhooks import deliver_webhook, endpoint_is_blocked
+
+URL = 'http://hooks.example.com/weather'
+PAYLOAD = {'text': {'city': 'Test City'}}
+
+
+@pytest.fixture
+def mock_requests_post(monkeypatch):
+    """
+    Fixture that mocks requests.post and records the calls. Set ``fail`` to make every call time out.
+    """
+    calls = Mock(fail=False, count=0)
+
+    def mock_post(url, json, timeout):
+        calls.count += 1
+        if calls.fail:
+            raise requests.Timeout('timed out')
+        response = Mock()
+        response.raise_for_status.return_value = None
+        return response
+
+    monkeypatch.setattr('requests.post', mock_post)
+    return calls
+
+
+@pytest.mark.django_db
+def test_circuit_opens_after_threshold(mock_requests_post, settings):
+    """
+    Test that consecutive failures open the circuit and that an open circuit rejects deliveries
+    without touching the network, sending every payload to the dead-letter table.
+    """
+    settings.WEBHOOK_FAILURE_THRESHOLD = 2
+    mock_requests_post.fail = True
+    assert not deliver_webhook(URL, PAYLOAD)
+    assert not deliver_webhook(URL, PAYLOAD)
+    assert WebhookEndpoint.objects.get(url=URL).state == WebhookEndpoint.OPEN
+
+    assert not deliver_webhook(URL, PAYLOAD)
+    assert mock_requests_post.count == 2
+    assert WebhookDeadLetter.objects.filter(endpoint__url=URL).count() == 3
+
+
+@pytest.mark.django_db
+def test_half_open_probe_closes_circuit(mock_requests_post, settings):
+    """
+    Test that once the recovery timeout has passed a single probe is let through and closes the circuit.
+    """
+    endpoint = WebhookEndpoint.objects.create(url=URL, state=WebhookEndpoint.OPEN, consecutive_failures=3,
+                                              opened_at=timezone.now() - settings.WEBHOOK_RECOVERY_TIMEOUT)
+    assert deliver_webhook(URL, PAYLOAD)
+    endpoint.refresh_from_db()
+    assert endpoint.state == WebhookEndpoint.CLOSED
+    assert endpoint.consecutive_failures == 0
+
+
+@pytest.mark.django_db
+def test_stuck_half_open_probe_is_replaced(mock_requests_post, settings):
+    """
+    Test that a half-open circuit whose probe never reported back lets a new probe through after the recovery timeout.
+    """
+    endpoint = WebhookEndpoint.objects.create(url=URL, state=WebhookEndpoint.HALF_OPEN, consecutive_failures=3,
+                                              opened_at=timezone.now() - timedelta(seconds=1))
+    assert endpoint_is_blocked(endpoint)
+    assert not deliver_webhook(URL, PAYLOAD)
+    assert mock_requests_post.count == 0
+
+    WebhookEndpoint.objects.filter(pk=endpoint.pk).update(opened_at=timezone.now() - settings.WEBHOOK_RECOVERY_TIMEOUT)
+    endpoint.refresh_from_db()
+    assert not endpoint_is_blocked(endpoint)
+    assert deliver_webhook(URL, PAYLOAD)
+    endpoint.refresh_from_db()
+    assert endpoint.state == WebhookEndpoint.CLOSED
+
+
+@pytest.mark.django_db
+def test_endpoint_auto_paused_and_replayed(mock_requests_post, settings):
+    """
+    Test that an endpoint failing for too long is paused and that the replay command resumes it
+    and redelivers its dead letters.
+    """
+    WebhookEndpoint.objects.create(url=URL, consecutive_failures=1,
+                                   failing_since=timezone.now() - settings.WEBHOOK_AUTO_PAUSE_AFTER - timedelta(1))
+    mock_requests_post.fail = True
+    assert not deliver_webhook(URL, PAYLOAD)
+    assert WebhookEndpoint.objects.get(url=URL).is_paused
+
+    mock_requests_post.fail = False
+    call_command('replay_webhooks', url=URL, resume=True)
+    endpoint = WebhookEndpoint.objects.get(url=URL)
+    assert not endpoint.is_paused
+    assert not endpoint.dead_letters.filter(replayed_at__isnull=True).exists()
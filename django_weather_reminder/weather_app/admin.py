@@ -1,7 +1,12 @@
 from django.contrib import admin
 
-from .models import City, SubscribedCity, Weather
+from .models import City, SubscribedCity, Weather, WebhookEndpoint, WebhookDeadLetter, SchedulerLease, \
+    NotificationDelivery
 
 admin.site.register(City)
 admin.site.register(SubscribedCity)
 admin.site.register(Weather)
+admin.site.register(WebhookEndpoint)
+admin.site.register(WebhookDeadLetter)
+admin.site.register(SchedulerLease)
+admin.site.register(NotificationDelivery)
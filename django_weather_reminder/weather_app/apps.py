@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class WeatherAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'weather_app'
+
+    def ready(self):
+        from weather_app import spatial  # noqa: F401 registers the signals keeping the city index current
+        from weather_app import authentication  # noqa: F401 registers the signals invalidating cached users
+        from weather_app import live  # noqa: F401 registers the signal publishing stored readings
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils import timezone
+
+from weather_app.buffers import weather_buffer
+from weather_app.models import City, Weather
+from weather_app.serializers import CitySerializer, WeatherSerializer
+from weather_app import metrics
+from weather_app.providers import CircuitOpen, ProviderError, circuit_accepts_requests, get_primary_provider, \
+    record_provider_failure, record_provider_success
+from weather_app.spatial import snap_to_city
+from weather_app.utils import cache_city_weather, cached_weather, weather_cache_key, weather_fields
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=settings.WEATHER_API_TIMEOUT,
+                             limits=httpx.Limits(max_connections=settings.ASYNC_HTTP_MAX_CONNECTIONS,
+                                                 max_keepalive_connections=100))
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the HTTP client shared by the async views of this process.
+
+    One pooled client keeps the upstream connections alive across requests; its pool is sized
+    by ASYNC_HTTP_MAX_CONNECTIONS, the number of upstream calls one process keeps in flight.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = new_client()
+    return _client
+
+
+async def aget_city_data(city_name: str, lang: str = 'en') -> dict | None:
+    """
+    Async counterpart of ``get_city_data``.
+
+    :return: The city data as a dictionary, or None if there is a problem with fetching it.
+    """
+    local_city = await City.objects.filter(search_name=City.normalize_name(city_name)).afirst()
+    if local_city:
+        return CitySerializer(local_city).data
+    try:
+        return await afetch_city_data(city_name, lang)
+    except ProviderError as e:
+        logger.error(f'Could not fetch city {city_name}: {e}')
+        return None
+
+
+async def afetch_city_data(city_name: str, lang: str = 'en', client: httpx.AsyncClient | None = None) -> dict | None:
+    """
+    Geocode a city with the primary provider through its circuit breaker, without looking it up
+    locally first, and store it if it is new.
+
+    :return: The city data as a dictionary, or None if the provider does not know the city.
+    :raises CircuitOpen: Without calling the provider, while its circuit is open.
+    :raises ProviderError: If the provider cannot be reached or answers with an error.
+    """
+    provider = get_primary_provider()
+    if not await sync_to_async(circuit_accepts_requests)(provider.name):
+        raise CircuitOpen(f'Circuit of weather provider {provider.name} is open')
+    try:
+        try:
+            response = await (client or get_client()).get(provider.geocode_url(city_name, lang))
+        except httpx.HTTPError as e:
+            raise ProviderError(f'{provider.name}: {e}') from e
+        city_data = provider.parse('parse_geocode', provider.decode(response))
+    except ProviderError:
+        await sync_to_async(record_provider_failure)(provider.name)
+        raise
+    await sync_to_async(record_provider_success)(provider.name)
+    if not city_data:
+        return None
+    serializer_city = CitySerializer(data=city_data)
+    if serializer_city.is_valid():
+        exists = await City.objects.using(router.db_for_write(City)).filter(
+            lat=city_data['lat'], lon=city_data['lon']).aexists()
+        if not exists:
+            await City.objects.acreate(**serializer_city.validated_data)
+    return serializer_city.data
+
+
+async def afetch_cities(city_names: list, concurrency: int, lang: str = 'en') -> list:
+    """
+    Geocode many cities with the API, at most ``concurrency`` requests in flight.
+
+    Meant to be run with ``async_to_sync`` from sync code, so it uses a client of its own instead
+    of the one shared by the async views, which is bound to their event loop.
+
+    :return: The city data, None or the ProviderError of each name, in the order of ``city_names``.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(city_name):
+        async with semaphore:
+            try:
+                return await afetch_city_data(city_name, lang, client)
+            except ProviderError as e:
+                logger.error(f'Could not fetch city {city_name}: {e}')
+                return e
+
+    async with new_client() as client:
+        return await asyncio.gather(*(fetch(city_name) for city_name in city_names))
+
+
+async def aget_weather_data_coord(lat: float, lon: float, city: City | None = None, units: str = 'metric',
+                                  lang: str = 'en') -> dict | None:
+    """
+    Async counterpart of ``get_weather_data_coord``. Only the primary provider is asked, the
+    views are not hedged, through its circuit breaker.
+
+    :return: A dictionary containing the weather data, the latest stored reading of the city marked stale
+        while the provider is unavailable, or None if there is a problem with fetching it.
+    """
+    provider = get_primary_provider()
+    if not await sync_to_async(circuit_accepts_requests)(provider.name):
+        return await aweather_fallback(city)
+    try:
+        try:
+            response = await get_client().get(provider.current_url(lat, lon, units, lang))
+        except httpx.HTTPError as e:
+            raise ProviderError(f'{provider.name}: {e}') from e
+        weather_data = provider.parse('parse_current', provider.decode(response), lat, lon)
+    except ProviderError as e:
+        logger.error(f'Could not fetch weather at {lat},{lon}: {e}')
+        await sync_to_async(record_provider_failure)(provider.name)
+        return await aweather_fallback(city)
+    await sync_to_async(record_provider_success)(provider.name)
+    if not weather_data:
+        return None
+    if city is None and weather_data['name']:
+        city = await City.objects.using(router.db_for_write(City)).filter(name=weather_data['name']).afirst()
+        if city is None:
+            city = await City.objects.acreate(name=weather_data['name'], country=weather_data['country'] or '',
+                                              lat=weather_data['lat'], lon=weather_data['lon'])
+    elif city is None:
+        city = await sync_to_async(snap_to_city)(lat, lon)
+        if city is None:
+            return None
+    serializer_weather_data = WeatherSerializer(data=weather_fields(weather_data, city))
+    # Validating the city relation queries the database.
+    if not await sync_to_async(serializer_weather_data.is_valid)():
+        return serializer_weather_data.data
+    reading = Weather(**serializer_weather_data.validated_data)
+    await sync_to_async(weather_buffer.add)(reading)
+    return WeatherSerializer(reading).data
+
+
+async def aweather_fallback(city: City | None) -> dict | None:
+    """
+    Async counterpart of ``weather_fallback``, for a known city only.
+    """
+    if city is None:
+        return None
+    reading = await aget_latest_reading(city, settings.UPSTREAM_FALLBACK_MAX_AGE)
+    if reading is None:
+        return None
+    await sync_to_async(metrics.observe)(metrics.UPSTREAM_FALLBACKS, 1)
+    age = timezone.now() - reading.datetime
+    return {**WeatherSerializer(reading).data, 'stale': True, 'age': int(age.total_seconds())}
+
+
+async def aget_city_weather(city: City) -> dict | None:
+    """
+    Async counterpart of ``get_city_weather``, sharing its cache entries.
+    """
+    entry = await cache.aget(weather_cache_key(city.pk))
+    if entry is not None:
+        return cached_weather(entry)
+    weather_data = await aget_weather_data_coord(city.lat, city.lon, city=city)
+    if weather_data is not None and not weather_data.get('stale'):
+        await sync_to_async(cache_city_weather)(city.pk, weather_data)
+    return weather_data
+
+
+async def aget_latest_reading(city: City, max_age: timedelta) -> Weather | None:
+    """
+    Async counterpart of ``get_latest_reading``.
+    """
+    return await (city.weather_data.filter(datetime__gte=timezone.now() - max_age).select_related('description_ref')
+                  .order_by('-datetime').afirst())
@@ -0,0 +1,137 @@
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+
+from weather_app.async_utils import aget_city_data, aget_city_weather, aget_latest_reading, aget_weather_data_coord
+from weather_app.authentication import CachedJWTAuthentication
+from weather_app.live import redeem_stream_ticket, stream_readings
+from weather_app.models import City, SubscribedCity, Weather
+from weather_app.serializers import CitySerializer, WeatherSerializer
+from weather_app.spatial import snap_to_city
+from weather_app.utils import schedule_weather_refresh
+from weather_app.views import with_age_headers
+
+
+async def authenticate_jwt(request, stream_ticket: bool = False):
+    """
+    Return the user of the JWT access token of a request, or None when it has no valid token.
+    With ``stream_ticket`` a ticket from ``WeatherViewSet.stream_ticket`` may be given in the
+    ``ticket`` query parameter instead, for clients such as EventSource that cannot set headers.
+    """
+    authentication = CachedJWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if raw_token is None:
+        ticket = request.GET.get('ticket') if stream_ticket else None
+        user_id = await sync_to_async(redeem_stream_ticket)(ticket) if ticket else None
+        if user_id is None:
+            return None
+        return await User.objects.filter(pk=user_id, is_active=True).afirst()
+    try:
+        token = authentication.get_validated_token(raw_token)
+        return await sync_to_async(authentication.get_user)(token)
+    except AuthenticationFailed:
+        return None
+
+
+def async_api_view(view=None, stream_ticket: bool = False):
+    """
+    Serve an async view to GET requests with a valid JWT access token, like a DRF list action
+    with IsAuthenticated.
+    """
+    if view is None:
+        return lambda view: async_api_view(view, stream_ticket=stream_ticket)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        user = await authenticate_jwt(request, stream_ticket)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user = user
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@async_api_view
+async def city_list(request):
+    """
+    Async variant of ``CityViewSet.list``, served through ASGI.
+
+    Upstream geocoding waits on the shared async HTTP client instead of blocking a worker.
+    """
+    city_name = request.GET.get('city_name')
+    if not city_name:
+        return JsonResponse([CitySerializer(city).data async for city in City.objects.all()], safe=False)
+    city_data = await aget_city_data(city_name)
+    if city_data:
+        return JsonResponse(city_data)
+    return JsonResponse({'error': 'City data not found'}, status=404)
+
+
+@async_api_view
+async def weather_list(request):
+    """
+    Async variant of ``WeatherViewSet.list``, served through ASGI.
+
+    Coordinates are snapped to known cities and stale readings are served with a background
+    refresh exactly as by the sync view; only the upstream call and the queries are awaited.
+    """
+    lat, lon = request.GET.get('lat'), request.GET.get('lon')
+    if not (lat and lon):
+        return JsonResponse([WeatherSerializer(reading).data async for reading in
+                             Weather.objects.select_related('description_ref')], safe=False)
+    try:
+        lat, lon = float(lat), float(lon)
+    except ValueError:
+        return JsonResponse({'error': 'lat and lon must be numbers'}, status=400)
+    city = await sync_to_async(snap_to_city)(lat, lon)
+    if city and settings.WEATHER_SERVE_STALE:
+        reading = await aget_latest_reading(city, settings.WEATHER_SERVE_STALE_FOR)
+        if reading:
+            age = timezone.now() - reading.datetime
+            stale = age > settings.WEATHER_SERVE_STALE_AFTER
+            if stale:
+                await sync_to_async(schedule_weather_refresh)(city)
+            return with_age_headers(JsonResponse(WeatherSerializer(reading).data), age, stale)
+    if city:
+        weather_data = await aget_city_weather(city)
+    else:
+        weather_data = await aget_weather_data_coord(lat, lon)
+    if weather_data is None:
+        return JsonResponse({'error': 'Problem with fetching weather data'}, status=500)
+    age = timedelta(seconds=weather_data.get('age', 0))
+    return with_age_headers(JsonResponse(weather_data), age,
+                            weather_data.get('stale', False) or age > settings.WEATHER_SERVE_STALE_AFTER)
+
+
+@async_api_view(stream_ticket=True)
+async def weather_stream(request):
+    """
+    Stream the new readings of the cities the user is subscribed to as Server-Sent Events.
+
+    Each reading is sent as a ``weather`` event whose data is the reading as JSON, as soon as it
+    is stored, instead of clients polling ``WeatherViewSet``. Users without subscriptions get
+    204, which tells EventSource not to reconnect. The stream ends when the client disconnects,
+    noticed through ``DisconnectMiddleware``, or after LIVE_UPDATES_MAX_AGE seconds.
+    """
+    if not settings.LIVE_UPDATES_URL:
+        return JsonResponse({'error': 'Live updates are not enabled'}, status=503)
+    city_ids = [city_id async for city_id in
+                SubscribedCity.objects.filter(user=request.user).values_list('city_id', flat=True).distinct()]
+    if not city_ids:
+        return HttpResponse(status=204)
+    # Only ASGI requests carry a scope, under WSGI the stream ends after LIVE_UPDATES_MAX_AGE.
+    disconnected = getattr(request, 'scope', {}).get('disconnected')
+    response = StreamingHttpResponse(stream_readings(city_ids, disconnected), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+User = get_user_model()
+
+
+class LocalUserCache:
+    """
+    Small per-process LRU of users whose entries expire after ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return user
+
+    def set(self, user_id, user) -> None:
+        with self._lock:
+            self._users[user_id] = (time.monotonic() + self.ttl, user)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+    def delete(self, user_id) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+
+
+local_user_cache = LocalUserCache(ttl=settings.AUTH_USER_LOCAL_CACHE_TTL,
+                                  max_size=settings.AUTH_USER_LOCAL_CACHE_SIZE)
+
+
+def user_cache_key(user_id) -> str:
+    return f'auth:user:{user_id}'
+
+
+def invalidate_user(user_id) -> None:
+    """
+    Drop a user from the shared cache and the cache of this process.
+    """
+    cache.delete(user_cache_key(user_id))
+    local_user_cache.delete(user_id)
+
+
+def invalidate_user_on_commit(user_id, using: str) -> None:
+    """
+    Drop a changed user from the caches now and again once the change is committed, as a request
+    running before the commit may cache the old row again.
+    """
+    invalidate_user(user_id)
+    transaction.on_commit(lambda: invalidate_user(user_id), using=using)
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, using, **kwargs) -> None:
+    # Covers password changes and deactivation, which are saved through the model.
+    invalidate_user_on_commit(getattr(instance, api_settings.USER_ID_FIELD), using)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, using, **kwargs) -> None:
+    invalidate_user_on_commit(getattr(instance, api_settings.USER_ID_FIELD), using)
+
+
+def cached_user_fields() -> list:
+    """
+    Return the fields of a user kept in the caches: those the authentication and permission checks
+    and the views read. Other fields, the password hash first, are loaded on access.
+    """
+    names = {User._meta.pk.attname, User.USERNAME_FIELD, User.get_email_field_name(), 'is_active', 'is_staff',
+             'is_superuser'}
+    # In the order of the model, as expected by Model.from_db.
+    return [field.attname for field in User._meta.concrete_fields if field.attname in names]
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving the user of a token through a cache instead of one query per request.
+
+    Users are looked up in a per-process cache (AUTH_USER_LOCAL_CACHE_TTL), then in the shared
+    cache (AUTH_USER_CACHE_TTL), then in the primary database, never a replica that may lag behind
+    a deactivation. Only ``cached_user_fields`` and, with CHECK_REVOKE_TOKEN, the digest of the
+    password that tokens carry are cached. Saving or deleting a user invalidates both caches of
+    this process and the shared one; other processes notice within the short local TTL.
+    Changes made with ``QuerySet.update()`` send no signals and are picked up when the entries expire.
+    The active and revoked-token checks run on every request as with JWTAuthentication.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        entry = local_user_cache.get(user_id)
+        if entry is None:
+            entry = cache.get(user_cache_key(user_id))
+            if entry is None:
+                entry = self.load_user(user_id)
+                cache.set(user_cache_key(user_id), entry, settings.AUTH_USER_CACHE_TTL)
+            local_user_cache.set(user_id, entry)
+        database, fields, password_digest = entry
+        # Requests must not share one instance; the fields not cached are deferred.
+        user = User.from_db(database, list(fields), list(fields.values()))
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_digest:
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
+
+    def load_user(self, user_id) -> tuple:
+        """
+        Load a user from the primary database.
+
+        :return: The database alias, the ``cached_user_fields`` of the user and the digest of its password.
+        """
+        database = router.db_for_write(User)
+        try:
+            user = User.objects.using(database).get(**{api_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        fields = {name: getattr(user, name) for name in cached_user_fields()}
+        password_digest = get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None
+        return database, fields, password_digest
@@ -0,0 +1,103 @@
+import logging
+import time
+from datetime import datetime
+
+from celery import current_app
+from celery.signals import before_task_publish, task_prerun
+from django.conf import settings
+from django.core.cache import cache
+
+from weather_app import metrics
+
+logger = logging.getLogger(__name__)
+
+NORMAL = 0
+# Hold due subscriptions longer so more of them share one city batch
+COALESCE = 1
+# Also drop queued sends that a newer slot of the same subscription superseded
+DROP_SUPERSEDED = 2
+# Also send each subscriber at most one forecast per BACKPRESSURE_DIGEST_PERIOD
+DIGEST = 3
+
+LEVEL_CACHE_KEY = 'backpressure:level'
+LATENCY_HEADER = 'due_at'
+
+
+def due_at(eta) -> float:
+    """
+    Return the time a task published with an ``eta`` header becomes due, as a timestamp.
+
+    Tasks with a countdown or an eta wait in the broker on purpose; their queue latency starts
+    when they are due, not when they are published.
+    """
+    if eta is None:
+        return time.time()
+    if isinstance(eta, str):
+        eta = datetime.fromisoformat(eta)
+    return max(eta.timestamp(), time.time())
+
+
+@before_task_publish.connect
+def stamp_due_at(headers=None, **kwargs) -> None:
+    if headers is not None:
+        headers[LATENCY_HEADER] = due_at(headers.get('eta'))
+
+
+@task_prerun.connect
+def record_queue_latency(task=None, **kwargs) -> None:
+    stamped_at = getattr(task.request, LATENCY_HEADER, None) if task is not None else None
+    if stamped_at:
+        metrics.gauge(metrics.TASK_QUEUE_LATENCY, max(time.time() - stamped_at, 0))
+
+
+def sample_queue_depth() -> int | None:
+    """
+    Return the number of messages waiting in all the queues of the Redis broker, None if it cannot be sampled.
+
+    With priorities every queue is a list per priority step, named ``<queue><sep><step>``.
+    """
+    if current_app.conf.task_always_eager:
+        return 0
+    options = current_app.conf.broker_transport_options or {}
+    sep, steps = options.get('sep', '\x06\x16'), options.get('priority_steps', [0, 3, 6, 9])
+    try:
+        with current_app.connection_for_read() as connection:
+            pipeline = connection.default_channel.client.pipeline()
+            for queue in current_app.conf.task_queues or ():
+                for step in steps:
+                    pipeline.llen(f'{queue.name}{sep}{step}' if step else queue.name)
+            return sum(pipeline.execute())
+    except Exception as e:
+        logger.warning(f'Could not sample the broker queue depth: {e}')
+        return None
+
+
+def level_for(value: float | None, thresholds: tuple) -> int:
+    if value is None:
+        return NORMAL
+    return sum(value >= threshold for threshold in thresholds)
+
+
+def degradation_level() -> int:
+    """
+    Return the current degradation level of the dispatch, from the broker queue depth and the
+    latency of the last started task against BACKPRESSURE_DEPTH_THRESHOLDS and
+    BACKPRESSURE_LATENCY_THRESHOLDS.
+
+    The level is sampled at most once per BACKPRESSURE_SAMPLE_INTERVAL seconds across processes
+    and reported as a metric with the depth.
+    """
+    level = cache.get(LEVEL_CACHE_KEY)
+    if level is not None:
+        return level
+    depth = sample_queue_depth()
+    latency = metrics.read(metrics.TASK_QUEUE_LATENCY).get('value')
+    level = max(level_for(depth, settings.BACKPRESSURE_DEPTH_THRESHOLDS),
+                level_for(latency, settings.BACKPRESSURE_LATENCY_THRESHOLDS))
+    cache.set(LEVEL_CACHE_KEY, level, settings.BACKPRESSURE_SAMPLE_INTERVAL)
+    if depth is not None:
+        metrics.gauge(metrics.BROKER_QUEUE_DEPTH, depth)
+    if level != metrics.read(metrics.DEGRADATION_LEVEL).get('value', NORMAL):
+        logger.warning(f'Dispatch degradation level {level} (queue depth {depth}, task latency {latency}s)')
+    metrics.gauge(metrics.DEGRADATION_LEVEL, level)
+    return level
@@ -0,0 +1,130 @@
+import atexit
+import logging
+import threading
+import time
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.conf import settings
+from django.db import connections, models
+
+from weather_app import metrics
+from weather_app.live import publish_readings
+from weather_app.models import Weather
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Accumulate unsaved model instances and insert them with one ``bulk_create``.
+
+    The buffer is flushed when it holds ``max_size`` instances or when the oldest one has waited
+    ``max_delay`` seconds, whichever comes first. A ``max_size`` of 1 writes every instance
+    through immediately. Each flush reports its latency and size to the metrics, and passes the
+    written instances to ``on_flush`` if given, as bulk inserts send no ``post_save``.
+
+    Instances a flush fails to write are put back and retried by the next flush, after ``max_delay``
+    seconds at the latest; beyond ``max_backlog`` instances the oldest are dropped.
+    """
+
+    def __init__(self, model: type[models.Model], max_size: int, max_delay: float, latency_metric: str,
+                 size_metric: str, on_flush=None, max_backlog: int = 1000):
+        self.model = model
+        self.on_flush = on_flush
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_backlog = max(max_backlog, max_size)
+        self.latency_metric = latency_metric
+        self.size_metric = size_metric
+        self._items = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, instance: models.Model) -> None:
+        """
+        Buffer an instance, flushing if the buffer is full.
+        """
+        with self._lock:
+            self._items.append(instance)
+            full = len(self._items) >= self.max_size
+            if not full:
+                self._schedule_flush()
+        if full:
+            self.flush()
+
+    def _schedule_flush(self) -> None:
+        # Called with the lock held.
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_delay, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_on_timer(self) -> None:
+        try:
+            self.flush()
+        except Exception:
+            # Logged and put back by flush, the timer of the retry is already scheduled.
+            pass
+        finally:
+            # The timer thread opened its own database connection.
+            connections.close_all()
+
+    def flush(self) -> int:
+        """
+        Insert every buffered instance.
+
+        :return: The number of instances written.
+        :raises Exception: The error of ``bulk_create``, once the instances are put back.
+        """
+        with self._lock:
+            items, self._items = self._items, []
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+        if not items:
+            return 0
+        started = time.perf_counter()
+        try:
+            self.model.objects.bulk_create(items)
+        except Exception:
+            logger.exception(f'Could not write {len(items)} buffered {self.model.__name__} rows, retrying later')
+            self._put_back(items)
+            raise
+        metrics.observe(self.latency_metric, (time.perf_counter() - started) * 1000)
+        metrics.observe(self.size_metric, len(items))
+        if self.on_flush is not None:
+            self.on_flush(items)
+        return len(items)
+
+    def _put_back(self, items: list) -> None:
+        """
+        Return instances that could not be written to the front of the buffer, keeping the newest
+        ``max_backlog``, and schedule their retry.
+        """
+        with self._lock:
+            self._items = items + self._items
+            dropped = len(self._items) - self.max_backlog
+            if dropped > 0:
+                logger.error(f'Write-behind buffer of {self.model.__name__} over {self.max_backlog} rows, '
+                             f'dropped the {dropped} oldest')
+                del self._items[:dropped]
+            self._schedule_flush()
+
+
+weather_buffer = WriteBehindBuffer(Weather, max_size=settings.WEATHER_WRITE_BUFFER_SIZE,
+                                   max_delay=settings.WEATHER_WRITE_BUFFER_DELAY,
+                                   latency_metric=metrics.WEATHER_FLUSH_LATENCY, size_metric=metrics.WEATHER_FLUSH_SIZE,
+                                   on_flush=publish_readings,
+                                   max_backlog=settings.WEATHER_WRITE_BUFFER_MAX_BACKLOG)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_on_shutdown(**kwargs) -> None:
+    weather_buffer.flush()
+
+
+atexit.register(weather_buffer.flush)
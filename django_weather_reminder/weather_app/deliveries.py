@@ -0,0 +1,112 @@
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Q
+from django.utils import timezone
+
+from weather_app.models import NotificationDelivery, SubscribedCity
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def delivery_slot(period_minutes: int, now: datetime) -> datetime:
+    """
+    Return the start of the notification period of ``now``, for a subscription notified every ``period_minutes``.
+
+    Every send of the same period, e.g. by an overlapping beat tick or a retried chain, maps to the same slot.
+    """
+    period = timedelta(minutes=max(period_minutes, 1))
+    return EPOCH + ((now - EPOCH) // period) * period
+
+
+def claim_deliveries(subscriptions: list[SubscribedCity], now: datetime | None = None) -> dict:
+    """
+    Atomically claim the current slot of each subscription in the ledger.
+
+    The ledger rows are inserted with one ``bulk_create(ignore_conflicts=True)``; the unique
+    (subscription, slot) key makes the insert fail for slots claimed before, and the rows carrying
+    the token of this call tell which claims were won. Slots whose delivery failed are claimed again
+    with a conditional update, so the next dispatch in the period retries them.
+
+    :return: A dictionary of subscription id to the id of its claimed delivery, without the subscriptions
+        whose slot was already claimed, sent or superseded.
+    """
+    if not subscriptions:
+        return {}
+    now = now or timezone.now()
+    token = uuid.uuid4()
+    deliveries = [NotificationDelivery(subscription_id=subscription.id, claim_token=token,
+                                       slot=delivery_slot(subscription.period_notifications, now))
+                  for subscription in subscriptions]
+    NotificationDelivery.objects.bulk_create(deliveries, ignore_conflicts=True,
+                                             batch_size=settings.BULK_SUBSCRIPTIONS_CHUNK_SIZE)
+    by_slot = defaultdict(list)
+    for delivery in deliveries:
+        by_slot[delivery.slot].append(delivery.subscription_id)
+    chunk_size = settings.BULK_SUBSCRIPTIONS_CHUNK_SIZE
+    for slot, subscription_ids in by_slot.items():
+        for start in range(0, len(subscription_ids), chunk_size):
+            chunk = subscription_ids[start:start + chunk_size]
+            # Only one of concurrent claimers sees the row still failed and takes it over.
+            NotificationDelivery.objects.filter(slot=slot, subscription_id__in=chunk,
+                                                status=NotificationDelivery.FAILED).update(
+                status=NotificationDelivery.CLAIMED, claim_token=token, claimed_at=now)
+    return dict(NotificationDelivery.objects.filter(claim_token=token).values_list('subscription_id', 'id'))
+
+
+def delivery_is_pending(delivery_id: int) -> bool:
+    return NotificationDelivery.objects.filter(id=delivery_id, status=NotificationDelivery.CLAIMED).exists()
+
+
+def delivery_is_superseded(delivery_id: int) -> bool:
+    """
+    Return True if a later slot of the subscription of a delivery has been claimed.
+    """
+    return NotificationDelivery.objects.filter(
+        id=delivery_id, subscription__deliveries__slot__gt=F('slot')).exists()
+
+
+def recently_delivered(subscription_ids: list, since: datetime) -> set:
+    """
+    Return the ids of the subscriptions with a delivery claimed since a time.
+    """
+    return set(NotificationDelivery.objects.filter(subscription_id__in=subscription_ids, claimed_at__gte=since)
+               .exclude(status=NotificationDelivery.SUPERSEDED).values_list('subscription_id', flat=True))
+
+
+def mark_delivery(delivery_id: int, status: str) -> None:
+    NotificationDelivery.objects.filter(id=delivery_id).update(
+        status=status, sent_at=timezone.now() if status == NotificationDelivery.SENT else None)
+
+
+def delivery_report(since: datetime) -> dict:
+    """
+    Summarize the deliveries of the slots since a time: counts per status and the lag between the
+    start of the slot and the send.
+    """
+    lag = ExpressionWrapper(F('sent_at') - F('slot'), output_field=DurationField())
+    report = NotificationDelivery.objects.filter(slot__gte=since).aggregate(
+        total=Count('id'), sent=Count('id', filter=Q(status=NotificationDelivery.SENT)),
+        failed=Count('id', filter=Q(status=NotificationDelivery.FAILED)),
+        superseded=Count('id', filter=Q(status=NotificationDelivery.SUPERSEDED)),
+        pending=Count('id', filter=Q(status=NotificationDelivery.CLAIMED)),
+        mean_lag=Avg(lag, filter=Q(status=NotificationDelivery.SENT)),
+        max_lag=Max(lag, filter=Q(status=NotificationDelivery.SENT)))
+    return report
+
+
+def compact_deliveries(before: datetime, batch_size: int = 10000) -> int:
+    """
+    Delete the ledger rows of the slots before a time in batches of ``batch_size``.
+
+    :return: The number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        ids = list(NotificationDelivery.objects.filter(slot__lt=before).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # No signals or cascades hang off the ledger, so this is a single DELETE per batch.
+        deleted += NotificationDelivery.objects.filter(id__in=ids).delete()[0]
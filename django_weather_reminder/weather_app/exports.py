@@ -0,0 +1,108 @@
+import csv
+import json
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from django.db.models import QuerySet
+
+EXPORT_FIELDS = ('id', 'city_id', 'datetime', 'description', 'temp', 'pressure', 'humidity', 'clouds', 'wind_speed')
+# The columns the EXPORT_FIELDS are read from, the description from its interned text
+EXPORT_COLUMNS = tuple('description_ref__text' if field == 'description' else field for field in EXPORT_FIELDS)
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Encoded rows are joined into blocks of about this many bytes before being yielded.
+BLOCK_SIZE = 64 * 1024
+
+
+class _Echo:
+    """
+    A file-like object for csv.writer which returns the written line instead of storing it.
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def filter_weather(queryset: QuerySet, city: int | None = None, since: datetime | None = None,
+                   until: datetime | None = None) -> QuerySet:
+    """
+    Narrow weather readings down to a city and a time range.
+    """
+    if city is not None:
+        queryset = queryset.filter(city_id=city)
+    if since is not None:
+        queryset = queryset.filter(datetime__gte=since)
+    if until is not None:
+        queryset = queryset.filter(datetime__lt=until)
+    return queryset
+
+
+def iter_weather_rows(queryset: QuerySet, chunk_size: int) -> Iterator[tuple]:
+    """
+    Iterate over weather readings as plain tuples of EXPORT_FIELDS, in primary key order.
+
+    Rows are fetched ``chunk_size`` at a time (through a server-side cursor on PostgreSQL),
+    so memory use does not depend on the size of the queryset.
+    """
+    return queryset.order_by('id').values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+
+
+def encode_ndjson(rows: Iterable[tuple]) -> Iterator[str]:
+    """
+    Encode rows as newline delimited JSON objects.
+    """
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record['datetime'] = record['datetime'].isoformat()
+        yield json.dumps(record) + '\n'
+
+
+def encode_csv(rows: Iterable[tuple]) -> Iterator[str]:
+    """
+    Encode rows as CSV lines, starting with a header line.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def gzip_stream(blocks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Compress a stream of byte blocks into a gzip stream.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _join_blocks(lines: Iterable[str]) -> Iterator[bytes]:
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            yield ''.join(block).encode()
+            block, size = [], 0
+    if block:
+        yield ''.join(block).encode()
+
+
+def export_weather(queryset: QuerySet, file_format: str = 'ndjson', compress: bool = False,
+                   chunk_size: int = 2000) -> Iterator[bytes]:
+    """
+    Stream weather readings in NDJSON or CSV, optionally gzip compressed.
+
+    :param queryset: The weather readings to export.
+    :param file_format: 'ndjson' or 'csv'.
+    :param compress: Whether to gzip the output.
+    :param chunk_size: The number of rows fetched from the database at a time.
+    :return: An iterator of byte blocks.
+    """
+    encoder = encode_csv if file_format == 'csv' else encode_ndjson
+    blocks = _join_blocks(encoder(iter_weather_rows(queryset, chunk_size)))
+    return gzip_stream(blocks) if compress else blocks
@@ -0,0 +1,83 @@
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+
+from weather_app.models import City
+from weather_app.providers import ProviderError
+from weather_app.serializers import CitySerializer
+
+logger = logging.getLogger(__name__)
+
+FOUND = 'found'
+NOT_FOUND = 'not_found'
+# Not geocoded because the upstream budget of the current minute is spent; retry later
+RATE_LIMITED = 'rate_limited'
+# Not geocoded because the provider failed or its circuit is open; retry later
+UNAVAILABLE = 'unavailable'
+
+
+def take_geocode_budget(wanted: int) -> int:
+    """
+    Reserve up to ``wanted`` upstream geocoding calls from the GEOCODE_RATE_LIMIT budget of the
+    current minute, shared by all processes through the cache.
+
+    :return: The number of calls granted.
+    """
+    if wanted <= 0:
+        return 0
+    key = f'geocode:budget:{int(time.time() // 60)}'
+    cache.add(key, 0, 120)
+    try:
+        used = cache.incr(key, wanted)
+    except ValueError:
+        # Evicted between add and incr.
+        cache.set(key, wanted, 120)
+        used = wanted
+    return max(0, min(wanted, settings.GEOCODE_RATE_LIMIT - (used - wanted)))
+
+
+def resolve_city_names(city_names: list, lang: str = 'en') -> list:
+    """
+    Resolve many city names to cities.
+
+    All names are looked up in the local ``City`` index with one query on their normalized
+    names. The misses, each distinct normalized name once, are geocoded concurrently with at
+    most GEOCODE_CONCURRENCY requests in flight, as far as the rate budget allows. Names the
+    provider failed to geocode, e.g. while its circuit is open, are ``unavailable``, not ``not_found``.
+
+    :return: One ``{"name", "status", "city"}`` result per name, in input order.
+    """
+    normalized = [City.normalize_name(city_name) for city_name in city_names]
+    cities = {}
+    for city in City.objects.filter(search_name__in=set(normalized)).order_by('-id'):
+        # The oldest city of a name wins, as with get_city_data.
+        cities[city.search_name] = CitySerializer(city).data
+    spellings = {}
+    for city_name, search_name in zip(city_names, normalized):
+        if search_name and search_name not in cities:
+            spellings.setdefault(search_name, city_name)
+    misses = list(spellings.values())
+    granted = take_geocode_budget(len(misses))
+    if granted:
+        # httpx is only imported by the processes that geocode.
+        from weather_app.async_utils import afetch_cities
+
+        fetched = async_to_sync(afetch_cities)(misses[:granted], settings.GEOCODE_CONCURRENCY, lang)
+        for city_name, city_data in zip(misses, fetched):
+            cities[City.normalize_name(city_name)] = city_data
+    if granted < len(misses):
+        logger.warning(f'Geocoding budget spent, {len(misses) - granted} city names not resolved')
+    rate_limited = {City.normalize_name(city_name) for city_name in misses[granted:]}
+    results = []
+    for city_name, search_name in zip(city_names, normalized):
+        if search_name in rate_limited:
+            results.append({'name': city_name, 'status': RATE_LIMITED, 'city': None})
+        elif isinstance(cities.get(search_name), ProviderError):
+            results.append({'name': city_name, 'status': UNAVAILABLE, 'city': None})
+        else:
+            city_data = cities.get(search_name)
+            results.append({'name': city_name, 'status': FOUND if city_data else NOT_FOUND, 'city': city_data})
+    return results
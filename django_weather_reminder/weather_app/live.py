@@ -0,0 +1,283 @@
+import asyncio
+import json
+import logging
+import secrets
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from weather_app.models import Weather
+from weather_app.serializers import WeatherSerializer
+
+logger = logging.getLogger(__name__)
+
+_redis = None
+# One LiveHub per event loop, i.e. per ASGI worker process
+_hubs = weakref.WeakKeyDictionary()
+
+
+def city_channel(city_id: int) -> str:
+    return f'weather:live:{city_id}'
+
+
+def get_redis():
+    """
+    Return the Redis client readings are published with, None when LIVE_UPDATES_URL is not set.
+    """
+    global _redis
+    if _redis is None and settings.LIVE_UPDATES_URL:
+        # Imported on first use, the client is only needed by the processes storing readings.
+        import redis
+
+        _redis = redis.Redis.from_url(settings.LIVE_UPDATES_URL, socket_timeout=settings.LIVE_UPDATES_TIMEOUT)
+    return _redis
+
+
+def get_async_redis():
+    import redis.asyncio
+
+    return redis.asyncio.Redis.from_url(settings.LIVE_UPDATES_URL)
+
+
+def reading_event(reading: Weather) -> str:
+    return json.dumps({**WeatherSerializer(reading).data, 'datetime': reading.datetime.isoformat()})
+
+
+def publish_readings(readings: list[Weather]) -> int:
+    """
+    Publish stored readings on the channels of their cities, in one round trip.
+
+    Publishing is best effort: a reading that cannot be published is only missed by the live streams.
+
+    :return: The number of readings published.
+    """
+    client = get_redis()
+    if client is None or not readings:
+        return 0
+    pipeline = client.pipeline(transaction=False)
+    for reading in readings:
+        pipeline.publish(city_channel(reading.city_id), reading_event(reading))
+    try:
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f'Could not publish {len(readings)} readings: {e}')
+        return 0
+    return len(readings)
+
+
+@receiver(post_save, sender=Weather)
+def publish_saved_reading(sender, instance: Weather, created: bool, **kwargs) -> None:
+    # Readings stored through weather_buffer are bulk inserted and published by the buffer.
+    if created:
+        publish_readings([instance])
+
+
+def _ticket_key(ticket: str) -> str:
+    return f'weather:live:ticket:{ticket}'
+
+
+def issue_stream_ticket(user_id: int) -> str:
+    """
+    Return a ticket opening one stream of a user within LIVE_UPDATES_TICKET_TTL seconds.
+
+    EventSource cannot set headers, so the stream is authenticated by a ticket in its URL instead of
+    the access token, which would be written to the access logs of the proxy and the workers.
+    """
+    ticket = secrets.token_urlsafe(32)
+    cache.set(_ticket_key(ticket), user_id, settings.LIVE_UPDATES_TICKET_TTL)
+    return ticket
+
+
+def redeem_stream_ticket(ticket: str):
+    """
+    Return the user id of a stream ticket and invalidate it, None when the ticket is unknown, expired or used.
+    """
+    key = _ticket_key(ticket)
+    user_id = cache.get(key)
+    # Only one of concurrent requests with the same ticket deletes it.
+    if user_id is None or not cache.delete(key):
+        return None
+    return user_id
+
+
+class LiveHub:
+    """
+    Fan the readings published on Redis out to the streams of one process.
+
+    All the streams share one pub/sub connection, subscribed to the channels at least one stream
+    listens to; each stream reads its readings from its own queue of LIVE_UPDATES_QUEUE_SIZE events.
+    The connection is closed when the last stream ends.
+    """
+
+    def __init__(self):
+        self._queues = defaultdict(set)
+        self._lock = asyncio.Lock()
+        self._client = None
+        self._pubsub = None
+        self._reader = None
+
+    async def subscribe(self, city_ids: list) -> asyncio.Queue:
+        queue = asyncio.Queue(settings.LIVE_UPDATES_QUEUE_SIZE)
+        channels = {city_channel(city_id) for city_id in city_ids}
+        async with self._lock:
+            if self._pubsub is None:
+                self._client = get_async_redis()
+                self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            new_channels = [channel for channel in channels if channel not in self._queues]
+            for channel in channels:
+                self._queues[channel].add(queue)
+            try:
+                if new_channels:
+                    await self._pubsub.subscribe(*new_channels)
+            except Exception:
+                self._discard(queue)
+                raise
+            if self._reader is None:
+                self._reader = asyncio.ensure_future(self._read())
+        return queue
+
+    async def unsubscribe(self, queue: asyncio.Queue) -> None:
+        async with self._lock:
+            unused = self._discard(queue)
+            if self._pubsub is None:
+                return
+            if not self._queues:
+                if self._reader is not None:
+                    self._reader.cancel()
+                await self._close()
+            elif unused:
+                await self._pubsub.unsubscribe(*unused)
+
+    def _discard(self, queue: asyncio.Queue) -> list:
+        """
+        Remove a queue from its channels and return the channels no stream listens to anymore.
+        """
+        unused = []
+        for channel, queues in list(self._queues.items()):
+            queues.discard(queue)
+            if not queues:
+                del self._queues[channel]
+                unused.append(channel)
+        return unused
+
+    async def _close(self) -> None:
+        pubsub, client = self._pubsub, self._client
+        self._pubsub = self._client = self._reader = None
+        try:
+            await pubsub.reset()
+            await client.close()
+        except Exception as e:
+            logger.warning(f'Could not close the live updates connection: {e}')
+
+    async def _read(self) -> None:
+        pubsub = self._pubsub
+        while True:
+            try:
+                message = await pubsub.get_message(timeout=settings.LIVE_UPDATES_HEARTBEAT)
+            except Exception as e:
+                logger.warning(f'Live updates connection failed: {e}')
+                break
+            if message is None:
+                continue
+            channel = message['channel']
+            for queue in self._queues.get(channel.decode() if isinstance(channel, bytes) else channel, ()):
+                try:
+                    queue.put_nowait(message['data'])
+                except asyncio.QueueFull:
+                    logger.warning(f'Live stream of {channel} lagging, reading dropped')
+        # End every stream, their clients reconnect through a new connection.
+        async with self._lock:
+            for queue in {queue for queues in self._queues.values() for queue in queues}:
+                while queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+            self._queues.clear()
+            await self._close()
+
+
+def get_hub() -> LiveHub:
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = LiveHub()
+    return hub
+
+
+class DisconnectMiddleware:
+    """
+    ASGI middleware setting ``scope['disconnected']``, an asyncio.Event, when the client goes away.
+
+    Django does not read the ASGI messages while it streams a response and the server drops what is
+    sent to a closed connection, so without it an endless stream would never notice its client left.
+    The messages are watched once the request body is read.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.application(scope, receive, send)
+        disconnected = scope['disconnected'] = asyncio.Event()
+        watcher = None
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        async def receive_body():
+            nonlocal watcher
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+            elif not message.get('more_body') and watcher is None:
+                watcher = asyncio.ensure_future(watch())
+            return message
+
+        try:
+            await self.application(scope, receive_body, send)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+
+async def stream_readings(city_ids: list, disconnected: asyncio.Event = None):
+    """
+    Yield the Server-Sent Events of the readings published for some cities, until the client
+    disconnects or for at most LIVE_UPDATES_MAX_AGE seconds, after which it reconnects.
+
+    A reading fetched once is pushed to all the streams of its city through the hub of the process.
+    A comment is sent after LIVE_UPDATES_HEARTBEAT seconds without readings to keep the connection
+    open through proxies.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.LIVE_UPDATES_MAX_AGE
+    hub = get_hub()
+    queue = await hub.subscribe(city_ids)
+    disconnect = asyncio.ensure_future((disconnected or asyncio.Event()).wait())
+    try:
+        yield f'retry: {settings.LIVE_UPDATES_RETRY_MS}\n\n'
+        while (remaining := deadline - loop.time()) > 0:
+            reading = asyncio.ensure_future(queue.get())
+            await asyncio.wait((reading, disconnect), timeout=min(settings.LIVE_UPDATES_HEARTBEAT, remaining),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                reading.cancel()
+                return
+            if not reading.done():
+                reading.cancel()
+                if loop.time() < deadline:
+                    yield ': keep-alive\n\n'
+                continue
+            data = reading.result()
+            if data is None:
+                return
+            yield f'event: weather\ndata: {data.decode()}\n\n'
+    finally:
+        disconnect.cancel()
+        await hub.unsubscribe(queue)
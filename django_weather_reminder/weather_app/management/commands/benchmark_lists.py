@@ -0,0 +1,82 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from weather_app.mixins import values_fields, values_rows
+from weather_app.models import City, Weather
+from weather_app.renderers import ORJSONRenderer
+from weather_app.serializers import CitySerializer, WeatherSerializer
+
+MODELS = {'city': (City, CitySerializer), 'weather': (Weather, WeatherSerializer)}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Compare the serializer list path with the .values() fast path and orjson rendering.
+    """
+    help = ('Measure rows/sec of building and rendering a list response with ModelSerializer and JSONRenderer '
+            'versus .values() and ORJSONRenderer. Sample rows are created in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=list(MODELS), default='weather')
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3, help='Best of this many runs is reported.')
+
+    def handle(self, *args, **options):
+        """
+        Creates the sample rows, times both paths and prints the rows/sec of each.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+        """
+        model, serializer_class = MODELS[options['model']]
+        rows = options['rows']
+        try:
+            with transaction.atomic():
+                self.create_rows(model, rows)
+                queryset = model.objects.all()[:rows]
+                if model is Weather:
+                    queryset = queryset.select_related('description_ref')
+                fields = values_fields(serializer_class)
+                paths = {
+                    'serializer + json': lambda: JSONRenderer().render(serializer_class(queryset, many=True).data),
+                    'values + orjson': lambda: ORJSONRenderer().render(
+                        list(values_rows(queryset, serializer_class, fields))),
+                }
+                results = {name: self.best_time(path, options['repeat']) for name, path in paths.items()}
+                raise Rollback
+        except Rollback:
+            pass
+        for name, seconds in results.items():
+            self.stdout.write(f'{name:>20}: {rows / seconds:12,.0f} rows/sec')
+        self.stdout.write(f'{"speedup":>20}: {results["serializer + json"] / results["values + orjson"]:12.1f}x')
+
+    @staticmethod
+    def best_time(path, repeat: int) -> float:
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            path()
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    @staticmethod
+    def create_rows(model, rows: int) -> None:
+        city = City.objects.create(name='Benchmark City', country='UA', lat=50.45, lon=30.52)
+        if model is City:
+            City.objects.bulk_create([City(name=f'Benchmark City {i}', country='UA', lat=50.45, lon=30.52)
+                                      for i in range(rows)], batch_size=1000)
+        else:
+            Weather.objects.bulk_create([Weather(city=city, description='clear sky', temp=20.5, pressure=1013,
+                                                 humidity=50, clouds=0, wind_speed=3.5)
+                                         for _ in range(rows)], batch_size=1000)
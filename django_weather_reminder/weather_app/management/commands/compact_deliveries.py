@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from weather_app.deliveries import compact_deliveries
+
+
+class Command(BaseCommand):
+    """
+    Delete old rows of the notification delivery ledger.
+    """
+    help = 'Delete the delivery ledger rows older than the retention period, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.DELIVERY_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        """
+        Deletes the rows of the slots older than ``--days`` days.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+        """
+        deleted = compact_deliveries(timezone.now() - timedelta(days=options['days']), options['batch_size'])
+        self.stdout.write(f'Deleted {deleted} delivery ledger rows')
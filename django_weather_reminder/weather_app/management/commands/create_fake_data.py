@@ -62,7 +62,7 @@ class Command(BaseCommand):
             temp = fake.random_int(min=0, max=40)
             pressure = fake.random_int(min=900, max=1100)
             humidity = fake.random_int(min=0, max=100)
-            clouds = fake.word()
+            clouds = fake.random_int(min=0, max=100)
             wind_speed = fake.random_int(min=0, max=30)
 
             Weather.objects.create(city=city, datetime=datetime, description=description, temp=temp, pressure=pressure,
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from weather_app.deliveries import delivery_report
+
+
+class Command(BaseCommand):
+    """
+    Report the notification deliveries of the recent slots.
+    """
+    help = 'Print delivery counts per status and the lag between the start of a slot and its send.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='Report the slots of this many last hours.')
+
+    def handle(self, *args, **options):
+        """
+        Aggregates the ledger in the database and prints the report.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+        """
+        report = delivery_report(timezone.now() - timedelta(hours=options['hours']))
+        for key in ('total', 'sent', 'failed', 'superseded', 'pending'):
+            self.stdout.write(f'{key:>10}: {report[key]}')
+        for key in ('mean_lag', 'max_lag'):
+            lag = report[key]
+            self.stdout.write(f'{key:>10}: {lag.total_seconds():.1f}s' if lag is not None else f'{key:>10}: -')
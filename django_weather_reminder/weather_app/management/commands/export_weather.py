@@ -0,0 +1,57 @@
+import sys
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import router
+from django.utils.dateparse import parse_datetime
+
+from django_weather_reminder.db_router import use_replica
+from weather_app.exports import EXPORT_FORMATS, export_weather, filter_weather
+from weather_app.models import Weather
+
+
+class Command(BaseCommand):
+    """
+    Stream the weather history to a file or stdout.
+    """
+    help = 'Export weather readings as NDJSON or CSV with constant memory use.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='file_format', choices=list(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output.')
+        parser.add_argument('--city', type=int, help='Only export the readings of this city id.')
+        parser.add_argument('--since', help='ISO 8601 datetime of the oldest reading to export.')
+        parser.add_argument('--until', help='ISO 8601 datetime the readings must be older than.')
+        parser.add_argument('--chunk-size', type=int, default=settings.WEATHER_EXPORT_CHUNK_SIZE)
+        parser.add_argument('--output', '-o', help='Output file, stdout when omitted.')
+
+    def handle(self, *args, **options):
+        """
+        Writes the export block by block, reading from a replica when one is configured.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+        """
+        try:
+            since = parse_datetime(options['since']) if options['since'] else None
+            until = parse_datetime(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        with use_replica():
+            database = router.db_for_read(Weather)
+        queryset = filter_weather(Weather.objects.using(database), city=options['city'], since=since,
+                                  until=until)
+        stream = export_weather(queryset, options['file_format'], options['gzip'], options['chunk_size'])
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for block in stream:
+                output.write(block)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
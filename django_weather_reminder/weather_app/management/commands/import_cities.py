@@ -0,0 +1,154 @@
+import gzip
+import json
+import sys
+from collections import defaultdict
+from typing import IO, Iterator
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from weather_app.models import City
+
+READ_SIZE = 1024 * 1024
+# Largest latitude and longitude difference between a listed city and the same city created by geocoding
+MATCH_DEGREES = 0.1
+
+
+def open_city_list(path: str) -> IO[str]:
+    """
+    Open a city list as text, transparently decompressing gzip files. '-' reads stdin.
+    """
+    if path == '-':
+        return sys.stdin
+    with open(path, 'rb') as file:
+        magic = file.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def iter_json_objects(file: IO[str], read_size: int = READ_SIZE) -> Iterator[dict]:
+    """
+    Incrementally parse the objects of a top-level JSON array, or of a stream of concatenated objects.
+
+    Only ``read_size`` characters plus one partially read object are held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, started = '', 0, False
+    while True:
+        chunk = file.read(read_size)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','
+                                         or buffer[pos] == '[' and not started):
+                started = started or buffer[pos] == '['
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            if pos == len(buffer):
+                break
+            try:
+                obj, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+            started = True
+            yield obj
+        if not chunk:
+            return
+
+
+class Command(BaseCommand):
+    """
+    Pre-seed the City table from the provider's bulk city list.
+    """
+    help = ('Stream-parse a (gzipped) JSON city list, e.g. OpenWeatherMap city.list.json.gz, '
+            'and upsert it into City in chunks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the city list, or '-' for stdin.")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--country', action='append', help='Only import cities of this country code.')
+
+    def handle(self, *args, **options):
+        """
+        Parses the city list object by object and upserts every chunk with one
+        ``bulk_create(update_conflicts=True)`` keyed on ``provider_id``. The normalized
+        ``search_name`` index is filled in the same pass. Cities created by geocoding before the
+        import, which have no ``provider_id``, are matched first, see ``match_geocoded``.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+        """
+        self.verbosity = options['verbosity']
+        countries = set(options['country'] or [])
+        chunk_size = options['chunk_size']
+        chunk = {}
+        total = skipped = 0
+        try:
+            file = open_city_list(options['path'])
+        except OSError as e:
+            raise CommandError(str(e))
+        with file:
+            try:
+                for item in iter_json_objects(file):
+                    try:
+                        city = City(provider_id=item['id'], name=item['name'], country=item.get('country', ''),
+                                    lat=item['coord']['lat'], lon=item['coord']['lon'],
+                                    search_name=City.normalize_name(item['name']))
+                    except (KeyError, TypeError):
+                        skipped += 1
+                        continue
+                    if countries and city.country not in countries:
+                        continue
+                    chunk[city.provider_id] = city
+                    if len(chunk) >= chunk_size:
+                        total += self.upsert(chunk)
+                        chunk = {}
+            except json.JSONDecodeError as e:
+                raise CommandError(f'Invalid city list after {total + len(chunk)} cities: {e}')
+            if chunk:
+                total += self.upsert(chunk)
+        self.stdout.write(f'Imported {total} cities, skipped {skipped} malformed entries')
+
+    def upsert(self, chunk: dict) -> int:
+        with transaction.atomic():
+            matched = self.match_geocoded(chunk)
+            City.objects.bulk_create(chunk.values(), update_conflicts=True, unique_fields=['provider_id'],
+                                     update_fields=['name', 'country', 'lat', 'lon', 'search_name'])
+        if self.verbosity > 1:
+            self.stdout.write(f'Upserted {len(chunk)} cities, {matched} of them created by geocoding')
+        return len(chunk)
+
+    def match_geocoded(self, chunk: dict) -> int:
+        """
+        Backfill the ``provider_id`` of the cities of a chunk that were created by geocoding, so
+        the upsert updates them instead of adding duplicates.
+
+        A city without ``provider_id`` matches a listed city of the same ``search_name`` and
+        country (or no country) within MATCH_DEGREES of its coordinates.
+
+        :return: The number of cities matched.
+        """
+        listed = defaultdict(list)
+        for city in chunk.values():
+            listed[city.search_name].append(city)
+        taken = set(City.objects.filter(provider_id__in=chunk).values_list('provider_id', flat=True))
+        matched = []
+        for existing in City.objects.filter(provider_id__isnull=True, search_name__in=listed,
+                                            lat__isnull=False, lon__isnull=False):
+            for city in listed[existing.search_name]:
+                if city.provider_id not in taken and existing.country in (city.country, '') and \
+                        abs(existing.lat - city.lat) <= MATCH_DEGREES and abs(existing.lon - city.lon) <= MATCH_DEGREES:
+                    existing.provider_id = city.provider_id
+                    taken.add(city.provider_id)
+                    matched.append(existing)
+                    break
+        City.objects.bulk_update(matched, ['provider_id'])
+        return len(matched)
@@ -0,0 +1,123 @@
+import json
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+# Run in a fresh interpreter, so nothing imported by this process is counted as already loaded.
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import django
+from django.apps.config import AppConfig
+
+ready_ms = {}
+create = AppConfig.create.__func__
+
+
+def timed_create(cls, entry):
+    config = create(cls, entry)
+    ready = config.ready
+
+    def timed_ready():
+        ready_started = time.perf_counter()
+        ready()
+        ready_ms[config.label] = (time.perf_counter() - ready_started) * 1000
+
+    config.ready = timed_ready
+    return config
+
+
+AppConfig.create = classmethod(timed_create)
+from django.conf import settings
+settings.INSTALLED_APPS
+settings_loaded = time.perf_counter()
+django.setup()
+setup_done = time.perf_counter()
+if sys.argv[1] == '1':
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+urls_loaded = time.perf_counter()
+print(json.dumps({'phases': {'settings': (settings_loaded - started) * 1000, 'setup': (setup_done - settings_loaded) * 1000,
+                             'urls': (urls_loaded - setup_done) * 1000},
+                  'ready': ready_ms, 'total': (urls_loaded - started) * 1000}))
+'''
+
+
+def parse_importtime(output: str) -> dict:
+    """
+    Sum the cumulative import time in milliseconds of the top-level imports of ``python -X importtime``
+    output per root package.
+    """
+    packages = defaultdict(float)
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented and already counted in the cumulative time of their parent.
+        if not name[1:].startswith(' '):
+            packages[name.strip().split('.')[0]] += int(cumulative) / 1000
+    return packages
+
+
+class Command(BaseCommand):
+    """
+    Profile the startup of a process of this project.
+    """
+    help = ('Report the time spent importing each package, loading the settings, setting up the apps (with the '
+            'ready() time of each app) and loading the URLs in a fresh interpreter, and fail when the total '
+            'exceeds a budget.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=float, default=settings.STARTUP_BUDGET_MS,
+                            help='Fail when the startup takes longer, STARTUP_BUDGET_MS by default.')
+        parser.add_argument('--no-urls', action='store_true', help='Skip loading the URLs, as a worker would.')
+        parser.add_argument('--repeat', type=int, default=3, help='Fastest of this many runs is reported.')
+        parser.add_argument('--top', type=int, default=15, help='Number of packages listed.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """
+        Runs the startup probe, prints its breakdown and checks it against the budget.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+
+        Raises:
+            CommandError: If the probe fails or the startup exceeds the budget.
+        """
+        runs = [self.probe(not options['no_urls']) for _ in range(max(options['repeat'], 1))]
+        report = min(runs, key=lambda run: run['total'])
+        packages = sorted(report.pop('packages').items(), key=lambda item: item[1], reverse=True)
+        report['imports'] = dict(packages[:options['top']])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write('Phases:')
+            for phase, ms in report['phases'].items():
+                self.stdout.write(f'{phase:>30}: {ms:8.1f} ms')
+            self.stdout.write('App ready():')
+            for label, ms in sorted(report['ready'].items(), key=lambda item: item[1], reverse=True):
+                self.stdout.write(f'{label:>30}: {ms:8.1f} ms')
+            self.stdout.write('Imports:')
+            for package, ms in report['imports'].items():
+                self.stdout.write(f'{package:>30}: {ms:8.1f} ms')
+            self.stdout.write(f'{"total":>30}: {report["total"]:8.1f} ms (budget {options["budget_ms"]:.0f} ms)')
+        if report['total'] > options['budget_ms']:
+            raise CommandError(f'Startup took {report["total"]:.0f} ms, over the budget of {options["budget_ms"]:.0f} ms')
+
+    @staticmethod
+    def probe(load_urls: bool) -> dict:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE, '1' if load_urls else '0'],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(f'Startup probe failed:\n{result.stderr[-2000:]}')
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        report['packages'] = parse_importtime(result.stderr)
+        return report
@@ -0,0 +1,42 @@
+from django.core.management import BaseCommand, CommandError
+
+from weather_app.models import WebhookEndpoint
+from weather_app.webhooks import replay_dead_letters, set_endpoint_paused
+
+
+class Command(BaseCommand):
+    """
+    Replay dead-lettered webhook payloads and resume paused endpoints.
+    """
+    help = 'Redeliver pending webhook dead letters, optionally resuming paused endpoints first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Only replay dead letters of this webhook URL.')
+        parser.add_argument('--limit', type=int, help='Maximum number of dead letters to replay per endpoint.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Unpause the endpoints and reset their circuits before replaying.')
+
+    def handle(self, *args, **options):
+        """
+        Replays the pending dead letters endpoint by endpoint.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+        """
+        endpoints = WebhookEndpoint.objects.filter(dead_letters__replayed_at__isnull=True).distinct()
+        if options['url']:
+            endpoints = WebhookEndpoint.objects.filter(url=options['url'])
+            if not endpoints.exists():
+                raise CommandError(f'Unknown webhook endpoint {options["url"]}')
+        for endpoint in endpoints:
+            if options['resume']:
+                set_endpoint_paused(endpoint, False)
+            elif endpoint.is_paused:
+                self.stdout.write(f'{endpoint.url}: paused, use --resume to replay')
+                continue
+            delivered, failed = replay_dead_letters(endpoint, limit=options['limit'])
+            self.stdout.write(f'{endpoint.url}: {delivered} delivered, {failed} failed')
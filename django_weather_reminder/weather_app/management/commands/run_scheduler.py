@@ -0,0 +1,64 @@
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django_celery_beat.models import PeriodicTask, PeriodicTasks
+
+from weather_app.scheduler import ShardedScheduler
+from weather_app.subscriptions import SUBSCRIPTION_TASK
+
+
+class Command(BaseCommand):
+    """
+    Run one instance of the sharded subscription scheduler.
+    """
+    help = ('Lease a share of the subscription partitions and dispatch their due notifications. '
+            'Run as many instances as needed with SUBSCRIPTION_SCHEDULER=sharded.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', default=f'{socket.gethostname()}:{os.getpid()}',
+                            help='Unique name of this instance, hostname:pid by default.')
+        parser.add_argument('--tick', type=float, default=settings.SCHEDULER_TICK)
+        parser.add_argument('--once', action='store_true', help='Run a single scheduling round and exit.')
+        parser.add_argument('--disable-beat-tasks', action='store_true',
+                            help='Disable the per-subscription celery-beat tasks left from the beat scheduler.')
+
+    def handle(self, *args, **options):
+        """
+        Runs scheduling rounds every ``--tick`` seconds until stopped, then releases the leases.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+        """
+        if options['disable_beat_tasks']:
+            disabled = PeriodicTask.objects.filter(task=SUBSCRIPTION_TASK, enabled=True).update(enabled=False)
+            PeriodicTasks.update_changed()
+            self.stdout.write(f'Disabled {disabled} celery-beat subscription tasks')
+        scheduler = ShardedScheduler(options['owner'])
+        if options['once']:
+            self.stdout.write(f'Dispatched {scheduler.tick()} subscriptions')
+            scheduler.release()
+            return
+        signal.signal(signal.SIGTERM, self.stop)
+        self.running = True
+        try:
+            while self.running:
+                started = time.monotonic()
+                dispatched = scheduler.tick()
+                if dispatched and options['verbosity'] > 1:
+                    self.stdout.write(f'Dispatched {dispatched} subscriptions')
+                time.sleep(max(0.0, options['tick'] - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            scheduler.release()
+
+    def stop(self, signum, frame):
+        self.running = False
@@ -0,0 +1,33 @@
+import json
+
+from django.core.management import BaseCommand
+
+from weather_app import metrics
+
+
+class Command(BaseCommand):
+    """
+    Print the metrics aggregated by the web and worker processes.
+    """
+    help = 'Print the aggregated metrics as JSON, e.g. the weather write buffer flush latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Metrics to print, all known metrics when omitted.')
+        parser.add_argument('--reset', action='store_true', help='Reset the printed metrics afterwards.')
+
+    def handle(self, *args, **options):
+        """
+        Reads every metric from the cache and prints them.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+        """
+        names = options['names'] or metrics.METRICS
+        self.stdout.write(json.dumps({name: metrics.read(name) for name in names}, indent=2))
+        if options['reset']:
+            for name in names:
+                metrics.reset(name)
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+
+from weather_app.storage import LAYOUTS, weather_storage_report
+
+
+class Command(BaseCommand):
+    """
+    Report the storage savings of the compact weather schema.
+    """
+    help = ('Copy the latest weather readings into temporary tables of the legacy and the compact layout and print '
+            'the table, index and per-row sizes of both and the savings. PostgreSQL and SQLite only.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=100000, help='Number of latest readings measured.')
+        parser.add_argument('--database', default='default', help='Database to measure.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """
+        Measures both layouts and prints the report.
+
+        Parameters:
+            *args: Variable length argument list.
+            **options: The parsed command line options.
+
+        Returns:
+            None
+
+        Raises:
+            CommandError: If the database can not report its storage sizes.
+        """
+        try:
+            report = weather_storage_report(options['sample'], options['database'])
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f'{"rows":>12}: {report["rows"]} ({report["sampled"]} sampled)')
+        for layout in LAYOUTS:
+            sizes = report[layout]
+            self.stdout.write(f'{layout:>12}: table {sizes["table_bytes"]:,} B, indexes {sizes["index_bytes"]:,} B, '
+                              f'{sizes["row_bytes"]:.1f} B/row')
+        for key in ('table', 'index', 'total'):
+            self.stdout.write(f'{key + " saving":>12}: {report[f"{key}_saving"]:.1f}%')
@@ -0,0 +1,62 @@
+from django.core.cache import cache
+
+# Metrics reported by the show_metrics command
+WEATHER_FLUSH_LATENCY = 'weather_buffer.flush_ms'
+WEATHER_FLUSH_SIZE = 'weather_buffer.flush_size'
+BROKER_QUEUE_DEPTH = 'broker.queue_depth'
+TASK_QUEUE_LATENCY = 'tasks.queue_latency_s'
+DEGRADATION_LEVEL = 'dispatch.degradation_level'
+UPSTREAM_HEDGES = 'upstream.hedges'
+UPSTREAM_FALLBACKS = 'upstream.fallbacks'
+METRICS = [WEATHER_FLUSH_LATENCY, WEATHER_FLUSH_SIZE, BROKER_QUEUE_DEPTH, TASK_QUEUE_LATENCY, DEGRADATION_LEVEL,
+           UPSTREAM_HEDGES, UPSTREAM_FALLBACKS]
+
+METRICS_TIMEOUT = None
+
+
+def _key(name: str, field: str) -> str:
+    return f'metrics:{name}:{field}'
+
+
+def observe(name: str, value: float) -> None:
+    """
+    Record one observation of a metric, e.g. a latency in milliseconds.
+
+    Observations are aggregated in the cache (count, sum and max, as integers), so every web
+    and worker process reports into the same series.
+    """
+    value = int(round(value))
+    for field, amount in (('count', 1), ('sum', value)):
+        key = _key(name, field)
+        if not cache.add(key, amount, METRICS_TIMEOUT):
+            try:
+                cache.incr(key, amount)
+            except ValueError:
+                # Evicted between add and incr.
+                cache.set(key, amount, METRICS_TIMEOUT)
+    max_key = _key(name, 'max')
+    if value > (cache.get(max_key) or 0):
+        cache.set(max_key, value, METRICS_TIMEOUT)
+
+
+def gauge(name: str, value: float) -> None:
+    """
+    Set the current value of a metric.
+    """
+    cache.set(_key(name, 'value'), value, METRICS_TIMEOUT)
+
+
+def read(name: str) -> dict:
+    """
+    Return the aggregated fields of a metric, with the mean of the observations when there are any.
+    """
+    fields = ('count', 'sum', 'max', 'value')
+    values = cache.get_many([_key(name, field) for field in fields])
+    result = {field: values[_key(name, field)] for field in fields if _key(name, field) in values}
+    if result.get('count'):
+        result['mean'] = result['sum'] / result['count']
+    return result
+
+
+def reset(name: str) -> None:
+    cache.delete_many([_key(name, field) for field in ('count', 'sum', 'max', 'value')])
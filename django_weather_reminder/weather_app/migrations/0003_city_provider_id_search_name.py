@@ -0,0 +1,43 @@
+# Generated by Django 4.2.4 on 2026-10-19 12:11
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalize_name(name: str) -> str:
+    """
+    City.normalize_name as of this migration, which must not change with the model.
+    """
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def fill_search_name(apps, schema_editor):
+    City = apps.get_model('weather_app', 'City')
+    cities = list(City.objects.only('id', 'name'))
+    for city in cities:
+        city.search_name = normalize_name(city.name)
+    City.objects.bulk_update(cities, ['search_name'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0002_webhook_endpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='provider_id',
+            field=models.PositiveBigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='search_name',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.RunPython(fill_search_name, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-19 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0003_city_provider_id_search_name'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='weather',
+            index=models.Index(fields=['city', '-datetime'], name='weather_app_city_id_5581cd_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.4 on 2026-10-19 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0004_weather_city_datetime_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscribedcity',
+            name='last_delivered',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='subscribedcity',
+            name='notify_on_description_change',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='subscribedcity',
+            name='pending_since',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='subscribedcity',
+            name='pressure_threshold',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='subscribedcity',
+            name='temp_threshold',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='subscribedcity',
+            name='wind_threshold',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.4 on 2026-10-19 12:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0006_scheduler_leases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.DateTimeField()),
+                ('status', models.CharField(choices=[('claimed', 'Claimed'), ('sent', 'Sent'), ('failed', 'Failed')], default='claimed', max_length=16)),
+                ('claim_token', models.UUIDField()),
+                ('claimed_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='weather_app.subscribedcity')),
+            ],
+            options={
+                'verbose_name': 'notification_delivery',
+                'indexes': [models.Index(fields=['slot'], name='weather_app_slot_d31b59_idx')],
+                'unique_together': {('subscription', 'slot')},
+            },
+        ),
+    ]
@@ -0,0 +1,161 @@
+# Generated by Django 4.2.4 on 2026-10-19 18:40
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+import weather_app.models
+
+# Readings converted per transaction, so the table is never locked for the whole copy.
+BATCH_SIZE = 5000
+
+
+def parse_clouds(value: str) -> int:
+    """
+    Convert a stored cloudiness to a percentage; free text that is not a number, e.g. from fake data, becomes 0.
+    """
+    try:
+        return min(max(round(float(value)), 0), 100)
+    except (TypeError, ValueError):
+        return 0
+
+
+def compact_readings(apps, schema_editor):
+    """
+    Intern the descriptions and convert the cloudiness of the stored readings, BATCH_SIZE at a time in
+    primary key order. Converted readings are skipped, so an interrupted run resumes where it stopped.
+    """
+    database = schema_editor.connection.alias
+    Weather = apps.get_model('weather_app', 'Weather')
+    WeatherDescription = apps.get_model('weather_app', 'WeatherDescription')
+    ids = dict(WeatherDescription.objects.using(database).values_list('text', 'id'))
+    last_id = 0
+    while True:
+        with transaction.atomic(using=database):
+            readings = list(Weather.objects.using(database).filter(id__gt=last_id, description_ref__isnull=True)
+                            .order_by('id').only('id', 'description', 'clouds')[:BATCH_SIZE])
+            if not readings:
+                return
+            missing = {reading.description for reading in readings} - ids.keys()
+            if missing:
+                WeatherDescription.objects.using(database).bulk_create(
+                    [WeatherDescription(text=text) for text in missing], ignore_conflicts=True)
+                ids.update(WeatherDescription.objects.using(database).filter(text__in=missing)
+                           .values_list('text', 'id'))
+            for reading in readings:
+                reading.description_ref_id = ids[reading.description]
+                reading.clouds_percent = parse_clouds(reading.clouds)
+            Weather.objects.using(database).bulk_update(readings, ['description_ref', 'clouds_percent'])
+        last_id = readings[-1].id
+
+
+def expand_readings(apps, schema_editor):
+    """
+    Copy the interned descriptions and the cloudiness back to text, BATCH_SIZE readings at a time.
+    """
+    database = schema_editor.connection.alias
+    Weather = apps.get_model('weather_app', 'Weather')
+    WeatherDescription = apps.get_model('weather_app', 'WeatherDescription')
+    texts = dict(WeatherDescription.objects.using(database).values_list('id', 'text'))
+    last_id = 0
+    while True:
+        with transaction.atomic(using=database):
+            readings = list(Weather.objects.using(database).filter(id__gt=last_id).order_by('id')
+                            .only('id', 'description_ref', 'clouds_percent')[:BATCH_SIZE])
+            if not readings:
+                return
+            for reading in readings:
+                reading.description = texts.get(reading.description_ref_id, '')
+                reading.clouds = '' if reading.clouds_percent is None else str(reading.clouds_percent)
+            Weather.objects.using(database).bulk_update(readings, ['description', 'clouds'])
+        last_id = readings[-1].id
+
+
+class Migration(migrations.Migration):
+    # The readings are copied in batches of their own transactions.
+    atomic = False
+
+    dependencies = [
+        ('weather_app', '0008_delivery_superseded_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeatherDescription',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('text', models.CharField(max_length=256, unique=True)),
+            ],
+            options={
+                'verbose_name': 'weather_description',
+            },
+        ),
+        migrations.AddField(
+            model_name='weather',
+            name='description_ref',
+            field=models.ForeignKey(db_column='description_id', db_index=False, null=True,
+                                    on_delete=django.db.models.deletion.PROTECT, related_name='+',
+                                    to='weather_app.weatherdescription'),
+        ),
+        migrations.AddField(
+            model_name='weather',
+            name='clouds_percent',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.RunPython(compact_readings, expand_readings, atomic=False),
+        # Blank text columns are added back empty, then filled, when the migration is reversed.
+        migrations.AlterField(
+            model_name='weather',
+            name='description',
+            field=models.CharField(blank=True, max_length=256),
+        ),
+        migrations.AlterField(
+            model_name='weather',
+            name='clouds',
+            field=models.CharField(blank=True, max_length=256),
+        ),
+        migrations.RemoveField(
+            model_name='weather',
+            name='description',
+        ),
+        migrations.RemoveField(
+            model_name='weather',
+            name='clouds',
+        ),
+        migrations.RenameField(
+            model_name='weather',
+            old_name='clouds_percent',
+            new_name='clouds',
+        ),
+        migrations.AlterField(
+            model_name='weather',
+            name='clouds',
+            field=models.PositiveSmallIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='weather',
+            name='description_ref',
+            field=models.ForeignKey(db_column='description_id', db_index=False,
+                                    on_delete=django.db.models.deletion.PROTECT, related_name='+',
+                                    to='weather_app.weatherdescription'),
+        ),
+        migrations.AlterField(
+            model_name='weather',
+            name='temp',
+            field=weather_app.models.RealField(),
+        ),
+        migrations.AlterField(
+            model_name='weather',
+            name='pressure',
+            field=weather_app.models.RealField(),
+        ),
+        migrations.AlterField(
+            model_name='weather',
+            name='humidity',
+            field=weather_app.models.RealField(),
+        ),
+        migrations.AlterField(
+            model_name='weather',
+            name='wind_speed',
+            field=weather_app.models.RealField(),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from typing import Iterator
+
+from django.conf import settings
+from django.db.models import QuerySet
+from rest_framework.response import Response
+
+
+def values_fields(serializer_class) -> list | None:
+    """
+    Return the fields of a ModelSerializer if all of them map one to one to ``.values()`` keys, None otherwise.
+
+    Declared fields are allowed when ``Meta.values_expressions`` gives their expression, e.g. a column
+    of a related table.
+    """
+    meta = getattr(serializer_class, 'Meta', None)
+    fields = getattr(meta, 'fields', None)
+    if not isinstance(fields, (list, tuple)) or \
+            set(serializer_class._declared_fields) - set(getattr(meta, 'values_expressions', {})):
+        return None
+    return list(fields)
+
+
+def values_rows(queryset: QuerySet, serializer_class, fields: list) -> Iterator[dict]:
+    """
+    Return the rows of ``fields`` as dictionaries, the ones in ``Meta.values_expressions`` as their expression.
+
+    The rows are built from ``.values_list()``, which keeps the columns in ``fields`` order like the
+    serializer output; ``.values()`` would put the annotated expressions last.
+    """
+    expressions = getattr(serializer_class.Meta, 'values_expressions', {})
+    rows = queryset.annotate(**{field: expressions[field] for field in fields if field in expressions}) \
+        .values_list(*fields)
+    return (dict(zip(fields, row)) for row in rows)
+
+
+class ValuesListMixin:
+    """
+    Build list responses straight from ``.values_list()`` rows instead of serializer instances.
+
+    Opt-in with API_FAST_LIST. Only used for unpaginated lists of serializers made of plain model
+    fields, where the rows are exactly what the serializer would output; other lists fall back to
+    the regular ``list``.
+    """
+
+    def list(self, request, *args, **kwargs):
+        fields = values_fields(self.get_serializer_class()) if settings.API_FAST_LIST else None
+        if fields is None or self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        queryset: QuerySet = self.filter_queryset(self.get_queryset())
+        return Response(list(values_rows(queryset, self.get_serializer_class(), fields)))
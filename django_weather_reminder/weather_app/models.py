@@ -1,5 +1,20 @@
+import unicodedata
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, router, transaction
+
+
+class RealField(models.FloatField):
+    """
+    A single precision float column, 4 bytes instead of 8 on the databases that have the type.
+    """
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'real'
+        if connection.vendor == 'mysql':
+            return 'float'
+        return super().db_type(connection)
 
 
 class City(models.Model):
@@ -11,6 +26,21 @@ class City(models.Model):
     country = models.CharField(max_length=255, blank=True)
     lat = models.FloatField(blank=True, null=True)
     lon = models.FloatField(blank=True, null=True)
+    provider_id = models.PositiveBigIntegerField(blank=True, null=True, unique=True)
+    search_name = models.CharField(max_length=255, blank=True, db_index=True)
+
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        """
+        Normalize a city name for lookups: accents stripped, case folded and whitespace collapsed.
+        """
+        decomposed = unicodedata.normalize('NFKD', name)
+        stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+        return ' '.join(stripped.casefold().split())
+
+    def save(self, *args, **kwargs):
+        self.search_name = self.normalize_name(self.name)
+        super().save(*args, **kwargs)
 
 
 class SubscribedCity(models.Model):
@@ -22,17 +52,203 @@ class SubscribedCity(models.Model):
     city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='city_subs')
     period_notifications = models.IntegerField()
     last_run_at = models.DateTimeField(auto_now_add=True)
+    # Change detection: when any threshold is set, a notification is only sent if the weather moved
+    # past one of them since the last delivered snapshot.
+    temp_threshold = models.FloatField(null=True, blank=True)
+    pressure_threshold = models.FloatField(null=True, blank=True)
+    wind_threshold = models.FloatField(null=True, blank=True)
+    notify_on_description_change = models.BooleanField(default=False)
+    last_delivered = models.JSONField(null=True, blank=True)
+    pending_since = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Used by the sharded scheduler (SUBSCRIPTION_SCHEDULER = 'sharded'), empty means due now.
+    next_run_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    SNAPSHOT_FIELDS = ('description', 'temp', 'pressure', 'wind_speed')
+
+    @classmethod
+    def snapshot(cls, weather_data: dict) -> dict:
+        """
+        Return the part of the weather data that change detection compares.
+        """
+        return {field: weather_data.get(field) for field in cls.SNAPSHOT_FIELDS}
+
+    @property
+    def has_thresholds(self) -> bool:
+        return self.notify_on_description_change or any(
+            threshold is not None for threshold in (self.temp_threshold, self.pressure_threshold, self.wind_threshold))
+
+    def weather_changed(self, snapshot: dict) -> bool:
+        """
+        Tell whether a notification with the given snapshot should be sent.
+
+        Subscriptions without thresholds, or without a delivered snapshot yet, are always notified.
+        """
+        last = self.last_delivered
+        if not last or not self.has_thresholds:
+            return True
+        if self.notify_on_description_change and last.get('description') != snapshot['description']:
+            return True
+        for field, threshold in (('temp', self.temp_threshold), ('pressure', self.pressure_threshold),
+                                 ('wind_speed', self.wind_threshold)):
+            if threshold is None:
+                continue
+            if last.get(field) is None or snapshot[field] is None or abs(snapshot[field] - last[field]) >= threshold:
+                return True
+        return False
+
+
+class NotificationDelivery(models.Model):
+    class Meta:
+        verbose_name = 'notification_delivery'
+        unique_together = ('subscription', 'slot')
+        indexes = [models.Index(fields=['slot']), ]
+
+    CLAIMED = 'claimed'
+    SENT = 'sent'
+    FAILED = 'failed'
+    # Dropped under backpressure because a later slot of the subscription was claimed
+    SUPERSEDED = 'superseded'
+    STATUS_CHOICES = [(CLAIMED, 'Claimed'), (SENT, 'Sent'), (FAILED, 'Failed'), (SUPERSEDED, 'Superseded'), ]
+
+    subscription = models.ForeignKey(SubscribedCity, on_delete=models.CASCADE, related_name='deliveries')
+    # Start of the notification period the delivery belongs to
+    slot = models.DateTimeField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=CLAIMED)
+    claim_token = models.UUIDField()
+    claimed_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+
+class WeatherDescription(models.Model):
+    """
+    The interned text of the weather descriptions, which repeat from a small vocabulary.
+    """
+    class Meta:
+        verbose_name = 'weather_description'
+
+    id = models.SmallAutoField(primary_key=True)
+    text = models.CharField(max_length=256, unique=True)
+
+    # Ids of the committed texts seen by this process; descriptions are never changed or deleted.
+    _ids = {}
+
+    def __str__(self):
+        return self.text
+
+    @classmethod
+    def intern(cls, texts) -> dict:
+        """
+        Return the ids of description texts, creating the missing ones.
+        """
+        ids = {text: cls._ids[text] for text in texts if text in cls._ids}
+        missing = set(texts) - ids.keys()
+        if missing:
+            database = router.db_for_write(cls)
+            cls.objects.using(database).bulk_create([cls(text=text) for text in missing], ignore_conflicts=True)
+            created = dict(cls.objects.using(database).filter(text__in=missing).values_list('text', 'id'))
+            ids.update(created)
+            # Remembered once committed, a rolled back text must be created again.
+            transaction.on_commit(lambda: cls._ids.update(created), using=database)
+        return ids
+
+
+class WeatherQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        Weather.intern_descriptions(objs)
+        return super().bulk_create(objs, *args, **kwargs)
 
 
 class Weather(models.Model):
+    """
+    A weather reading, stored compactly: the description as a reference to its interned text,
+    the cloudiness as a percentage and the measurements in single precision.
+
+    ``description`` reads and writes the text, so readings are still created with
+    ``Weather(description='clear sky', ...)``; it is interned when the reading is saved.
+    Select ``description_ref`` along with many readings to read their descriptions in the same query.
+    """
     class Meta:
         verbose_name = 'weather'
+        indexes = [models.Index(fields=['city', '-datetime']), ]
 
     city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='weather_data')
     datetime = models.DateTimeField(auto_now_add=True)
-    description = models.CharField(max_length=256)
-    temp = models.FloatField()
-    pressure = models.FloatField()
-    humidity = models.FloatField()
-    clouds = models.CharField(max_length=256)
-    wind_speed = models.FloatField()
+    description_ref = models.ForeignKey(WeatherDescription, on_delete=models.PROTECT, related_name='+',
+                                        db_column='description_id', db_index=False)
+    temp = RealField()
+    pressure = RealField()
+    humidity = RealField()
+    # Cloudiness in percent
+    clouds = models.PositiveSmallIntegerField()
+    wind_speed = RealField()
+
+    objects = WeatherQuerySet.as_manager()
+
+    _description = None
+
+    @property
+    def description(self) -> str | None:
+        if self._description is None and self.description_ref_id is not None:
+            self._description = self.description_ref.text
+        return self._description
+
+    @description.setter
+    def description(self, text: str) -> None:
+        self._description = text
+        self.description_ref_id = None
+
+    @staticmethod
+    def intern_descriptions(readings: list) -> None:
+        """
+        Set the description references of unsaved readings from their texts, in at most two queries.
+        """
+        pending = [reading for reading in readings if reading.description_ref_id is None and reading._description]
+        if pending:
+            ids = WeatherDescription.intern({reading._description for reading in pending})
+            for reading in pending:
+                reading.description_ref_id = ids[reading._description]
+
+    def save(self, *args, **kwargs):
+        self.intern_descriptions([self])
+        super().save(*args, **kwargs)
+
+
+class WebhookEndpoint(models.Model):
+    class Meta:
+        verbose_name = 'webhook_endpoint'
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    STATE_CHOICES = [(CLOSED, 'Closed'), (OPEN, 'Open'), (HALF_OPEN, 'Half-open'), ]
+
+    url = models.URLField(max_length=512, unique=True)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=CLOSED)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    failing_since = models.DateTimeField(blank=True, null=True)
+    opened_at = models.DateTimeField(blank=True, null=True)
+    last_success_at = models.DateTimeField(blank=True, null=True)
+    is_paused = models.BooleanField(default=False)
+
+
+class WebhookDeadLetter(models.Model):
+    class Meta:
+        verbose_name = 'webhook_dead_letter'
+        indexes = [models.Index(fields=['endpoint', 'replayed_at']), ]
+
+    endpoint = models.ForeignKey(WebhookEndpoint, on_delete=models.CASCADE, related_name='dead_letters')
+    payload = models.JSONField()
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    replayed_at = models.DateTimeField(blank=True, null=True)
+
+
+class SchedulerLease(models.Model):
+    class Meta:
+        verbose_name = 'scheduler_lease'
+
+    partition = models.PositiveIntegerField(unique=True)
+    owner = models.CharField(max_length=255, blank=True)
+    expires_at = models.DateTimeField()
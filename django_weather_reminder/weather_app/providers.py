@@ -0,0 +1,364 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from weather_app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Fields of a normalized current weather answer, as stored in Weather
+WEATHER_FIELDS = ('description', 'temp', 'pressure', 'humidity', 'clouds', 'wind_speed')
+
+
+class ProviderError(Exception):
+    """
+    Raised when a weather provider cannot be reached or answers with an error.
+    """
+
+
+class CircuitOpen(ProviderError):
+    """
+    Raised without calling any provider while the circuits of all of them are open.
+    """
+
+
+class WeatherProvider:
+    """
+    A weather API.
+
+    Subclasses build the request URLs and normalize the responses:
+
+    * a geocoded city to ``{"name", "country", "lat", "lon"}``,
+    * the current weather to the ``WEATHER_FIELDS`` plus the ``name``, ``country``, ``lat`` and
+      ``lon`` of the place when the provider knows them, ``None`` otherwise.
+
+    The parse methods return None when the provider has no answer, e.g. an unknown city.
+    """
+    name = None
+
+    def geocode_url(self, city_name: str, lang: str) -> str:
+        raise NotImplementedError
+
+    def parse_geocode(self, data) -> dict | None:
+        raise NotImplementedError
+
+    def current_url(self, lat: float, lon: float, units: str, lang: str) -> str:
+        raise NotImplementedError
+
+    def parse_current(self, data, lat: float, lon: float) -> dict | None:
+        raise NotImplementedError
+
+    def decode(self, response):
+        """
+        Return the JSON body of a response of the provider, from ``requests`` or ``httpx``.
+
+        :raises ProviderError: If the response is not a success or its body is not JSON.
+        """
+        if response.status_code != 200:
+            raise ProviderError(f'{self.name}: status {response.status_code}')
+        try:
+            return response.json()
+        except ValueError as e:
+            raise ProviderError(f'{self.name}: invalid JSON ({e})') from e
+
+    def parse(self, parser: str, data, *args) -> dict | None:
+        """
+        Normalize an answer with one of the parse methods.
+
+        :raises ProviderError: If the answer does not have the expected shape.
+        """
+        try:
+            return getattr(self, parser)(data, *args)
+        except (LookupError, TypeError, ValueError, AttributeError) as e:
+            raise ProviderError(f'{self.name}: unexpected answer ({e!r})') from e
+
+    def get(self, url: str):
+        try:
+            response = requests.get(url, timeout=settings.WEATHER_API_TIMEOUT)
+        except requests.RequestException as e:
+            raise ProviderError(f'{self.name}: {e}') from e
+        return self.decode(response)
+
+    def geocode(self, city_name: str, lang: str = 'en') -> dict | None:
+        return self.parse('parse_geocode', self.get(self.geocode_url(city_name, lang)))
+
+    def current(self, lat: float, lon: float, units: str = 'metric', lang: str = 'en') -> dict | None:
+        return self.parse('parse_current', self.get(self.current_url(lat, lon, units, lang)), lat, lon)
+
+
+class OpenWeatherMapProvider(WeatherProvider):
+    name = 'openweathermap'
+
+    def geocode_url(self, city_name: str, lang: str) -> str:
+        return settings.GEO_URL + f'?q={city_name}&lang={lang}&appid={settings.WEATHER_API_KEY}'
+
+    def parse_geocode(self, data) -> dict | None:
+        if not (data and data[0]):
+            return None
+        return {'name': data[0]['name'], 'country': data[0]['country'], 'lat': data[0]['lat'], 'lon': data[0]['lon']}
+
+    def current_url(self, lat: float, lon: float, units: str, lang: str) -> str:
+        return settings.WEATHER_URL + f'?lat={lat}&lon={lon}&units={units}&lang={lang}&appid={settings.WEATHER_API_KEY}'
+
+    def parse_current(self, data, lat: float, lon: float) -> dict | None:
+        if not data:
+            return None
+        coord = data.get('coord', {})
+        return {'name': data.get('name'), 'country': data.get('sys', {}).get('country', ''),
+                'lat': coord.get('lat', lat), 'lon': coord.get('lon', lon),
+                'description': data['weather'][0]['description'], 'temp': data['main']['temp'],
+                'pressure': data['main']['pressure'], 'humidity': data['main']['humidity'],
+                'clouds': data['clouds']['all'], 'wind_speed': data['wind']['speed']}
+
+
+class OpenMeteoProvider(WeatherProvider):
+    """
+    Open-Meteo, which needs no API key. Its current weather carries no place name.
+    """
+    name = 'open-meteo'
+    # WMO weather interpretation codes
+    DESCRIPTIONS = {0: 'clear sky', 1: 'mainly clear', 2: 'partly cloudy', 3: 'overcast', 45: 'fog',
+                    48: 'depositing rime fog', 51: 'light drizzle', 53: 'moderate drizzle', 55: 'dense drizzle',
+                    56: 'light freezing drizzle', 57: 'dense freezing drizzle', 61: 'slight rain',
+                    63: 'moderate rain', 65: 'heavy rain', 66: 'light freezing rain', 67: 'heavy freezing rain',
+                    71: 'slight snow fall', 73: 'moderate snow fall', 75: 'heavy snow fall', 77: 'snow grains',
+                    80: 'slight rain showers', 81: 'moderate rain showers', 82: 'violent rain showers',
+                    85: 'slight snow showers', 86: 'heavy snow showers', 95: 'thunderstorm',
+                    96: 'thunderstorm with slight hail', 99: 'thunderstorm with heavy hail'}
+    # Open-Meteo has no Kelvin: standard temperatures are fetched in Celsius and converted by ``current``.
+    UNITS = {'metric': '&temperature_unit=celsius&wind_speed_unit=ms',
+             'imperial': '&temperature_unit=fahrenheit&wind_speed_unit=mph',
+             'standard': '&temperature_unit=celsius&wind_speed_unit=ms'}
+
+    def geocode_url(self, city_name: str, lang: str) -> str:
+        return settings.OPEN_METEO_GEO_URL + f'?name={city_name}&count=1&language={lang}'
+
+    def parse_geocode(self, data) -> dict | None:
+        results = data.get('results') if data else None
+        if not results:
+            return None
+        return {'name': results[0]['name'], 'country': results[0].get('country_code', ''),
+                'lat': results[0]['latitude'], 'lon': results[0]['longitude']}
+
+    def current_url(self, lat: float, lon: float, units: str, lang: str) -> str:
+        return (settings.OPEN_METEO_URL + f'?latitude={lat}&longitude={lon}'
+                '&current=temperature_2m,relative_humidity_2m,pressure_msl,cloud_cover,wind_speed_10m,weather_code'
+                + self.UNITS.get(units, self.UNITS['metric']))
+
+    def parse_current(self, data, lat: float, lon: float) -> dict | None:
+        current = data.get('current') if data else None
+        if not current:
+            return None
+        temp = current['temperature_2m']
+        return {'name': None, 'country': None, 'lat': data.get('latitude', lat), 'lon': data.get('longitude', lon),
+                'description': self.DESCRIPTIONS.get(current['weather_code'], 'unknown'),
+                'temp': temp, 'pressure': current['pressure_msl'],
+                'humidity': current['relative_humidity_2m'], 'clouds': current['cloud_cover'],
+                'wind_speed': current['wind_speed_10m']}
+
+    def current(self, lat: float, lon: float, units: str = 'metric', lang: str = 'en') -> dict | None:
+        weather = super().current(lat, lon, units, lang)
+        if weather and units == 'standard':
+            weather['temp'] = round(weather['temp'] + 273.15, 2)
+        return weather
+
+
+PROVIDERS = {OpenWeatherMapProvider.name: OpenWeatherMapProvider, OpenMeteoProvider.name: OpenMeteoProvider}
+
+
+def get_providers() -> list[WeatherProvider]:
+    """
+    Return the WEATHER_PROVIDERS in order of preference, given by name or dotted path.
+    """
+    return [PROVIDERS[name]() if name in PROVIDERS else import_string(name)() for name in settings.WEATHER_PROVIDERS]
+
+
+def get_primary_provider() -> WeatherProvider:
+    return get_providers()[0]
+
+
+class LatencyWindow:
+    """
+    The latencies of the last ``size`` successful calls to the primary provider of this process.
+    """
+
+    def __init__(self, size: int):
+        self._latencies = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, percent: float) -> float:
+        with self._lock:
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._latencies.clear()
+
+
+primary_latencies = LatencyWindow(settings.WEATHER_HEDGE_WINDOW)
+_executor = ThreadPoolExecutor(max_workers=settings.WEATHER_HEDGE_THREADS, thread_name_prefix='weather-provider')
+# Calls to the primary provider may occupy at most half of the pool, so a primary that hangs
+# cannot queue the hedges behind its abandoned calls.
+PRIMARY_CALLS_MAX = max(settings.WEATHER_HEDGE_THREADS // 2, 1)
+_primary_slots = threading.BoundedSemaphore(PRIMARY_CALLS_MAX)
+
+
+def hedge_delay() -> float:
+    """
+    Return how long to wait for the primary provider before asking the secondary: the
+    WEATHER_HEDGE_PERCENTILE of its recent latencies, WEATHER_HEDGE_DELAY until enough are known.
+    """
+    if len(primary_latencies) < settings.WEATHER_HEDGE_MIN_SAMPLES:
+        return settings.WEATHER_HEDGE_DELAY
+    return max(primary_latencies.percentile(settings.WEATHER_HEDGE_PERCENTILE), settings.WEATHER_HEDGE_MIN_DELAY)
+
+
+def _circuit_key(provider_name: str, field: str) -> str:
+    return f'upstream:circuit:{provider_name}:{field}'
+
+
+def circuit_accepts_requests(provider_name: str) -> bool:
+    """
+    Check whether the circuit of a provider lets a call through.
+
+    The circuit is shared by every process through the cache. A closed circuit always lets calls
+    through. An open circuit lets exactly one probe through once UPSTREAM_RECOVERY_TIMEOUT has
+    passed: the first caller claims it and every other caller keeps being rejected until the probe
+    succeeds or fails, or for another UPSTREAM_RECOVERY_TIMEOUT if it never reports back.
+    """
+    opened_at = cache.get(_circuit_key(provider_name, 'opened_at'))
+    if opened_at is None:
+        return True
+    recovery = settings.UPSTREAM_RECOVERY_TIMEOUT.total_seconds()
+    if time.time() < opened_at + recovery:
+        return False
+    return cache.add(_circuit_key(provider_name, 'probe'), True, recovery)
+
+
+def release_probe(provider_name: str) -> None:
+    """
+    Give up the half-open probe of a provider claimed through ``circuit_accepts_requests`` without
+    calling it, so the next caller probes instead of waiting for another UPSTREAM_RECOVERY_TIMEOUT.
+    """
+    cache.delete(_circuit_key(provider_name, 'probe'))
+
+
+def record_provider_success(provider_name: str) -> None:
+    """
+    Close the circuit of a provider after a successful call.
+    """
+    cache.delete_many([_circuit_key(provider_name, field) for field in ('failures', 'opened_at', 'probe')])
+
+
+def record_provider_failure(provider_name: str) -> None:
+    """
+    Count a failed call and open the circuit of the provider once UPSTREAM_FAILURE_THRESHOLD
+    consecutive calls failed. A failed half-open probe reopens the circuit immediately.
+    """
+    opened_key, probe_key = _circuit_key(provider_name, 'opened_at'), _circuit_key(provider_name, 'probe')
+    if cache.get(opened_key) is not None:
+        cache.set(opened_key, time.time(), None)
+        cache.delete(probe_key)
+        return
+    failures_key = _circuit_key(provider_name, 'failures')
+    if cache.add(failures_key, 1, None):
+        failures = 1
+    else:
+        try:
+            failures = cache.incr(failures_key)
+        except ValueError:
+            # Expired or evicted meanwhile.
+            cache.add(failures_key, 1, None)
+            failures = 1
+    if failures >= settings.UPSTREAM_FAILURE_THRESHOLD and cache.add(opened_key, time.time(), None):
+        logger.warning(f'Circuit opened for weather provider {provider_name} after {failures} failures')
+
+
+def _timed_call(provider: WeatherProvider, method: str, args: tuple, primary: bool):
+    started = time.perf_counter()
+    try:
+        result = getattr(provider, method)(*args)
+    except ProviderError:
+        record_provider_failure(provider.name)
+        raise
+    record_provider_success(provider.name)
+    if primary:
+        primary_latencies.add(time.perf_counter() - started)
+    return result
+
+
+def hedged_call(method: str, *args):
+    """
+    Call a method of the primary provider and, if it has not answered within ``hedge_delay()``
+    or has failed, the same method of the secondary provider. The first answer wins.
+
+    Providers whose circuit is open are skipped, see ``circuit_accepts_requests``. While
+    PRIMARY_CALLS_MAX calls to the primary are in flight the secondary is asked at once.
+
+    :raises CircuitOpen: Without calling any provider, if all their circuits are open.
+    :raises ProviderError: If every provider asked failed.
+    """
+    providers = get_providers()
+    primary = next((provider for provider in providers if circuit_accepts_requests(provider.name)), None)
+    if primary is None:
+        raise CircuitOpen('Circuits of all weather providers are open')
+    # The secondary is only checked, and its probe only claimed, when it is needed.
+    secondaries = iter(providers[providers.index(primary) + 1:])
+    if primary is providers[-1]:
+        return _timed_call(primary, method, args, primary is providers[0])
+    done, pending, errors = set(), set(), []
+    slots = _primary_slots
+    if slots.acquire(blocking=False):
+        future = _executor.submit(_timed_call, primary, method, args, primary is providers[0])
+        future.add_done_callback(lambda future: slots.release())
+        done, pending = wait({future}, timeout=hedge_delay())
+    else:
+        # Not called, so a probe claimed for it goes to the next caller that gets a slot.
+        release_probe(primary.name)
+        errors.append(ProviderError(f'{primary.name}: {PRIMARY_CALLS_MAX} calls in flight'))
+    hedged = False
+    while True:
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                errors.append(e)
+        if not hedged:
+            hedged = True
+            secondary = next((provider for provider in secondaries if circuit_accepts_requests(provider.name)), None)
+            if secondary is not None:
+                metrics.observe(metrics.UPSTREAM_HEDGES, 1)
+                logger.info(f'Hedging {method} to {secondary.name}' + (f' after {errors[0]}' if errors else ''))
+                pending.add(_executor.submit(_timed_call, secondary, method, args, False))
+        if not pending:
+            raise ProviderError('; '.join(str(error) for error in errors))
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+
+def fetch_city(city_name: str, lang: str = 'en') -> dict | None:
+    """
+    Geocode a city through the providers, see ``hedged_call``.
+    """
+    return hedged_call('geocode', city_name, lang)
+
+
+def fetch_current_weather(lat: float, lon: float, units: str = 'metric', lang: str = 'en') -> dict | None:
+    """
+    Get the current weather at a place through the providers, normalized, see ``hedged_call``.
+    """
+    return hedged_call('current', lat, lon, units, lang)
@@ -0,0 +1,130 @@
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from weather_app.backpressure import COALESCE, degradation_level
+from weather_app.models import SchedulerLease, SubscribedCity
+from weather_app.tasks import schedule_city_forecasts, send_city_forecasts_task
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedScheduler:
+    """
+    One instance of the sharded subscription scheduler.
+
+    Subscriptions are split into SCHEDULER_PARTITIONS hash partitions (``id % partitions``).
+    Every instance leases a fair share of the partitions through SchedulerLease rows and
+    dispatches the due subscriptions of the partitions it holds, so dispatch capacity grows
+    with the number of instances. Leases are renewed on every tick; the partitions of an
+    instance that stops renewing expire after SCHEDULER_LEASE_TIMEOUT and are taken over by
+    the others, and a new instance takes its share over from the instances holding more.
+    """
+
+    def __init__(self, owner: str):
+        self.owner = owner
+        self.partitions = set()
+        self._seeded = False
+
+    def acquire(self, now: datetime | None = None) -> set:
+        """
+        Renew the leases of this instance, rebalance, and return the partitions it holds.
+        """
+        now = now or timezone.now()
+        count = settings.SCHEDULER_PARTITIONS
+        if not self._seeded:
+            SchedulerLease.objects.bulk_create([SchedulerLease(partition=partition, expires_at=now)
+                                                for partition in range(count)], ignore_conflicts=True)
+            self._seeded = True
+        expires_at = now + settings.SCHEDULER_LEASE_TIMEOUT
+        SchedulerLease.objects.filter(owner=self.owner, expires_at__gt=now).update(expires_at=expires_at)
+        leases = list(SchedulerLease.objects.filter(partition__lt=count).values_list('partition', 'owner',
+                                                                                    'expires_at'))
+        owned = {partition for partition, owner, expires in leases if owner == self.owner and expires > now}
+        live_owners = {owner for partition, owner, expires in leases if expires > now} | {self.owner}
+        share = math.ceil(count / len(live_owners))
+        for partition, owner, expires in leases:
+            if len(owned) >= share:
+                break
+            # The filter on expires_at makes the takeover a compare-and-set between competing instances.
+            if expires <= now and SchedulerLease.objects.filter(partition=partition, expires_at__lte=now).update(
+                    owner=self.owner, expires_at=expires_at):
+                owned.add(partition)
+        held = defaultdict(list)
+        for partition, owner, expires in leases:
+            if expires > now and owner != self.owner:
+                held[owner].append(partition)
+        for owner, partitions in held.items():
+            # Take the surplus over from instances above their share, e.g. when this instance just joined.
+            for partition in sorted(partitions)[share:]:
+                if len(owned) >= share:
+                    break
+                if SchedulerLease.objects.filter(partition=partition, owner=owner).update(owner=self.owner,
+                                                                                           expires_at=expires_at):
+                    owned.add(partition)
+        if owned != self.partitions:
+            logger.info(f'Scheduler {self.owner} holds {len(owned)} of {count} partitions')
+        self.partitions = owned
+        return owned
+
+    def release(self) -> None:
+        """
+        Give up every lease of this instance so the others take its partitions over immediately.
+        """
+        SchedulerLease.objects.filter(owner=self.owner).update(expires_at=timezone.now())
+        self.partitions = set()
+
+    def dispatch(self, now: datetime | None = None) -> int:
+        """
+        Dispatch the due subscriptions of the held partitions, one send_city_forecasts_task per city,
+        and move their next_run_at one period ahead.
+
+        While the queues are backed up the subscriptions are marked pending instead and their
+        cities scheduled with schedule_city_forecasts, which batches them over a longer delay.
+
+        :return: The number of subscriptions dispatched; SCHEDULER_BATCH_SIZE means there may be more due.
+        """
+        if not self.partitions:
+            return 0
+        now = now or timezone.now()
+        with transaction.atomic():
+            due = list(SubscribedCity.objects.annotate(partition=Mod('id', settings.SCHEDULER_PARTITIONS))
+                       .filter(Q(next_run_at__isnull=True) | Q(next_run_at__lte=now), partition__in=self.partitions)
+                       .select_for_update(skip_locked=True)
+                       .values_list('id', 'city_id', 'period_notifications')[:settings.SCHEDULER_BATCH_SIZE])
+            by_period, by_city = defaultdict(list), defaultdict(list)
+            for subscription_id, city_id, period in due:
+                by_period[period].append(subscription_id)
+                by_city[city_id].append(subscription_id)
+            for period, ids in by_period.items():
+                SubscribedCity.objects.filter(id__in=ids).update(next_run_at=now + timedelta(minutes=period),
+                                                                 last_run_at=now)
+            if degradation_level() >= COALESCE:
+                SubscribedCity.objects.filter(id__in=[row[0] for row in due], pending_since__isnull=True).update(
+                    pending_since=now)
+                for city_id in by_city:
+                    transaction.on_commit(partial(schedule_city_forecasts, city_id))
+            else:
+                for city_id, ids in by_city.items():
+                    transaction.on_commit(partial(send_city_forecasts_task.delay, city_id, ids))
+        return len(due)
+
+    def tick(self) -> int:
+        """
+        Run one scheduling round: renew the leases and dispatch until nothing held is due.
+        """
+        self.acquire()
+        total = 0
+        while True:
+            dispatched = self.dispatch()
+            total += dispatched
+            if dispatched < settings.SCHEDULER_BATCH_SIZE:
+                return total
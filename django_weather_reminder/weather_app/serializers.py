@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.db.models import F
 from rest_framework import serializers
 
 from .models import City, SubscribedCity, Weather
@@ -24,10 +25,101 @@ class CitySerializer(serializers.ModelSerializer):
 class SubscribedCitySerializer(serializers.ModelSerializer):
     class Meta:
         model = SubscribedCity
-        fields = ['user', 'city', 'period_notifications']
+        fields = ['user', 'city', 'period_notifications', 'temp_threshold', 'pressure_threshold', 'wind_threshold',
+                  'notify_on_description_change']
+        extra_kwargs = {'temp_threshold': {'min_value': 0}, 'pressure_threshold': {'min_value': 0},
+                        'wind_threshold': {'min_value': 0}}
 
 
 class WeatherSerializer(serializers.ModelSerializer):
+    # The text of the interned description, see Weather.description.
+    description = serializers.CharField(max_length=256)
+
     class Meta:
         model = Weather
         fields = ['city', 'description', 'temp', 'pressure', 'humidity', 'clouds', 'wind_speed']
+        extra_kwargs = {'clouds': {'max_value': 100}}
+        values_expressions = {'description': F('description_ref__text')}
+
+
+class SubscribedCityBulkListSerializer(serializers.ListSerializer):
+    """
+    Validates and writes a batch of subscriptions for one user.
+
+    Items are validated one by one so every item gets its own result, but the checks that
+    need the database (existing cities, existing subscriptions) run as one query per batch.
+    """
+
+    def validate_items(self, user: User, partial: bool = False) -> list:
+        """
+        Validate every item of ``initial_data``.
+
+        :param user: The owner of the subscriptions.
+        :param partial: True for updates, where items reference existing subscriptions by ``id``.
+        :return: A list in input order holding either the validated data or the errors of each item.
+        """
+        key = 'id' if partial else 'city'
+        results = []
+        for item in self.initial_data:
+            try:
+                item = self.child.run_validation(item)
+            except serializers.ValidationError as e:
+                results.append(serializers.ValidationError(e.detail))
+                continue
+            if key not in item:
+                results.append(serializers.ValidationError({key: ['This field is required.']}))
+                continue
+            results.append({key: item[key], 'period_notifications': item['period_notifications']})
+        valid = [item for item in results if isinstance(item, dict)]
+        if partial:
+            ids = {item['id'] for item in valid}
+            existing = set(SubscribedCity.objects.filter(user=user, id__in=ids).values_list('id', flat=True))
+            known, seen = existing, set()
+            missing_error, duplicate_error = 'Subscription does not exist.', 'Duplicate subscription in request.'
+        else:
+            cities = {item['city'] for item in valid}
+            known = set(City.objects.filter(id__in=cities).values_list('id', flat=True))
+            seen = set(SubscribedCity.objects.filter(user=user, city__in=cities).values_list('city_id', flat=True))
+            missing_error, duplicate_error = 'City does not exist.', 'Already subscribed to this city.'
+        for index, item in enumerate(results):
+            if not isinstance(item, dict):
+                continue
+            if item[key] not in known:
+                results[index] = serializers.ValidationError({key: [missing_error]})
+            elif item[key] in seen:
+                results[index] = serializers.ValidationError({key: [duplicate_error]})
+            else:
+                seen.add(item[key])
+        return results
+
+    def create(self, validated_data: list) -> list:
+        """
+        Insert subscriptions with ``bulk_create`` in chunks of ``chunk_size``.
+        """
+        chunk_size = self.context['chunk_size']
+        user = self.context['user']
+        created = []
+        for start in range(0, len(validated_data), chunk_size):
+            chunk = [SubscribedCity(user=user, city_id=item['city'], period_notifications=item['period_notifications'])
+                     for item in validated_data[start:start + chunk_size]]
+            created.extend(SubscribedCity.objects.bulk_create(chunk))
+        return created
+
+    def update(self, instances: list, validated_data: list) -> list:
+        """
+        Update ``period_notifications`` of subscriptions with ``bulk_update`` in chunks of ``chunk_size``.
+        """
+        by_id = {instance.id: instance for instance in instances}
+        for item in validated_data:
+            by_id[item['id']].period_notifications = item['period_notifications']
+        SubscribedCity.objects.bulk_update(instances, ['period_notifications'], batch_size=self.context['chunk_size'])
+        return instances
+
+
+class SubscribedCityBulkSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)
+    city = serializers.IntegerField(required=False)
+    period_notifications = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        list_serializer_class = SubscribedCityBulkListSerializer
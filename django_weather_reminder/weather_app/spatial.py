@@ -0,0 +1,177 @@
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from weather_app.models import City
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Ids below the highest one loaded that are read again by every refresh, see CityIndex.refresh
+RESCAN_IDS = 1000
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Return the great-circle distance between two points in kilometres.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class CityIndex:
+    """
+    In-memory grid index over the coordinates of the known cities.
+
+    Cities are bucketed into cells of ``cell_km`` by ``cell_km`` (measured along the meridian),
+    so finding the nearest city within a radius only looks at the handful of cells around
+    the point instead of scanning every city.
+
+    The index is loaded lazily and kept current incrementally: cities saved in this process
+    are added through a post_save signal, and cities created elsewhere (other processes,
+    bulk imports) are picked up by loading the rows with an id above the highest one already
+    indexed, at most once per ``refresh_interval`` seconds. Every ``full_refresh_interval``
+    seconds the whole index is reloaded, which also drops the cities deleted elsewhere.
+    """
+
+    def __init__(self, cell_km: float, refresh_interval: float, full_refresh_interval: float = math.inf):
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        # Columns of cells around the globe, counted eastwards from the antimeridian
+        self.columns = math.ceil(360 / self.cell_deg)
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self._lock = threading.Lock()
+        # Held for a whole refresh, so concurrent lookups do not load the same rows and clear() waits for it.
+        self._refresh_lock = threading.Lock()
+        self.clear()
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor((lon + 180) % 360 / self.cell_deg)
+
+    @property
+    def loaded(self) -> bool:
+        return self._refreshed_at is not None
+
+    def clear(self) -> None:
+        """
+        Drop every indexed city; the next lookup reloads them from the database.
+        """
+        with self._refresh_lock, self._lock:
+            self._cells = defaultdict(dict)
+            self._city_cells = {}
+            self._max_id = 0
+            self._refreshed_at = None
+            self._fully_refreshed_at = None
+
+    def add(self, city_id: int, lat: float, lon: float) -> None:
+        """
+        Add a city to the index, or move it if it is already indexed.
+        """
+        with self._lock:
+            self._discard(city_id)
+            cell = self._cell(lat, lon)
+            self._cells[cell][city_id] = (lat, lon)
+            self._city_cells[city_id] = cell
+
+    def discard(self, city_id: int) -> None:
+        """
+        Remove a city from the index.
+        """
+        with self._lock:
+            self._discard(city_id)
+
+    def _discard(self, city_id: int) -> None:
+        cell = self._city_cells.pop(city_id, None)
+        if cell is not None:
+            self._cells[cell].pop(city_id, None)
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Load the cities created since the last refresh, or all of them once ``full_refresh_interval`` passed.
+
+        Ids are not committed in order, so the RESCAN_IDS ids below the highest one loaded are read
+        again; rows committed even later are picked up by the next full refresh.
+        """
+        with self._refresh_lock:
+            now = time.monotonic()
+            if not force and self.loaded and now - self._refreshed_at < self.refresh_interval:
+                return
+            cities = City.objects.filter(lat__isnull=False, lon__isnull=False).order_by('id') \
+                .values_list('id', 'lat', 'lon')
+            if self.loaded and now - self._fully_refreshed_at < self.full_refresh_interval:
+                max_id = self._max_id
+                for city_id, lat, lon in cities.filter(id__gt=max_id - RESCAN_IDS).iterator(chunk_size=10000):
+                    self.add(city_id, lat, lon)
+                    max_id = max(max_id, city_id)
+            else:
+                cells, city_cells, max_id = defaultdict(dict), {}, 0
+                for city_id, lat, lon in cities.iterator(chunk_size=10000):
+                    cell = self._cell(lat, lon)
+                    cells[cell][city_id] = (lat, lon)
+                    city_cells[city_id] = cell
+                    max_id = city_id
+                with self._lock:
+                    self._cells, self._city_cells = cells, city_cells
+                self._fully_refreshed_at = now
+            self._max_id = max_id
+            self._refreshed_at = now
+
+    def nearest(self, lat: float, lon: float, radius_km: float) -> int | None:
+        """
+        Return the id of the nearest known city within ``radius_km`` of a point, or None.
+        """
+        self.refresh()
+        row, col = self._cell(lat, lon)
+        lat_cells = math.ceil(radius_km / KM_PER_DEGREE / self.cell_deg)
+        # Cells get narrower towards the poles, so more of them are needed along the parallel.
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + lat_cells * self.cell_deg, 90.0))), 1e-6)
+        lon_cells = min(math.ceil(lat_cells / cos_lat), self.columns)
+        # Columns wrap around at the antimeridian.
+        cols = {(col + d_col) % self.columns for d_col in range(-lon_cells, lon_cells + 1)}
+        cells = [(row + d_row, col) for d_row in range(-lat_cells, lat_cells + 1) for col in cols]
+        # Copied under the lock, the cells are changed by add() and discard() from other threads.
+        with self._lock:
+            candidates = [item for cell in cells for item in self._cells.get(cell, {}).items()]
+        best_id, best_distance = None, radius_km
+        for city_id, (city_lat, city_lon) in candidates:
+            distance = haversine_km(lat, lon, city_lat, city_lon)
+            if distance <= best_distance:
+                best_id, best_distance = city_id, distance
+        return best_id
+
+
+city_index = CityIndex(cell_km=settings.CITY_SNAP_RADIUS_KM, refresh_interval=settings.CITY_INDEX_REFRESH_INTERVAL,
+                       full_refresh_interval=settings.CITY_INDEX_FULL_REFRESH_INTERVAL)
+
+
+@receiver(post_save, sender=City)
+def index_saved_city(sender, instance: City, **kwargs) -> None:
+    # Only cities of this process are added here; refresh() keeps tracking the highest id it loaded
+    # and reads the ids below it again, so cities created concurrently by other processes are not skipped.
+    if city_index.loaded and instance.lat is not None and instance.lon is not None:
+        city_index.add(instance.id, instance.lat, instance.lon)
+
+
+@receiver(post_delete, sender=City)
+def unindex_deleted_city(sender, instance: City, **kwargs) -> None:
+    city_index.discard(instance.id)
+
+
+def snap_to_city(lat: float, lon: float) -> City | None:
+    """
+    Resolve a coordinate to the nearest known city within CITY_SNAP_RADIUS_KM.
+    """
+    city_id = city_index.nearest(lat, lon, settings.CITY_SNAP_RADIUS_KM)
+    if city_id is None:
+        return None
+    city = City.objects.filter(pk=city_id).first()
+    if city is None:
+        # Deleted by another process since it was indexed.
+        city_index.discard(city_id)
+    return city
@@ -0,0 +1,89 @@
+from django.db import connections, models
+
+from weather_app.models import Weather, WeatherDescription
+
+# The layout of the weather rows before the descriptions were interned and the measurements made single precision
+LEGACY_COLUMNS = {'description': models.CharField(max_length=256), 'temp': models.FloatField(),
+                  'pressure': models.FloatField(), 'humidity': models.FloatField(),
+                  'clouds': models.CharField(max_length=256), 'wind_speed': models.FloatField()}
+LAYOUTS = ('legacy', 'compact')
+
+
+def _columns(layout: str, connection) -> list:
+    """
+    Return the ``(name, type, select expression)`` of each column of a layout of the weather rows.
+    """
+    meta = Weather._meta
+    columns = [('id', f'{meta.pk.db_type(connection)} PRIMARY KEY', 'w.id'),
+               ('city_id', meta.get_field('city').db_type(connection), 'w.city_id'),
+               ('datetime', meta.get_field('datetime').db_type(connection), 'w.datetime')]
+    for name in ('description', 'temp', 'pressure', 'humidity', 'clouds', 'wind_speed'):
+        if layout == 'compact':
+            field = meta.get_field('description_ref' if name == 'description' else name)
+            columns.append((field.column, field.db_type(connection), f'w.{field.column}'))
+        elif name == 'description':
+            columns.append((name, LEGACY_COLUMNS[name].db_type(connection), 'd.text'))
+        else:
+            db_type = LEGACY_COLUMNS[name].db_type(connection)
+            columns.append((name, db_type, f'CAST(w.{name} AS {db_type})'))
+    return columns
+
+
+def _sizes(cursor, connection, table: str) -> tuple[int, int]:
+    """
+    Return the bytes taken by a temporary table and by its indexes.
+    """
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT pg_table_size(%s::regclass), pg_indexes_size(%s::regclass)', [table, table])
+        return cursor.fetchone()
+    cursor.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat('temp') WHERE name = %s", [table])
+    table_bytes = cursor.fetchone()[0]
+    cursor.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat('temp') WHERE name IN "
+                   "(SELECT name FROM sqlite_temp_master WHERE type = 'index' AND tbl_name = %s)", [table])
+    return table_bytes, cursor.fetchone()[0]
+
+
+def weather_storage_report(sample: int, database: str = 'default') -> dict:
+    """
+    Measure the storage of the weather rows in the legacy and the compact layout.
+
+    The latest ``sample`` readings are copied into a temporary table of each layout, with the
+    ``(city, -datetime)`` index of Weather, whose table and index sizes are read from the database:
+    ``pg_table_size`` and ``pg_indexes_size`` on PostgreSQL, the ``dbstat`` table on SQLite.
+
+    :return: The number of rows stored and sampled, ``legacy`` and ``compact`` dictionaries of
+        ``table_bytes``, ``index_bytes`` and ``row_bytes`` (both per sampled row), and the saving in
+        percent of the table, the indexes and the total.
+    """
+    connection = connections[database]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        raise NotImplementedError(f'Storage sizes can not be measured on {connection.vendor}')
+    report = {'rows': Weather.objects.using(database).count()}
+    quote = connection.ops.quote_name
+    source = (f' FROM {quote(Weather._meta.db_table)} w JOIN {quote(WeatherDescription._meta.db_table)} d'
+              ' ON d.id = w.description_id ORDER BY w.id DESC LIMIT %s')
+    with connection.cursor() as cursor:
+        for layout in LAYOUTS:
+            table = f'weather_{layout}_sample'
+            columns = _columns(layout, connection)
+            cursor.execute(f'DROP TABLE IF EXISTS {table}')
+            cursor.execute(f'CREATE TEMPORARY TABLE {table} ('
+                           + ', '.join(f'{quote(name)} {db_type}' for name, db_type, _ in columns) + ')')
+            try:
+                cursor.execute(f'INSERT INTO {table} SELECT ' + ', '.join(select for _, _, select in columns) + source,
+                               [sample])
+                report['sampled'] = cursor.rowcount
+                cursor.execute(f'CREATE INDEX {table}_city ON {table} (city_id, datetime DESC)')
+                table_bytes, index_bytes = _sizes(cursor, connection, table)
+            finally:
+                cursor.execute(f'DROP TABLE {table}')
+            rows = max(report['sampled'], 1)
+            report[layout] = {'table_bytes': table_bytes, 'index_bytes': index_bytes,
+                              'row_bytes': round((table_bytes + index_bytes) / rows, 1)}
+    legacy, compact = report['legacy'], report['compact']
+    for key, legacy_bytes, compact_bytes in (
+            ('table', legacy['table_bytes'], compact['table_bytes']),
+            ('index', legacy['index_bytes'], compact['index_bytes']),
+            ('total', legacy['table_bytes'] + legacy['index_bytes'], compact['table_bytes'] + compact['index_bytes'])):
+        report[f'{key}_saving'] = round(100 * (1 - compact_bytes / legacy_bytes), 1) if legacy_bytes else 0.0
+    return report
@@ -0,0 +1,77 @@
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from django_celery_beat.models import IntervalSchedule, PeriodicTask, PeriodicTasks
+
+from weather_app.models import SubscribedCity
+
+SUBSCRIPTION_TASK = 'weather_app.tasks.send_weather_forecast_task'
+
+
+def subscription_task_name(subscription: SubscribedCity) -> str:
+    """
+    Return the name of the periodic task sending the notifications of a subscription.
+    """
+    return f'Subscriptions {subscription.id}'
+
+
+def subscription_task_kwargs(subscription: SubscribedCity) -> str:
+    """
+    Return the JSON encoded kwargs of the periodic task of a subscription.
+    """
+    return json.dumps({"email": subscription.user.email, "city": subscription.city.name,
+                       "subscription_id": subscription.id, })
+
+
+def get_intervals(subscriptions: list) -> dict:
+    """
+    Return the interval schedules used by the subscriptions keyed by their period in minutes.
+    """
+    intervals = {}
+    for minutes in {subscription.period_notifications for subscription in subscriptions}:
+        intervals[minutes], created = IntervalSchedule.objects.get_or_create(every=minutes,
+                                                                              period=IntervalSchedule.MINUTES)
+    return intervals
+
+
+def create_subscription_tasks(subscriptions: list) -> None:
+    """
+    Create the periodic tasks of new subscriptions with ``bulk_create``.
+
+    The subscriptions must have their ``user`` and ``city`` loaded. Nothing is created with the
+    sharded scheduler, which dispatches subscriptions from their ``next_run_at``.
+    """
+    if settings.SUBSCRIPTION_SCHEDULER == 'sharded':
+        return
+    intervals = get_intervals(subscriptions)
+    start_time = timezone.now()
+    tasks = [PeriodicTask(interval=intervals[subscription.period_notifications],
+                          name=subscription_task_name(subscription), task=SUBSCRIPTION_TASK,
+                          kwargs=subscription_task_kwargs(subscription), start_time=start_time)
+             for subscription in subscriptions]
+    PeriodicTask.objects.bulk_create(tasks, batch_size=settings.BULK_SUBSCRIPTIONS_CHUNK_SIZE)
+    # bulk_create bypasses the signals beat relies on to reload its schedule.
+    PeriodicTasks.update_changed()
+
+
+def update_subscription_tasks(subscriptions: list) -> None:
+    """
+    Bring the interval and kwargs of the periodic tasks of subscriptions in line with them, using ``bulk_update``.
+
+    The subscriptions must have their ``user`` and ``city`` loaded.
+    """
+    if settings.SUBSCRIPTION_SCHEDULER == 'sharded':
+        return
+    intervals = get_intervals(subscriptions)
+    chunk_size = settings.BULK_SUBSCRIPTIONS_CHUNK_SIZE
+    for start in range(0, len(subscriptions), chunk_size):
+        by_name = {subscription_task_name(subscription): subscription
+                   for subscription in subscriptions[start:start + chunk_size]}
+        tasks = list(PeriodicTask.objects.filter(name__in=by_name))
+        for task in tasks:
+            subscription = by_name[task.name]
+            task.interval = intervals[subscription.period_notifications]
+            task.kwargs = subscription_task_kwargs(subscription)
+        PeriodicTask.objects.bulk_update(tasks, ['interval', 'kwargs'])
+    PeriodicTasks.update_changed()
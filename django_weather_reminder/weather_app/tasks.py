@@ -1,141 +1,385 @@
 import logging
+from datetime import timedelta
 
-import requests
 from celery import shared_task, chain
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
+from django.utils import timezone
+from rest_framework.response import Response
 
-from weather_app.utils import get_weather_data_coord, get_city_data
+# Creates the project Celery app, which Django no longer does at startup, so the tasks are sent through it.
+import django_weather_reminder.celery  # noqa: F401
+from weather_app.backpressure import COALESCE, DIGEST, DROP_SUPERSEDED, degradation_level
+from weather_app.deliveries import claim_deliveries, compact_deliveries, delivery_is_pending, \
+    delivery_is_superseded, mark_delivery, recently_delivered
+from weather_app.models import City, NotificationDelivery, SubscribedCity
+from weather_app.spatial import snap_to_city
+from weather_app.utils import cache_city_weather, get_weather_data_coord, get_city_data, get_fresh_weather
+from weather_app.warming import warm_weather_cache
+from weather_app.webhooks import deliver_webhook, endpoint_is_blocked, get_endpoint, webhook_subscription
 
 logger = logging.getLogger(__name__)
 
+FORECAST_SUBJECT = 'Your weather forecast'
+
 
 @shared_task(ignore_result=True)
-def get_city_coordinates_task(city: str) -> dict:
+def get_city_coordinates_task(city: str) -> dict | None:
     """
     Get the coordinates of a city.
     Args:
         city (str): The name of the city.
     Returns:
-        dict: A dictionary containing the coordinates of the city.
+        dict: A dictionary containing the coordinates of the city, None if it could not be geocoded.
     """
-    return get_city_data(city)
+    city_data = get_city_data(city)
+    if isinstance(city_data, Response):
+        logger.error(f'Could not geocode city {city}: {city_data.data["error"]}')
+        return None
+    return city_data
 
 
 @shared_task(ignore_result=True)
-def get_city_weather_task(coordinates: dict) -> dict:
+def get_city_weather_task(coordinates: dict | None) -> dict | None:
     """
     Retrieves the weather data for a given city based on its coordinates.
     Parameters:
-        coordinates (dict): A dictionary containing the latitude and longitude of the city.
+        coordinates (dict): A dictionary containing the latitude and longitude of the city,
+            None if the previous task of the chain failed.
     Returns:
-        dict: A dictionary containing the weather data for the city.
+        dict: A dictionary containing the weather data for the city, possibly the latest stored reading
+            marked stale while the weather providers are unavailable. None if there is no weather to send,
+            so the rest of the chain skips the notification.
     Raises:
         TypeError: If the 'coordinates' parameter is not a dictionary.
         KeyError: If the 'coordinates' dictionary does not have 'lat' and 'lon' keys.
+
+    A reading of the city stored within WEATHER_SERVE_STALE_AFTER, e.g. one pre-fetched by
+    warm_weather_cache_task, is used instead of calling the API.
     """
+    if coordinates is None:
+        return None
     if not isinstance(coordinates, dict):
         raise TypeError('Parameter of function must be a dict')
     try:
         lat, lon = coordinates['lat'], coordinates['lon']
     except KeyError:
         raise KeyError('Your dict should have "lat" and "lan" keys')
-    return get_weather_data_coord(lat, lon)
+    city = snap_to_city(lat, lon)
+    weather_data = get_fresh_weather(city) if city is not None else get_weather_data_coord(lat, lon)
+    if isinstance(weather_data, Response):
+        logger.error(f'Could not fetch the weather at {lat},{lon}: {weather_data.data["error"]}')
+        return None
+    return weather_data
+
+
+@shared_task(ignore_result=True)
+def refresh_city_weather_task(city_id: int) -> None:
+    """
+    Fetches and stores the current weather of a city in the background.
+    Args:
+        city_id (int): The id of the city to refresh.
+    Returns:
+        None
+    """
+    city = City.objects.filter(pk=city_id).first()
+    try:
+        if city is not None:
+            weather_data = get_weather_data_coord(city.lat, city.lon, city=city)
+            if not isinstance(weather_data, Response) and not weather_data.get('stale'):
+                cache_city_weather(city_id, weather_data)
+    finally:
+        cache.delete(f'weather:refresh:{city_id}')
+
+
+@shared_task(ignore_result=True)
+def warm_weather_cache_task() -> int:
+    """
+    Pre-fetches the weather of the cities with notifications due within WEATHER_WARM_LEAD,
+    so they are sent from a fresh stored reading. Run every minute by beat.
+    Returns:
+        int: The number of refreshes scheduled.
+    """
+    return warm_weather_cache()
+
+
+@shared_task(ignore_result=True)
+def compact_deliveries_task() -> int:
+    """
+    Deletes the delivery ledger rows older than DELIVERY_RETENTION_DAYS. Run daily by beat.
+    Returns:
+        int: The number of rows deleted.
+    """
+    return compact_deliveries(timezone.now() - timedelta(days=settings.DELIVERY_RETENTION_DAYS))
+
+
+def build_forecast_context(weather_data: dict, city: str) -> dict:
+    """
+    Build the template context of a forecast notification from the weather data of a city.
+    """
+    return {'city': city, 'description': weather_data.get('description'), 'temp': weather_data.get('temp'),
+            'pressure': weather_data.get('pressure'), 'humidity': weather_data.get('humidity'),
+            'clouds': weather_data.get('clouds'), 'wind': weather_data.get('wind_speed'), }
 
 
 @shared_task
-def send_mail_task(weather_data: dict, email: str, city: str) -> None:
+def render_forecast_task(weather_data: dict | None, city: str) -> str | None:
     """
-    Sends an email with weather forecast information.
+    Renders the forecast email body.
     Args:
-        weather_data (dict): A dictionary containing weather data.
-        email (str): The recipient's email address.
+        weather_data (dict): A dictionary containing weather data, None if it could not be fetched.
         city (str): The name of the city for which the weather forecast is being sent.
+    Returns:
+        str: The rendered message, None without weather data.
+    """
+    if weather_data is None:
+        return None
+    return render_to_string('weather_app/message.html', context=build_forecast_context(weather_data, city))
+
+
+@shared_task
+def send_forecast_mail_task(message: str | None, email: str, delivery_id: int | None = None,
+                            snapshot: dict | None = None) -> None:
+    """
+    Sends an already rendered forecast email.
+    Args:
+        message (str): The rendered email body. None when the weather could not be fetched: nothing
+            is sent and the delivery is marked failed.
+        email (str): The recipient's email address.
+        delivery_id (int): The claimed NotificationDelivery of the email. The email is not sent again
+            if the delivery is no longer pending, e.g. when the task is retried after sending. Under
+            backpressure it is dropped if a later slot of the subscription was claimed meanwhile.
+        snapshot (dict): The weather snapshot the email reports, stored as the last delivered one of
+            the subscription of the delivery once the email is sent.
     Returns:
         None
     """
-    logger.info(f'Send mail task{email} for city {city}')
-    mail_subject = 'Your weather forecast'
-    context = {'city': city, 'description': weather_data.get('description'), 'temp': weather_data.get('temp'),
-               'pressure': weather_data.get('pressure'), 'humidity': weather_data.get('humidity'),
-               'clouds': weather_data.get('clouds'), 'wind': weather_data.get('wind_speed'), }
-    message = render_to_string('weather_app/message.html', context=context)
+    if delivery_id is not None and not delivery_is_pending(delivery_id):
+        logger.info(f'Delivery {delivery_id} to {email} already handled')
+        return
+    if delivery_id is not None and degradation_level() >= DROP_SUPERSEDED and delivery_is_superseded(delivery_id):
+        logger.info(f'Delivery {delivery_id} to {email} superseded by a later one, dropped')
+        mark_delivery(delivery_id, NotificationDelivery.SUPERSEDED)
+        return
+    if message is None:
+        logger.error(f'No forecast to send to {email}, the weather could not be fetched')
+        if delivery_id is not None:
+            mark_delivery(delivery_id, NotificationDelivery.FAILED)
+        return
+    logger.info(f'Send mail task {email}')
     try:
         from_email = getattr(settings, 'EMAIL_HOST_USER')
     except AttributeError:
         raise AttributeError('You must add EMAIL_HOST_USER attribute to your settings')
-    send_mail(subject=mail_subject, message=message, from_email=from_email, recipient_list=[email],
-              fail_silently=False, )
+    try:
+        send_mail(subject=FORECAST_SUBJECT, message=message, from_email=from_email, recipient_list=[email],
+                  fail_silently=False, )
+    except Exception:
+        if delivery_id is not None:
+            mark_delivery(delivery_id, NotificationDelivery.FAILED)
+        raise
+    if delivery_id is not None:
+        mark_delivery(delivery_id, NotificationDelivery.SENT)
+        if snapshot is not None:
+            SubscribedCity.objects.filter(deliveries__id=delivery_id).update(last_delivered=snapshot)
+
+
+def claim_slot(subscription: SubscribedCity | None) -> tuple[bool, int | None]:
+    """
+    Claim the current slot of the subscription a legacy task was found to belong to.
+    Returns:
+        tuple: Whether to send, False if the slot was already claimed, and the id of the claimed delivery.
+            Sends without a subscription are not recorded in the ledger.
+    """
+    if subscription is None:
+        return True, None
+    delivery_id = claim_deliveries([subscription]).get(subscription.id)
+    return delivery_id is not None, delivery_id
+
 
 @shared_task
-def send_webhook_notification(weather_data: dict, city: str, webhook_url: str) -> None:
-    # message = weather_data
-    webhook_subject = 'Your weather forecast'
-    context = {'city': city, 'description': weather_data.get('description'), 'temp': weather_data.get('temp'),
-               'pressure': weather_data.get('pressure'), 'humidity': weather_data.get('humidity'),
-               'clouds': weather_data.get('clouds'), 'wind': weather_data.get('wind_speed'), }
-    # message = render_to_string('weather_app/message.html', context=context)
-    message = context
-    payload = {'text': message}
+def send_mail_task(weather_data: dict | None, email: str, city: str) -> None:
+    """
+    Sends an email with weather forecast information, once per period of the subscription of the
+    recipient to the city.
+    Args:
+        weather_data (dict): A dictionary containing weather data, None if it could not be fetched.
+        email (str): The recipient's email address.
+        city (str): The name of the city for which the weather forecast is being sent.
+    Returns:
+        None
+    """
+    send, delivery_id = claim_slot(SubscribedCity.objects.filter(user__email=email, city__name=city).first())
+    if not send:
+        logger.info(f'Forecast for city {city} to {email} already sent in this period')
+        return
+    if weather_data is None:
+        logger.error(f'No forecast of city {city} to send to {email}, the weather could not be fetched')
+    logger.info(f'Send mail task{email} for city {city}')
+    send_forecast_mail_task(render_forecast_task(weather_data, city), email, delivery_id)
 
-    try:
-        response = requests.post(webhook_url, json=payload)
 
-        if response.status_code == 200:
-            print("Уведомление успешно отправлено")
-        else:
-            print(f"Ошибка при отправке уведомления: {response.status_code}")
-    except Exception as e:
-        print(f"Произошла ошибка при отправке уведомления: {str(e)}")
+@shared_task
+def send_webhook_notification(weather_data: dict | None, city: str, webhook_url: str,
+                              delivery_id: int | None = None) -> bool:
+    """
+    Sends weather forecast information to a webhook.
+    Args:
+        weather_data (dict): A dictionary containing weather data, None if it could not be fetched.
+        city (str): The name of the city for which the weather forecast is being sent.
+        webhook_url (str): The URL of the webhook to send the notification to.
+        delivery_id (int): The claimed NotificationDelivery of the notification. It is not sent again
+            if the delivery is no longer pending, e.g. when the task is retried after sending.
+    Returns:
+        bool: True if the notification was delivered, False if it went to the dead-letter table,
+            there was no weather to send or it was already handled.
+    """
+    if delivery_id is not None and not delivery_is_pending(delivery_id):
+        logger.info(f'Delivery {delivery_id} to {webhook_url} already handled')
+        return False
+    if weather_data is None:
+        logger.error(f'No forecast of city {city} to send to {webhook_url}, the weather could not be fetched')
+        delivered = False
+    else:
+        delivered = deliver_webhook(webhook_url, {'text': build_forecast_context(weather_data, city)})
+    if delivery_id is not None:
+        mark_delivery(delivery_id, NotificationDelivery.SENT if delivered else NotificationDelivery.FAILED)
+    return delivered
 
 
 @shared_task
-def send_weather_forecast_task(email: str, city: str) -> None:
+def send_weather_forecast_task(email: str, city: str, subscription_id: int | None = None) -> None:
     """
     Sends a weather forecast for a specific city to a given email address.
     Parameters:
         email (str): The email address to send the weather forecast to.
         city (str): The name of the city for which to retrieve the weather forecast.
+        subscription_id (int): The subscription the notification is for. When given, the subscription is
+            marked pending and sent by send_city_forecasts_task together with the other due subscriptions
+            of its city, subject to its change thresholds.
     Returns:
         None: This function does not return any value.
     Raises:
         Exception: If an error occurs while sending the email.
     """
+    if subscription_id is not None:
+        SubscribedCity.objects.filter(id=subscription_id, pending_since__isnull=True).update(
+            pending_since=timezone.now())
+        city_id = SubscribedCity.objects.filter(id=subscription_id).values_list('city_id', flat=True).first()
+        if city_id is not None:
+            schedule_city_forecasts(city_id)
+        return
+    # Tasks created before subscription_id was added to the kwargs: find the subscription to claim its slot.
+    send, delivery_id = claim_slot(SubscribedCity.objects.filter(user__email=email, city__name=city).first())
+    if not send:
+        logger.info(f'Forecast for city {city} to {email} already sent in this period')
+        return
     try:
         logger.info(f'Sending weather forecast for city {city} to {email}')
         weather_info = chain(
-            get_city_coordinates_task.s(city) | get_city_weather_task.s() | send_mail_task.s(email, city))
+            get_city_coordinates_task.s(city) | get_city_weather_task.s() | render_forecast_task.s(city) |
+            send_forecast_mail_task.s(email, delivery_id))
         weather_info.apply_async()
     except Exception as e:
         logger.error(f'Error whan sent email: {str(e)}')
 
 
+def schedule_city_forecasts(city_id: int) -> bool:
+    """
+    Schedule one send_city_forecasts_task for a city after WEATHER_NOTIFY_BATCH_DELAY,
+    unless one is already pending, so the subscriptions falling due meanwhile are sent together.
+    While the queues are backed up the delay is BACKPRESSURE_COALESCE_FACTOR times longer.
+    """
+    delay = settings.WEATHER_NOTIFY_BATCH_DELAY
+    if degradation_level() >= COALESCE:
+        delay *= settings.BACKPRESSURE_COALESCE_FACTOR
+    if not cache.add(f'notify:city:{city_id}', True, delay + settings.WEATHER_REFRESH_LOCK_TIMEOUT):
+        return False
+    send_city_forecasts_task.apply_async((city_id, ), countdown=delay)
+    return True
+
+
+@shared_task
+def send_city_forecasts_task(city_id: int, subscription_ids: list | None = None) -> int:
+    """
+    Sends the forecast of a city to its due subscribers whose change thresholds are crossed.
+    The weather is fetched and rendered once and the subscriptions are compared in one pass against
+    their last delivered snapshot. The new snapshot of a subscription is saved by send_forecast_mail_task
+    once its email is sent, so a failed send does not suppress the next forecast.
+    In digest mode, subscribers who got a forecast within BACKPRESSURE_DIGEST_PERIOD are skipped.
+    Args:
+        city_id (int): The id of the city.
+        subscription_ids (list): The due subscriptions, all pending subscriptions of the city when omitted.
+    Returns:
+        int: The number of forecasts sent.
+    """
+    cache.delete(f'notify:city:{city_id}')
+    subscriptions = SubscribedCity.objects.filter(city_id=city_id).select_related('user', 'city')
+    if subscription_ids is None:
+        subscriptions = subscriptions.filter(pending_since__isnull=False)
+    else:
+        subscriptions = subscriptions.filter(id__in=subscription_ids)
+    subscriptions = list(subscriptions)
+    if not subscriptions:
+        return 0
+    city = subscriptions[0].city
+    weather_data = get_fresh_weather(city)
+    if isinstance(weather_data, Response):
+        # Left pending, the next due run of any of them retries.
+        logger.error(f'Could not fetch the weather of city {city_id}, {len(subscriptions)} forecasts delayed')
+        return 0
+    snapshot = SubscribedCity.snapshot(weather_data)
+    changed = [subscription for subscription in subscriptions if subscription.weather_changed(snapshot)]
+    if changed and degradation_level() >= DIGEST:
+        recent = recently_delivered([subscription.id for subscription in changed],
+                                    timezone.now() - timedelta(minutes=settings.BACKPRESSURE_DIGEST_PERIOD))
+        changed = [subscription for subscription in changed if subscription.id not in recent]
+    # Subscriptions already delivered in this period, e.g. by an overlapping dispatch, are skipped.
+    claims = claim_deliveries(changed)
+    changed = [subscription for subscription in changed if subscription.id in claims]
+    if changed:
+        message = render_forecast_task(weather_data, city.name)
+        for subscription in changed:
+            send_forecast_mail_task.delay(message, subscription.user.email, claims[subscription.id], snapshot)
+    SubscribedCity.objects.filter(id__in=[subscription.id for subscription in subscriptions]).update(
+        pending_since=None)
+    logger.info(f'Sent {len(changed)} forecasts of city {city_id}, '
+                f'suppressed {len(subscriptions) - len(changed)} unchanged or already sent')
+    return len(changed)
 
 
 @shared_task
-def send_webhook_notification_task(webhook_url: str, city: str) -> None:
+def send_webhook_notification_task(webhook_url: str, city: str, subscription_id: int | None = None) -> None:
     """
-    Sends a notification via a webhook.
+    Sends a notification via a webhook, once per period of the subscription.
+    The weather is not fetched at all while the circuit of the endpoint is open or the endpoint is paused.
     Args:
         webhook_url (str): The URL of the webhook to send the notification to.
-        city (str): The message to be sent.
+        city (str): The name of the city for which the weather forecast is being sent.
+        subscription_id (int): The subscription the notification is for, whose slot is claimed. Found
+            from the periodic task of the webhook for tasks created before it was added to the kwargs.
     Returns:
         None
     """
+    endpoint = get_endpoint(webhook_url)
+    if endpoint_is_blocked(endpoint):
+        logger.info(f'Skipping webhook notification to {webhook_url}, endpoint is {endpoint.get_state_display()}'
+                    f'{" and paused" if endpoint.is_paused else ""}')
+        return
+    if subscription_id is not None:
+        subscription = SubscribedCity.objects.filter(id=subscription_id).first()
+    else:
+        subscription = webhook_subscription(webhook_url, city)
+    send, delivery_id = claim_slot(subscription)
+    if not send:
+        logger.info(f'Webhook notification for city {city} to {webhook_url} already sent in this period')
+        return
     logger.info(f'Sending webhook notification to {webhook_url}')
-
-    # payload = {'text': message}
-
     try:
-        weather_info = chain(get_city_coordinates_task.s(city) | get_city_weather_task.s() | send_webhook_notification.s(city, webhook_url))
+        weather_info = chain(get_city_coordinates_task.s(city) | get_city_weather_task.s() |
+                             send_webhook_notification.s(city, webhook_url, delivery_id))
         weather_info.apply_async()
-        payload = {'text': weather_info}
-        response = requests.post(webhook_url, json=payload)
-
-        if response.status_code == 200:
-            logger.info("Webhook notification sent successfully")
-        else:
-            logger.error(f"Error sending webhook notification: {response.status_code}")
     except Exception as e:
         logger.error(f"An error occurred while sending the webhook notification: {str(e)}")
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework import routers
 
@@ -10,7 +11,13 @@ router.register(r'users', UserViewSet)
 router.register(r'cities', CityViewSet)
 router.register(r'subscribes', SubscribedCityViewSet)
 router.register(r'weathers', WeatherViewSet)
-router.register(r'webhooks2', SubscribedWebhookCityViewSet)
+router.register(r'webhooks2', SubscribedWebhookCityViewSet, basename='subscribedwebhookcity')
 # print(router.urls)
-urlpatterns = [path('', include(router.urls)),
-               ]
+urlpatterns = [path('', include(router.urls)), ]
+if settings.ASYNC_VIEWS:
+    # Async variants served by the ASGI workers
+    from weather_app.async_views import city_list, weather_list, weather_stream
+
+    urlpatterns += [path('async/cities/', city_list, name='async-city-list'),
+                    path('async/weathers/', weather_list, name='async-weather-list'),
+                    path('async/weathers/stream/', weather_stream, name='async-weather-stream'), ]
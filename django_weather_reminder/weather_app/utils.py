@@ -1,12 +1,32 @@
+import logging
+import time
+from datetime import timedelta
 from typing import Any
 
-import requests
+from django.core.cache import cache
+from django.db import router
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.response import Response
 
-from django_weather_reminder.settings import WEATHER_API_KEY, GEO_URL, WEATHER_URL
-from weather_app.models import City
+from django_weather_reminder.settings import WEATHER_CACHE_TIMEOUT, WEATHER_REFRESH_LOCK_TIMEOUT, \
+    WEATHER_SERVE_STALE_AFTER, WEATHER_SERVE_STALE_FOR, UPSTREAM_FALLBACK_MAX_AGE
+from weather_app import metrics
+from weather_app.buffers import weather_buffer
+from weather_app.models import City, Weather
+from weather_app.providers import WEATHER_FIELDS, CircuitOpen, ProviderError, fetch_city, fetch_current_weather
 from weather_app.serializers import CitySerializer, WeatherSerializer
+from weather_app.spatial import snap_to_city
+
+logger = logging.getLogger(__name__)
+
+
+def weather_fields(weather_data: dict, city: City) -> dict:
+    """
+    Map a normalized current weather answer of a provider to the WeatherSerializer fields.
+    """
+    return {'city': city.pk, **{field: weather_data[field] for field in WEATHER_FIELDS}}
 
 
 def get_city_data(city_name: str, lang: str = 'en') -> Response | Any:
@@ -15,32 +35,36 @@ def get_city_data(city_name: str, lang: str = 'en') -> Response | Any:
     :param lang: The language code for the response (default is 'en').
     :return: The city data as a dictionary.
 
-    This method fetches data for a given city from the weather API.
-    It sends a request to the GEO_URL with the city name and language code as parameters,
-    along with the weather API key.
-    If the response status code is 200, it extracts the city data from the response and saves
-    it using the CitySerializer. The city data is then returned as a dictionary.
+    Cities already stored locally, e.g. pre-seeded with the import_cities command,
+    are returned without calling the API.
+    Otherwise the city is geocoded by the weather providers, see ``providers.hedged_call``,
+    and saved using the CitySerializer. The city data is then returned as a dictionary.
 
     If there is a problem with fetching the city data,
     a response with an error message is returned with a status code of 500.
     """
-    url = GEO_URL + f'?q={city_name}&lang={lang}&appid={WEATHER_API_KEY}'
-    response = requests.get(url)
-    if response.status_code == 200:
-        city_data = response.json()
-        if city_data and city_data[0]:
-            serializer_city = CitySerializer(
-                data={'name': city_data[0]['name'], 'country': city_data[0]['country'], 'lat': city_data[0]['lat'],
-                      'lon': city_data[0]['lon'], })
-            if serializer_city.is_valid():
-                existing_city = City.objects.filter(lat=city_data[0]['lat'], lon=city_data[0]['lon']).first()
-                if not existing_city:
-                    serializer_city.save()
-            return serializer_city.data
+    local_city = City.objects.filter(search_name=City.normalize_name(city_name)).first()
+    if local_city:
+        return CitySerializer(local_city).data
+    try:
+        city_data = fetch_city(city_name, lang)
+    except ProviderError as e:
+        logger.error(f'Could not geocode {city_name}: {e}')
+        city_data = None
+    if city_data:
+        serializer_city = CitySerializer(data=city_data)
+        if serializer_city.is_valid():
+            # Checked on the primary, a lagging replica would let duplicates through.
+            existing_city = City.objects.using(router.db_for_write(City)).filter(
+                lat=city_data['lat'], lon=city_data['lon']).first()
+            if not existing_city:
+                serializer_city.save()
+        return serializer_city.data
     return Response({'error': 'Problem with fetching city data'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-def get_weather_data_coord(lat: float, lon: float, units: str = 'metric', lang: str = 'en') -> Response | Any:
+def get_weather_data_coord(lat: float, lon: float, units: str = 'metric', lang: str = 'en',
+                           city: City | None = None) -> Response | Any:
     """
     Get weather data for a given latitude and longitude.
 
@@ -48,21 +72,179 @@ def get_weather_data_coord(lat: float, lon: float, units: str = 'metric', lang:
     :param lon: The longitude of the location.
     :param units: The unit of measurement for the weather data (default is 'metric').
     :param lang: The language code for the weather data (default is 'en').
-    :return: A dictionary containing the weather data for the location.
+    :param city: The city the reading belongs to. When omitted it is looked up by the name
+        in the answer, and created from the answer if it is not known yet; answers without
+        a name, e.g. from Open-Meteo, are matched to the nearest known city.
+    :return: A dictionary containing the weather data for the location, or the latest stored
+        reading of the city marked stale when the providers are unavailable, see ``weather_fallback``.
     """
-    url = WEATHER_URL + f'?lat={lat}&lon={lon}&units={units}&lang={lang}&appid={WEATHER_API_KEY}'
-    response = requests.get(url)
-    if response.status_code == 200:
-        weather_data = response.json()
-        if weather_data:
+    try:
+        weather_data = fetch_current_weather(lat, lon, units, lang)
+    except ProviderError as e:
+        logger.error(f'Could not fetch the weather at {lat},{lon}: {e}')
+        return weather_fallback(lat, lon, city, e)
+    if weather_data:
+        if city is None and weather_data['name']:
             city_name = weather_data['name']
-            city = City.objects.get(name=city_name)
-            serializer_weather_data = WeatherSerializer(
-                data={'city': city.pk, 'description': weather_data['weather'][0]['description'],
-                      'temp': weather_data['main']['temp'], 'pressure': weather_data['main']['pressure'],
-                      'humidity': weather_data['main']['humidity'], 'clouds': weather_data['clouds']['all'],
-                      'wind_speed': weather_data['wind']['speed'], })
+            city = City.objects.using(router.db_for_write(City)).filter(name=city_name).first()
+            if city is None:
+                city = City.objects.create(name=city_name, country=weather_data['country'] or '',
+                                           lat=weather_data['lat'], lon=weather_data['lon'])
+        elif city is None:
+            city = snap_to_city(lat, lon)
+        if city is not None:
+            serializer_weather_data = WeatherSerializer(data=weather_fields(weather_data, city))
             if serializer_weather_data.is_valid():
-                serializer_weather_data.save()
+                # Written by the write-behind buffer, batched when WEATHER_WRITE_BUFFER_SIZE > 1.
+                reading = Weather(**serializer_weather_data.validated_data)
+                weather_buffer.add(reading)
+                return WeatherSerializer(reading).data
             return serializer_weather_data.data
     return Response({'error': 'Problem with fetching weather data'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def weather_fallback(lat: float, lon: float, city: City | None, error: ProviderError) -> Response | Any:
+    """
+    Serve the weather of a place while the providers fail or their circuits are open: the latest
+    reading of its city stored within UPSTREAM_FALLBACK_MAX_AGE, with ``"stale": True`` and its ``age``
+    in seconds, or an error response, 503 without any upstream call while the circuits are open.
+    """
+    if city is None:
+        city = snap_to_city(lat, lon)
+    reading = get_latest_reading(city, UPSTREAM_FALLBACK_MAX_AGE) if city is not None else None
+    if reading is not None:
+        metrics.observe(metrics.UPSTREAM_FALLBACKS, 1)
+        age = timezone.now() - reading.datetime
+        return {**WeatherSerializer(reading).data, 'stale': True, 'age': int(age.total_seconds())}
+    if isinstance(error, CircuitOpen):
+        return Response({'error': 'Weather providers unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({'error': 'Problem with fetching weather data'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def weather_cache_key(city_id: int) -> str:
+    return f'weather:city:{city_id}'
+
+
+def cache_city_weather(city_id: int, weather_data: dict) -> None:
+    """
+    Cache the fetched weather of a city for WEATHER_CACHE_TIMEOUT, with the time it was fetched.
+    """
+    cache.set(weather_cache_key(city_id), (time.time(), weather_data), WEATHER_CACHE_TIMEOUT)
+
+
+def cached_weather(entry: tuple) -> dict:
+    """
+    Return the weather data of a cache entry of ``cache_city_weather`` with its ``age`` in seconds.
+    """
+    fetched_at, weather_data = entry
+    return {**weather_data, 'age': max(int(time.time() - fetched_at), 0)}
+
+
+def get_city_weather(city: City) -> Response | Any:
+    """
+    Get the current weather of a known city, shared through the cache.
+
+    Every request resolved to the same city, e.g. by snapping nearby coordinates to it,
+    reuses one cache entry and therefore one upstream fetch per WEATHER_CACHE_TIMEOUT.
+
+    :param city: The city to get the weather for.
+    :return: A dictionary containing the weather data for the city, with the ``age`` in seconds
+        of answers served from the cache.
+    """
+    entry = cache.get(weather_cache_key(city.pk))
+    if entry is not None:
+        return cached_weather(entry)
+    weather_data = get_weather_data_coord(city.lat, city.lon, city=city)
+    # Fallback readings are not cached, so the next request asks the providers again.
+    if not isinstance(weather_data, Response) and not weather_data.get('stale'):
+        cache_city_weather(city.pk, weather_data)
+    return weather_data
+
+
+def get_latest_reading(city: City, max_age: timedelta) -> Weather | None:
+    """
+    Return the most recent stored reading of a city if it is not older than ``max_age``.
+    """
+    return (city.weather_data.filter(datetime__gte=timezone.now() - max_age).select_related('description_ref')
+            .order_by('-datetime').first())
+
+
+def get_latest_readings(city_ids: list, max_age: timedelta) -> dict:
+    """
+    Return the most recent stored reading not older than ``max_age`` of each of many cities, in one query.
+
+    :return: A dictionary of city id to its reading, without the cities that have none.
+    """
+    # One lookup per city over the (city, -datetime) index, readings may be stored out of time order.
+    latest = Subquery(Weather.objects.filter(city_id=OuterRef('pk'), datetime__gte=timezone.now() - max_age)
+                      .order_by('-datetime').values('id')[:1])
+    latest_ids = City.objects.filter(id__in=city_ids).values(latest=latest)
+    readings = Weather.objects.filter(id__in=latest_ids).select_related('description_ref')
+    return {reading.city_id: reading for reading in readings}
+
+
+def get_cities_weather(city_ids: list) -> dict:
+    """
+    Get the current weather of many cities without calling the API.
+
+    The weather is taken from the cache entries of ``get_city_weather`` and, for the other cities,
+    from their latest stored readings within WEATHER_SERVE_STALE_FOR, read in one query.
+    Readings older than WEATHER_SERVE_STALE_AFTER and cities without any reading get one
+    background refresh each.
+
+    :return: A dictionary of city id to ``{"status", "age", "weather"}``, where the status is
+        ``fresh``, ``stale`` or ``pending`` (no reading yet, being fetched), without unknown cities.
+    """
+    city_ids = list(dict.fromkeys(city_ids))
+    cached = cache.get_many([weather_cache_key(city_id) for city_id in city_ids])
+    results = {}
+    for city_id in city_ids:
+        if weather_cache_key(city_id) in cached:
+            weather_data = cached_weather(cached[weather_cache_key(city_id)])
+            results[city_id] = {'status': 'fresh', 'age': weather_data.pop('age'), 'weather': weather_data}
+    misses = [city_id for city_id in city_ids if city_id not in results]
+    readings = get_latest_readings(misses, WEATHER_SERVE_STALE_FOR) if misses else {}
+    now = timezone.now()
+    refresh = []
+    for city_id, reading in readings.items():
+        age = now - reading.datetime
+        stale = age > WEATHER_SERVE_STALE_AFTER
+        if stale:
+            refresh.append(city_id)
+        results[city_id] = {'status': 'stale' if stale else 'fresh', 'age': int(age.total_seconds()),
+                            'weather': WeatherSerializer(reading).data}
+    unread = [city_id for city_id in misses if city_id not in readings]
+    if unread:
+        for city_id in City.objects.filter(id__in=unread).values_list('id', flat=True):
+            refresh.append(city_id)
+            results[city_id] = {'status': 'pending', 'age': None, 'weather': None}
+    for city_id in refresh:
+        # Only the pk is needed to schedule the refresh.
+        schedule_weather_refresh(City(pk=city_id))
+    return results
+
+
+def get_fresh_weather(city: City) -> Response | Any:
+    """
+    Return the weather of a city from a reading stored within WEATHER_SERVE_STALE_AFTER, e.g. one
+    pre-fetched by the cache warmer, or fetch it from the API when there is none.
+    """
+    reading = get_latest_reading(city, WEATHER_SERVE_STALE_AFTER)
+    if reading is not None:
+        return WeatherSerializer(reading).data
+    return get_weather_data_coord(city.lat, city.lon, city=city)
+
+
+def schedule_weather_refresh(city: City, countdown: float = 0) -> bool:
+    """
+    Refresh the weather of a city in the background, at most once per WEATHER_REFRESH_LOCK_TIMEOUT.
+    The refresh runs after ``countdown`` seconds; the lock covers the wait.
+
+    :return: True if a refresh was scheduled, False if one is already pending.
+    """
+    from weather_app.tasks import refresh_city_weather_task
+
+    if not cache.add(f'weather:refresh:{city.pk}', True, countdown + WEATHER_REFRESH_LOCK_TIMEOUT):
+        return False
+    refresh_city_weather_task.apply_async((city.pk, ), countdown=countdown)
+    return True
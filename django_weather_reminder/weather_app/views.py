@@ -1,29 +1,52 @@
 import json
 import logging
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.db import IntegrityError, router, transaction
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from django.views.decorators.csrf import csrf_exempt
+from django.utils.dateparse import parse_datetime
 from django_celery_beat.models import IntervalSchedule, PeriodicTask
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.fields import URLField
 from rest_framework.response import Response
 
+from weather_app.exports import EXPORT_FORMATS, export_weather, filter_weather
+from weather_app.geocoding import resolve_city_names
+from weather_app.live import issue_stream_ticket
+from weather_app.mixins import ValuesListMixin
 from weather_app.models import Weather, City, SubscribedCity
-from weather_app.serializers import WeatherSerializer, CitySerializer, SubscribedCitySerializer, UserSerializer
-from weather_app.utils import get_city_data, get_weather_data_coord
+from weather_app.serializers import WeatherSerializer, CitySerializer, SubscribedCitySerializer, UserSerializer, \
+    SubscribedCityBulkSerializer
+from weather_app.subscriptions import create_subscription_tasks, update_subscription_tasks, subscription_task_name
+from weather_app.spatial import city_index, snap_to_city
+from weather_app.utils import get_city_data, get_weather_data_coord, get_city_weather, get_latest_reading, \
+    schedule_weather_refresh, get_cities_weather
+from weather_app.webhooks import WEBHOOK_TASK_PREFIX, get_endpoint
 
 logger = logging.getLogger(__name__)
 
 
+def with_age_headers(response: Response, age: timedelta, stale: bool) -> Response:
+    """
+    Mark a weather response with the age of its reading and whether it is being revalidated.
+    """
+    response['Age'] = str(int(age.total_seconds()))
+    response['X-Weather-Stale'] = 'true' if stale else 'false'
+    return response
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = (AllowAny,)
 
 
-class CityViewSet(viewsets.ModelViewSet):
+class CityViewSet(ValuesListMixin, viewsets.ModelViewSet):
     queryset = City.objects.all()
     serializer_class = CitySerializer
     permission_classes = (IsAuthenticated,)
@@ -49,15 +72,47 @@ class CityViewSet(viewsets.ModelViewSet):
             return Response(city_data, status=status.HTTP_200_OK)
         return Response({'error': 'City data not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    @action(detail=False, methods=['post'], url_path='resolve')
+    def resolve(self, request, *args, **kwargs):
+        """
+        Resolve a list of city names in one request.
+
+        Names known locally are answered from the ``City`` index, the others are geocoded
+        concurrently within the GEOCODE_RATE_LIMIT budget; names left over when it is spent
+        come back with the ``rate_limited`` status, names the provider failed to geocode with
+        ``unavailable``.
 
-class WeatherViewSet(viewsets.ModelViewSet):
-    queryset = Weather.objects.all()
+        Args:
+            request (Request): The HTTP request object.
+            *args: Variable length argument list.
+            **kwargs: Arbitrary keyword arguments.
+
+        Returns:
+            Response: One result per name, in input order, with its status and the city data.
+        """
+        if not isinstance(request.data, list) or not all(isinstance(name, str) for name in request.data):
+            return Response({'error': 'Expected a list of city names'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > settings.GEOCODE_BATCH_MAX_ITEMS:
+            return Response({'error': f'At most {settings.GEOCODE_BATCH_MAX_ITEMS} city names per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': resolve_city_names(request.data)}, status=status.HTTP_200_OK)
+
+
+class WeatherViewSet(ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Weather.objects.select_related('description_ref')
     serializer_class = WeatherSerializer
     permission_classes = (IsAuthenticated,)
 
     def list(self, request, *args, **kwargs):
         """
-        Retrieve a list of city data based on the provided city name.
+        Retrieve the current weather at the provided coordinates, or the stored readings without them.
+
+        Coordinates within CITY_SNAP_RADIUS_KM of a known city are served as that city,
+        so nearby requests share one upstream fetch and one cache entry.
+        With WEATHER_SERVE_STALE the last stored reading of the city is returned without waiting
+        for the upstream when it is at most WEATHER_SERVE_STALE_FOR old; readings older than
+        WEATHER_SERVE_STALE_AFTER also trigger one background refresh. The ``Age`` and
+        ``X-Weather-Stale`` headers tell how old the returned reading is.
 
         Parameters:
             request (Request): The HTTP request object.
@@ -65,20 +120,135 @@ class WeatherViewSet(viewsets.ModelViewSet):
             **kwargs: Arbitrary keyword arguments.
 
         Returns:
-            Response: The HTTP response object containing city data if found,
+            Response: The HTTP response object containing weather data if found,
             or an error message if not found.
         """
         lat = request.query_params.get('lat')
         lon = request.query_params.get('lon')
-        if lat and lon:
+        if not (lat and lon):
             return super().list(request, *args, **kwargs)
-        weather_data = get_weather_data_coord(lat, lon)
+        try:
+            lat, lon = float(lat), float(lon)
+        except ValueError:
+            return Response({'error': 'lat and lon must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        city = snap_to_city(lat, lon)
+        if city and settings.WEATHER_SERVE_STALE:
+            reading = get_latest_reading(city, settings.WEATHER_SERVE_STALE_FOR)
+            if reading:
+                age = timezone.now() - reading.datetime
+                stale = age > settings.WEATHER_SERVE_STALE_AFTER
+                if stale:
+                    schedule_weather_refresh(city)
+                return with_age_headers(Response(WeatherSerializer(reading).data, status=status.HTTP_200_OK),
+                                        age, stale)
+        if city:
+            weather_data = get_city_weather(city)
+        else:
+            weather_data = get_weather_data_coord(lat, lon)
+        if isinstance(weather_data, Response):
+            return weather_data
         if weather_data:
-            return Response(weather_data, status=status.HTTP_200_OK)
+            # Cached answers and stored readings served while the providers are unavailable carry their age.
+            age = timedelta(seconds=weather_data.get('age', 0))
+            return with_age_headers(Response(weather_data, status=status.HTTP_200_OK), age,
+                                    weather_data.get('stale', False) or age > settings.WEATHER_SERVE_STALE_AFTER)
         return Response({'error': 'Weather data not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    @action(detail=False, methods=['get'], url_path='current')
+    def current(self, request, *args, **kwargs):
+        """
+        Retrieve the current weather of many cities in one request, without waiting for the upstream.
+
+        Query parameters:
+            cities: Comma separated city ids.
+            coords: Semicolon separated ``lat,lon`` pairs, each resolved to the nearest known city
+                within CITY_SNAP_RADIUS_KM.
+
+        The weather is served from the cache and the latest stored readings, see ``get_cities_weather``;
+        only stale or missing readings are refreshed, in the background.
+
+        Returns:
+            Response: One result per city id, then one per coordinate, in input order, with the
+            city, its status (``fresh``, ``stale``, ``pending`` or ``not_found``), the age of the
+            reading in seconds when known and the weather data.
+        """
+        params = request.query_params
+        try:
+            city_ids = [int(city_id) for city_id in params.get('cities', '').split(',') if city_id.strip()]
+            coords = [tuple(float(value) for value in pair.split(','))
+                      for pair in params.get('coords', '').split(';') if pair.strip()]
+        except ValueError:
+            return Response({'error': 'cities must be ids and coords lat,lon pairs of numbers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if any(len(pair) != 2 for pair in coords):
+            return Response({'error': 'coords must be lat,lon pairs'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(city_ids) + len(coords) > settings.WEATHER_BATCH_MAX_ITEMS:
+            return Response({'error': f'At most {settings.WEATHER_BATCH_MAX_ITEMS} cities per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        snapped = [city_index.nearest(lat, lon, settings.CITY_SNAP_RADIUS_KM) for lat, lon in coords]
+        weather = get_cities_weather(city_ids + [city_id for city_id in snapped if city_id is not None])
+        not_found = {'status': 'not_found', 'age': None, 'weather': None}
+        results = [{'city': city_id, **weather.get(city_id, not_found)} for city_id in city_ids]
+        results += [{'lat': lat, 'lon': lon, 'city': city_id, **weather.get(city_id, not_found)}
+                    for (lat, lon), city_id in zip(coords, snapped)]
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='stream-ticket')
+    def stream_ticket(self, request, *args, **kwargs):
+        """
+        Issue a ticket opening the live weather stream of the user once.
+
+        Returns:
+            Response: The ``ticket`` to pass as the ``ticket`` query parameter of the stream within
+            ``expires_in`` seconds, or 503 when live updates are not enabled.
+        """
+        if not settings.LIVE_UPDATES_URL:
+            return Response({'error': 'Live updates are not enabled'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'ticket': issue_stream_ticket(request.user.pk),
+                         'expires_in': settings.LIVE_UPDATES_TICKET_TTL}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request, *args, **kwargs):
+        """
+        Stream the weather history as NDJSON or CSV.
+
+        Query parameters:
+            city: Only export the readings of this city id.
+            since, until: ISO 8601 datetimes bounding the readings.
+            file_format: 'ndjson' (default) or 'csv'.
+            gzip: Set to 1 to gzip the stream.
+
+        Returns:
+            StreamingHttpResponse: The export, encoded row by row so memory use stays constant.
+        """
+        params = request.query_params
+        file_format = params.get('file_format', 'ndjson')
+        if file_format not in EXPORT_FORMATS:
+            return Response({'error': f'file_format must be one of {", ".join(EXPORT_FORMATS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            city = int(params['city']) if params.get('city') else None
+            since = parse_datetime(params['since']) if params.get('since') else None
+            until = parse_datetime(params['until']) if params.get('until') else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        # parse_datetime returns None for malformed values, which would export the whole history.
+        for name, value in (('since', since), ('until', until)):
+            if params.get(name) and value is None:
+                return Response({'error': f'{name} must be an ISO 8601 datetime'}, status=status.HTTP_400_BAD_REQUEST)
+        compress = params.get('gzip') in ('1', 'true')
+        # The stream is consumed after the request returns, so pick the database now.
+        queryset = filter_weather(Weather.objects.using(router.db_for_read(Weather)), city=city, since=since,
+                                  until=until)
+        stream = export_weather(queryset, file_format, compress, settings.WEATHER_EXPORT_CHUNK_SIZE)
+        filename = f'weather.{file_format}' + ('.gz' if compress else '')
+        response = StreamingHttpResponse(stream,
+                                         content_type='application/gzip' if compress else EXPORT_FORMATS[file_format])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
-class SubscribedCityViewSet(viewsets.ModelViewSet):
+
+class SubscribedCityViewSet(ValuesListMixin, viewsets.ModelViewSet):
     queryset = SubscribedCity.objects.all()
     serializer_class = SubscribedCitySerializer
     permission_classes = (IsAuthenticated,)
@@ -90,7 +260,8 @@ class SubscribedCityViewSet(viewsets.ModelViewSet):
         :param self: The instance of the class.
         :return: A filtered queryset based on the user making the request.
         """
-        return self.queryset.filter(user=self.request.user)
+        # Updates rebuild the periodic task kwargs from the user email and the city name.
+        return self.queryset.filter(user=self.request.user).select_related('user', 'city')
 
     def create(self, request, *args, **kwargs):
         """
@@ -107,14 +278,151 @@ class SubscribedCityViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         city = serializer.save(user=self.request.user)
-        hours = city.period_notifications
+        create_subscription_tasks([city])
+        data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def update(self, request, *args, **kwargs):
+        """
+        Update the object specified by the request.
+
+        Args:
+            request (Request): The request object containing the data to update the object.
+            args: Additional positional arguments.
+            kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: The response object containing the serialized data of the updated object.
+        """
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        update_subscription_tasks([instance])
+        logger.info(f'Updated subscription with ID {instance.id} by user {request.user.username}')
+        return Response(serializer.data)
+
+    def destroy(self, request, *args, **kwargs):
+        """
+        Deletes the specified instance and the associated periodic task.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            *args: Variable length argument list.
+            **kwargs: Arbitrary keyword arguments.
+
+        Returns:
+            Response: The response object with the status code indicating the success of the deletion.
+        """
+        instance = self.get_object()
+        PeriodicTask.objects.filter(name=subscription_task_name(instance)).delete()
+        instance.delete()
+        return Response({"delete": "ok"}, status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['post', 'patch'], url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create (POST) or update (PATCH) many subscriptions of the requesting user in one request.
+
+        POST takes a list of ``{"city", "period_notifications"}`` items and PATCH a list of
+        ``{"id", "period_notifications"}`` items. Valid items are written with
+        ``bulk_create``/``bulk_update`` in chunks inside one transaction, invalid ones are skipped.
+
+        Args:
+            request (Request): The HTTP request object.
+            *args: Variable length argument list.
+            **kwargs: Arbitrary keyword arguments.
+
+        Returns:
+            Response: One result per item, in input order, with its status and either the
+            subscription data or the validation errors, or 409 when a subscription to one of the
+            cities was created concurrently, in which case nothing is written.
+        """
+        if not isinstance(request.data, list):
+            return Response({'error': 'Expected a list of subscriptions'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > settings.BULK_SUBSCRIPTIONS_MAX_ITEMS:
+            return Response({'error': f'At most {settings.BULK_SUBSCRIPTIONS_MAX_ITEMS} subscriptions per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        partial = request.method == 'PATCH'
+        serializer = SubscribedCityBulkSerializer(data=request.data, many=True, context={
+            'user': request.user, 'chunk_size': settings.BULK_SUBSCRIPTIONS_CHUNK_SIZE})
+        items = serializer.validate_items(request.user, partial=partial)
+        valid = [item for item in items if isinstance(item, dict)]
+        try:
+            with transaction.atomic():
+                if partial:
+                    instances = list(SubscribedCity.objects.filter(id__in=[item['id'] for item in valid])
+                                     .select_related('user', 'city'))
+                    subscriptions = serializer.update(instances, valid)
+                    update_subscription_tasks(subscriptions)
+                    by_id = {subscription.id: subscription for subscription in subscriptions}
+                    written = iter(by_id[item['id']] for item in valid)
+                else:
+                    subscriptions = serializer.create(valid)
+                    cities = City.objects.in_bulk({subscription.city_id for subscription in subscriptions})
+                    for subscription in subscriptions:
+                        subscription.city = cities[subscription.city_id]
+                    create_subscription_tasks(subscriptions)
+                    written = iter(subscriptions)
+        except IntegrityError:
+            # A subscription to one of the cities was created concurrently after the items were validated;
+            # nothing of the batch was written, a retry reports the duplicate per item.
+            logger.warning(f'Bulk subscriptions of user {request.user.username} conflicted with a concurrent write')
+            return Response({'error': 'A subscription was created concurrently, retry the request'},
+                            status=status.HTTP_409_CONFLICT)
+        results = []
+        for index, item in enumerate(items):
+            if isinstance(item, dict):
+                subscription = next(written)
+                results.append({'index': index, 'status': 'updated' if partial else 'created', 'id': subscription.id,
+                                'city': subscription.city_id,
+                                'period_notifications': subscription.period_notifications})
+            else:
+                results.append({'index': index, 'status': 'error', 'errors': item.detail})
+        logger.info(f'Bulk {"updated" if partial else "created"} {len(valid)} of {len(items)} subscriptions '
+                    f'for user {request.user.username}')
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class SubscribedWebhookCityViewSet(viewsets.ModelViewSet):
+    queryset = SubscribedCity.objects.all()
+    serializer_class = SubscribedCitySerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        """
+        Returns a filtered queryset based on the user making the request.
+
+        :param self: The instance of the class.
+        :return: A filtered queryset based on the user making the request.
+        """
+        return self.queryset.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        """
+        Create a new subscription delivered to the webhook given in ``webhook_url``.
+
+        Args:
+            request: The HTTP request object.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            A Response object with the serialized data and a status code of 201 (Created).
+        """
+        webhook_field = URLField(max_length=512)
+        webhook_url = webhook_field.run_validation(request.data.get('webhook_url'))
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        city = serializer.save(user=self.request.user)
         minutes = city.period_notifications
         interval, created = IntervalSchedule.objects.get_or_create(every=minutes, period=IntervalSchedule.MINUTES)
-        subscription_info = {"email": self.request.user.email, "city": city.city.name, }
+        get_endpoint(webhook_url)
+        subscription_info = {"webhook_url": webhook_url, "city": city.city.name, "subscription_id": city.id, }
         subscription_info_json = json.dumps(subscription_info)
         startdatatime = timezone.now()
-        task_name = 'weather_app.tasks.send_weather_forecast_task'
-        PeriodicTask.objects.create(interval=interval, name=f'Subscriptions {self.request.user}', task=task_name,
+        task_name = 'weather_app.tasks.send_webhook_notification_task'
+        PeriodicTask.objects.create(interval=interval, name=f'{WEBHOOK_TASK_PREFIX}{city.id}', task=task_name,
                                     kwargs=subscription_info_json, start_time=startdatatime)
         data = serializer.data
         return Response(data, status=status.HTTP_201_CREATED)
@@ -135,20 +443,16 @@ class SubscribedCityViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(instance, data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        task_name = f'Subscriptions {instance.id}'
+        task_name = f'{WEBHOOK_TASK_PREFIX}{instance.id}'
         try:
             task = PeriodicTask.objects.get(name=task_name)
-            hours = instance.period_notifications
-            interval, created = IntervalSchedule.objects.get_or_create(every=hours, period=IntervalSchedule.HOURS)
-            subscription_info = {'email': self.request.user.user_settings.email, 'city': instance.city.name,
-                                 'country': instance.city.country}
-            subscription_info_json = json.dumps(subscription_info)
+            minutes = instance.period_notifications
+            interval, created = IntervalSchedule.objects.get_or_create(every=minutes, period=IntervalSchedule.MINUTES)
             task.interval = interval
-            task.kwargs = subscription_info_json
             task.save()
         except PeriodicTask.DoesNotExist as e:
             logger.error(f'PeriodicTask with name {task_name} does not exist: {str(e)}')
-        logger.info(f'Updated subscription with ID {instance.id} by user {request.user.username}')
+        logger.info(f'Updated webhook subscription with ID {instance.id} by user {request.user.username}')
         return Response(serializer.data)
 
     def destroy(self, request, *args, **kwargs):
@@ -164,121 +468,6 @@ class SubscribedCityViewSet(viewsets.ModelViewSet):
             Response: The response object with the status code indicating the success of the deletion.
         """
         instance = self.get_object()
-        task_name = f'Subscriptions {instance.id}'
-        try:
-            task = PeriodicTask.objects.get(name=task_name)
-            task.delete()
-        except PeriodicTask.DoesNotExist:
-            pass
+        PeriodicTask.objects.filter(name=f'{WEBHOOK_TASK_PREFIX}{instance.id}').delete()
         instance.delete()
         return Response({"delete": "ok"}, status=status.HTTP_204_NO_CONTENT)
-
-#
-# class SubscribedWebhookCityViewSet(viewsets.ModelViewSet):
-#     queryset = SubscribedCity.objects.all()
-#     serializer_class = SubscribedCitySerializer
-#     permission_classes = (IsAuthenticated,)
-#
-#     def get_queryset(self):
-#         """
-#         Returns a filtered queryset based on the user making the request.
-#
-#         :param self: The instance of the class.
-#         :return: A filtered queryset based on the user making the request.
-#         """
-#         return self.queryset.filter(user=self.request.user)
-#
-#     def create(self, request, *args, **kwargs):
-#         """
-#         Create a new object.
-#
-#         Args:
-#             request: The HTTP request object.
-#             *args: Additional positional arguments.
-#             **kwargs: Additional keyword arguments.
-#
-#         Returns:
-#             A Response object with the serialized data and a status code of 201 (Created).
-#         """
-#         serializer = self.get_serializer(data=request.data)
-#         serializer.is_valid(raise_exception=True)
-#         city = serializer.save(user=self.request.user)
-#         hours = city.period_notifications
-#         minutes = city.period_notifications
-#         # webhook_url = request.build_absolute_uri(reverse('weather_webhook'))
-#         webhook_url = 'http://localhost:1337/webhooks/'
-#         interval, created = IntervalSchedule.objects.get_or_create(every=minutes, period=IntervalSchedule.MINUTES)
-#         subscription_info = {"webhook_url": webhook_url, "city": city.city.name, }
-#         subscription_info_json = json.dumps(subscription_info)
-#         startdatatime = timezone.now()
-#         task_name = 'weather_app.tasks.send_webhook_notification_task'
-#         PeriodicTask.objects.create(interval=interval, name=f'Subscriptions {self.request.user}', task=task_name,
-#                                     kwargs=subscription_info_json, start_time=startdatatime)
-#         data = serializer.data
-#         return Response(data, status=status.HTTP_201_CREATED)
-#
-#     def update(self, request, *args, **kwargs):
-#         """
-#         Update the object specified by the request.
-#
-#         Args:
-#             request (Request): The request object containing the data to update the object.
-#             args: Additional positional arguments.
-#             kwargs: Additional keyword arguments.
-#
-#         Returns:
-#             Response: The response object containing the serialized data of the updated object.
-#         """
-#         instance = self.get_object()
-#         serializer = self.get_serializer(instance, data=request.data)
-#         serializer.is_valid(raise_exception=True)
-#         serializer.save()
-#         task_name = f'Subscriptions {instance.id}'
-#         try:
-#             task = PeriodicTask.objects.get(name=task_name)
-#             hours = instance.period_notifications
-#             interval, created = IntervalSchedule.objects.get_or_create(every=hours, period=IntervalSchedule.HOURS)
-#             subscription_info = {'email': self.request.user.user_settings.email, 'city': instance.city.name,
-#                                  'country': instance.city.country}
-#             subscription_info_json = json.dumps(subscription_info)
-#             task.interval = interval
-#             task.kwargs = subscription_info_json
-#             task.save()
-#         except PeriodicTask.DoesNotExist as e:
-#             logger.error(f'PeriodicTask with name {task_name} does not exist: {str(e)}')
-#         logger.info(f'Updated subscription with ID {instance.id} by user {request.user.username}')
-#         return Response(serializer.data)
-#
-#     def destroy(self, request, *args, **kwargs):
-#         """
-#         Deletes the specified instance and the associated periodic task.
-#
-#         Args:
-#             request (HttpRequest): The HTTP request object.
-#             *args: Variable length argument list.
-#             **kwargs: Arbitrary keyword arguments.
-#
-#         Returns:
-#             Response: The response object with the status code indicating the success of the deletion.
-#         """
-#         instance = self.get_object()
-#         task_name = f'Subscriptions {instance.id}'
-#         try:
-#             task = PeriodicTask.objects.get(name=task_name)
-#             task.delete()
-#         except PeriodicTask.DoesNotExist:
-#             pass
-#         instance.delete()
-#         return Response({"delete": "ok"}, status=status.HTTP_204_NO_CONTENT)
-#
-#
-# @csrf_exempt
-# def webhook(request):
-#     try:
-#         data = json.loads(request.body)
-#
-#         response_data = {'status': 'success', 'message': 'data corect'}
-#         return JsonResponse(response_data)
-#     except Exception as e:
-#         error_response = {'status': 'error', 'message': str(e)}
-#         return JsonResponse(error_response, status=400)
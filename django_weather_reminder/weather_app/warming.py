@@ -0,0 +1,97 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+from django_celery_beat.models import IntervalSchedule, PeriodicTask
+
+from weather_app.models import City, SubscribedCity, Weather
+from weather_app.subscriptions import SUBSCRIPTION_TASK
+from weather_app.utils import schedule_weather_refresh
+
+logger = logging.getLogger(__name__)
+
+PERIOD_SECONDS = {IntervalSchedule.DAYS: 86400, IntervalSchedule.HOURS: 3600, IntervalSchedule.MINUTES: 60,
+                  IntervalSchedule.SECONDS: 1, IntervalSchedule.MICROSECONDS: 1e-6}
+
+
+def upcoming_subscriptions(now: datetime, horizon: timedelta) -> dict:
+    """
+    Find the subscriptions whose periodic task, or ``next_run_at`` with the sharded scheduler, is due within
+    ``horizon``.
+
+    :return: A dictionary of subscription id to the time its notification is due.
+    """
+    if settings.SUBSCRIPTION_SCHEDULER == 'sharded':
+        subscriptions = SubscribedCity.objects.filter(Q(next_run_at__isnull=True) | Q(next_run_at__lte=now + horizon))
+        return {subscription_id: max(next_run_at or now, now) for subscription_id, next_run_at in
+                subscriptions.values_list('id', 'next_run_at').iterator(chunk_size=5000)}
+    tasks = PeriodicTask.objects.filter(task=SUBSCRIPTION_TASK, enabled=True, interval__isnull=False) \
+        .values_list('name', 'last_run_at', 'start_time', 'interval__every', 'interval__period')
+    due = {}
+    for name, last_run_at, start_time, every, period in tasks.iterator(chunk_size=5000):
+        last_run_at = last_run_at or start_time or now
+        due_at = last_run_at + timedelta(seconds=every * PERIOD_SECONDS[period])
+        if due_at <= now + horizon:
+            subscription_id = name.rsplit(' ', 1)[-1]
+            if subscription_id.isdigit():
+                due[int(subscription_id)] = max(due_at, now)
+    return due
+
+
+def plan_warming(now: datetime) -> list:
+    """
+    Pick the cities to pre-fetch ahead of the notifications due within WEATHER_WARM_LEAD.
+
+    Cities are ranked by the number of subscribers due, and cities whose stored reading will
+    still be fresh (WEATHER_SERVE_STALE_AFTER) when their first notification is due are skipped.
+    At most one minute of the warming share of WEATHER_API_RATE_LIMIT is planned per call.
+    The subscriptions and readings are read in chunks of BULK_SUBSCRIPTIONS_CHUNK_SIZE ids.
+
+    :return: A list of (city id, number of due subscribers) tuples, best ranked first.
+    """
+    due = upcoming_subscriptions(now, settings.WEATHER_WARM_LEAD)
+    chunk_size = settings.BULK_SUBSCRIPTIONS_CHUNK_SIZE
+    subscription_ids = list(due)
+    subscribers, first_due = Counter(), {}
+    for start in range(0, len(subscription_ids), chunk_size):
+        for subscription_id, city_id in SubscribedCity.objects.filter(
+                id__in=subscription_ids[start:start + chunk_size]).values_list('id', 'city_id'):
+            subscribers[city_id] += 1
+            first_due[city_id] = min(first_due.get(city_id, due[subscription_id]), due[subscription_id])
+    city_ids = list(subscribers)
+    latest = {}
+    for start in range(0, len(city_ids), chunk_size):
+        latest.update(Weather.objects.filter(city_id__in=city_ids[start:start + chunk_size]).values('city_id')
+                      .annotate(latest=Max('datetime')).values_list('city_id', 'latest'))
+    fresh = settings.WEATHER_SERVE_STALE_AFTER
+    candidates = [(city_id, count) for city_id, count in subscribers.most_common()
+                  if city_id not in latest or latest[city_id] + fresh < first_due[city_id]]
+    return candidates[:warming_budget()]
+
+
+def warming_budget() -> int:
+    """
+    Return the number of upstream calls the warmer may make per minute.
+    """
+    return max(1, int(settings.WEATHER_API_RATE_LIMIT * settings.WEATHER_WARM_RATE_SHARE))
+
+
+def warm_weather_cache(now: datetime | None = None) -> int:
+    """
+    Schedule background refreshes for the cities planned by ``plan_warming``, evenly spread over the next minute.
+
+    :return: The number of refreshes scheduled.
+    """
+    now = now or timezone.now()
+    plan = plan_warming(now)
+    spacing = 60 / warming_budget()
+    cities = City.objects.in_bulk([city_id for city_id, count in plan])
+    scheduled = 0
+    for city_id, count in plan:
+        if city_id in cities and schedule_weather_refresh(cities[city_id], countdown=scheduled * spacing):
+            scheduled += 1
+    logger.info(f'Warming weather of {scheduled} cities ahead of due notifications')
+    return scheduled
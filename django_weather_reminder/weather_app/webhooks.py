@@ -0,0 +1,196 @@
+import json
+import logging
+
+import requests
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django_celery_beat.models import PeriodicTask, PeriodicTasks
+
+from weather_app.models import SubscribedCity, WebhookEndpoint, WebhookDeadLetter
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_TASK_NAME = 'weather_app.tasks.send_webhook_notification_task'
+WEBHOOK_TASK_PREFIX = 'Webhook subscriptions '
+
+
+def get_endpoint(url: str) -> WebhookEndpoint:
+    """
+    Return the health record for a webhook URL, creating it on first use.
+    """
+    endpoint, created = WebhookEndpoint.objects.get_or_create(url=url)
+    return endpoint
+
+
+def webhook_subscription(url: str, city: str) -> SubscribedCity | None:
+    """
+    Return the subscription of a webhook task created before its kwargs carried ``subscription_id``,
+    from the periodic tasks of the webhook named after their subscription.
+    """
+    names = PeriodicTask.objects.filter(task=WEBHOOK_TASK_NAME, name__startswith=WEBHOOK_TASK_PREFIX,
+                                        kwargs__contains=json.dumps(url)).values_list('name', flat=True)
+    ids = [int(name[len(WEBHOOK_TASK_PREFIX):]) for name in names if name[len(WEBHOOK_TASK_PREFIX):].isdigit()]
+    return SubscribedCity.objects.filter(id__in=ids, city__name=city).first()
+
+
+def endpoint_is_blocked(endpoint: WebhookEndpoint) -> bool:
+    """
+    Check, without claiming the half-open probe, whether deliveries to an endpoint are rejected right now.
+    """
+    if endpoint.is_paused:
+        return True
+    if endpoint.state in (WebhookEndpoint.OPEN, WebhookEndpoint.HALF_OPEN):
+        return endpoint.opened_at > timezone.now() - settings.WEBHOOK_RECOVERY_TIMEOUT
+    return False
+
+
+def endpoint_accepts_requests(endpoint: WebhookEndpoint) -> bool:
+    """
+    Check whether the circuit of an endpoint lets a delivery through.
+
+    A closed circuit always does. An open circuit lets exactly one probe through once
+    WEBHOOK_RECOVERY_TIMEOUT has passed: the first caller flips it to half-open and every
+    other caller keeps being rejected until the probe succeeds or fails. A probe that never
+    reports back, e.g. because its worker died, is replaced after another WEBHOOK_RECOVERY_TIMEOUT.
+    Paused endpoints never accept requests.
+    """
+    if endpoint.is_paused:
+        return False
+    if endpoint.state == WebhookEndpoint.CLOSED:
+        return True
+    now = timezone.now()
+    # Claiming the probe restarts the clock, so opened_at of a half-open circuit is when its probe started.
+    probe = WebhookEndpoint.objects.filter(
+        pk=endpoint.pk, state__in=[WebhookEndpoint.OPEN, WebhookEndpoint.HALF_OPEN],
+        opened_at__lte=now - settings.WEBHOOK_RECOVERY_TIMEOUT).update(state=WebhookEndpoint.HALF_OPEN, opened_at=now)
+    if probe:
+        endpoint.state = WebhookEndpoint.HALF_OPEN
+        endpoint.opened_at = now
+        return True
+    return False
+
+
+def record_success(endpoint: WebhookEndpoint) -> None:
+    """
+    Close the circuit of an endpoint after a successful delivery.
+    """
+    WebhookEndpoint.objects.filter(pk=endpoint.pk).update(state=WebhookEndpoint.CLOSED, consecutive_failures=0,
+                                                          failing_since=None, opened_at=None,
+                                                          last_success_at=timezone.now())
+
+
+def record_failure(endpoint: WebhookEndpoint) -> None:
+    """
+    Count a failed delivery and open the circuit once the failure threshold is reached.
+
+    A failed half-open probe reopens the circuit immediately. Endpoints failing for longer
+    than WEBHOOK_AUTO_PAUSE_AFTER are paused together with their periodic tasks.
+    """
+    now = timezone.now()
+    WebhookEndpoint.objects.filter(pk=endpoint.pk).update(consecutive_failures=F('consecutive_failures') + 1)
+    WebhookEndpoint.objects.filter(pk=endpoint.pk, failing_since__isnull=True).update(failing_since=now)
+    endpoint.refresh_from_db()
+    if endpoint.state == WebhookEndpoint.HALF_OPEN or \
+            endpoint.consecutive_failures >= settings.WEBHOOK_FAILURE_THRESHOLD:
+        endpoint.state = WebhookEndpoint.OPEN
+        endpoint.opened_at = now
+        endpoint.save(update_fields=['state', 'opened_at'])
+        logger.warning(f'Circuit opened for webhook {endpoint.url} after {endpoint.consecutive_failures} failures')
+    if endpoint.failing_since <= now - settings.WEBHOOK_AUTO_PAUSE_AFTER:
+        set_endpoint_paused(endpoint, True)
+
+
+def set_endpoint_paused(endpoint: WebhookEndpoint, paused: bool) -> None:
+    """
+    Pause or resume an endpoint and the periodic tasks delivering to it.
+
+    Resuming also resets the circuit so the next delivery is attempted right away.
+    """
+    if paused:
+        logger.warning(f'Pausing webhook {endpoint.url}, failing since {endpoint.failing_since}')
+        WebhookEndpoint.objects.filter(pk=endpoint.pk).update(is_paused=True)
+    else:
+        WebhookEndpoint.objects.filter(pk=endpoint.pk).update(is_paused=False, state=WebhookEndpoint.CLOSED,
+                                                              consecutive_failures=0, failing_since=None,
+                                                              opened_at=None)
+    endpoint.refresh_from_db()
+    url_kwarg = json.dumps({'webhook_url': endpoint.url})[1:-1]
+    if PeriodicTask.objects.filter(task=WEBHOOK_TASK_NAME, kwargs__contains=url_kwarg).update(enabled=not paused):
+        # Queryset updates bypass the signals beat relies on to reload its schedule.
+        PeriodicTasks.update_changed()
+
+
+def post_webhook(url: str, payload: dict) -> None:
+    """
+    POST a payload to a webhook URL.
+
+    Raises:
+        requests.RequestException: If the endpoint can not be reached, times out
+        or answers with a non-2xx status code.
+    """
+    response = requests.post(url, json=payload, timeout=settings.WEBHOOK_TIMEOUT)
+    response.raise_for_status()
+
+
+def deliver_webhook(url: str, payload: dict, dead_letter: WebhookDeadLetter | None = None) -> bool:
+    """
+    Deliver a payload to a webhook URL through the endpoint's circuit breaker.
+
+    :param url: The webhook URL.
+    :param payload: The JSON payload to send.
+    :param dead_letter: The dead letter being replayed, if any.
+    :return: True if the payload was delivered, False otherwise.
+
+    Payloads which can not be delivered, either because the circuit is open or because the
+    request failed, are stored in the dead-letter table. A replayed dead letter is updated
+    in place instead of being duplicated.
+    """
+    endpoint = get_endpoint(url)
+    if not endpoint_accepts_requests(endpoint):
+        error = 'Endpoint paused' if endpoint.is_paused else 'Circuit open'
+        _store_dead_letter(endpoint, payload, error, dead_letter)
+        return False
+    try:
+        post_webhook(url, payload)
+    except requests.RequestException as e:
+        logger.error(f'Error sending webhook notification to {url}: {str(e)}')
+        record_failure(endpoint)
+        _store_dead_letter(endpoint, payload, str(e), dead_letter)
+        return False
+    record_success(endpoint)
+    if dead_letter is not None:
+        dead_letter.replayed_at = timezone.now()
+        dead_letter.save(update_fields=['replayed_at'])
+    logger.info(f'Webhook notification sent to {url}')
+    return True
+
+
+def replay_dead_letters(endpoint: WebhookEndpoint, limit: int | None = None) -> tuple[int, int]:
+    """
+    Redeliver the pending dead letters of an endpoint, oldest first.
+
+    Stops at the first failure so a still broken endpoint is not hammered.
+
+    :return: A tuple with the number of delivered and failed dead letters.
+    """
+    pending = endpoint.dead_letters.filter(replayed_at__isnull=True).order_by('created_at')
+    if limit:
+        pending = pending[:limit]
+    delivered = 0
+    for dead_letter in pending:
+        if not deliver_webhook(endpoint.url, dead_letter.payload, dead_letter=dead_letter):
+            return delivered, 1
+        delivered += 1
+    return delivered, 0
+
+
+def _store_dead_letter(endpoint: WebhookEndpoint, payload: dict, error: str,
+                       dead_letter: WebhookDeadLetter | None) -> None:
+    if dead_letter is None:
+        WebhookDeadLetter.objects.create(endpoint=endpoint, payload=payload, error=error)
+    else:
+        dead_letter.error = error
+        dead_letter.attempts = F('attempts') + 1
+        dead_letter.save(update_fields=['error', 'attempts'])
+        dead_letter.refresh_from_db(fields=['attempts'])